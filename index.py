@@ -37,7 +37,15 @@ import manifest from './lib/manifest'
 import semver from './lib/semver'
 import refstring from './lib/refstring'
 import logger from './lib/logger'
+import _bundle from './lib/bundle'
+import _bytecode from './lib/bytecode'
+import _cache_export from './lib/cache-export'
 import _install from './lib/install'
+import _snapshot from './lib/snapshot'
+import _dedupe from './lib/dedupe'
+import _verify from './lib/verify'
+import _fetch from './lib/fetch'
+import fingerprint from './lib/fingerprint'
 import {RegistryClient} from './lib/registry'
 import PackageLifecycle from './lib/package-lifecycle'
 import env, {PACKAGE_MANIFEST} from './lib/env'
@@ -117,7 +125,14 @@ def create_installer(args):
     pip_separate_process=args.pip_separate_process,
     pip_use_target_option=args.pip_use_target_option,
     recursive=args.recursive,
-    verbose=args.verbose
+    verbose=args.verbose,
+    jobs=args.jobs,
+    optional_timeout=args.optional_timeout,
+    prefer=args.prefer,
+    offline=args.offline,
+    dedupe=args.dedupe,
+    placement=args.placement,
+    precompile=args.precompile
   )
   installer.ignore_installed = args.pip_ignore_installed
   return installer
@@ -221,6 +236,10 @@ install_parser.add_argument('-R', '--recursive', action='store_true',
     'used when packages where uninstall that may still be required by '
     'other packages. Attempts to dependencies of already satisfied '
     'dependencies.')
+install_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of threads to use for parallelizable work, such as '
+    'checking dependencies with --recursive. Defaults to the number of '
+    'CPUs plus four (at most 32).')
 install_parser.add_argument('--dev', action='store_true',
   help='Install development dependencies or not. By default, development '
     'dependencies are only installed for the current package.')
@@ -236,7 +255,8 @@ install_parser.add_argument('--save-ext', action='store_true',
   help='Add the installed Node.py packages to the "extensions" field. '
     'This option implies --save.')
 install_parser.add_argument('-v', '--verbose', action='count',
-  help='Enable verbose output for nppm and Pip.')
+  help='Enable verbose output for nppm and Pip. Also reports the time spent '
+    'in every stage of the installation.')
 install_parser.add_argument('--internal', action='store_true', default=None,
   help='Install the specified Node.py packages as internal dependencies. '
     'This flag has no immediate effect on local install, but the --internal '
@@ -247,6 +267,47 @@ install_parser.add_argument('--no-internal', action='store_true',
     'and --global installations.')
 install_parser.add_argument('--pure', action='store_true',
   help='Install Node.py packages without their command-line scripts.')
+install_parser.add_argument('--optional-timeout', type=float, metavar='SECONDS',
+  help='Optional dependencies are installed after all required dependencies. '
+    'Skip the optional dependencies that were not started within this many '
+    'seconds. Pass 0 to skip optional dependencies entirely.')
+install_parser.add_argument('--prefer-installed', dest='prefer',
+  action='store_const', const='installed',
+  help='Among the versions that satisfy a dependency, prefer versions that '
+    'are already installed (also in other install locations, even with '
+    '--upgrade) or in the local archive cache over the newest version.')
+install_parser.add_argument('--prefer-cached', dest='prefer',
+  action='store_const', const='cached',
+  help='Among the versions that satisfy a dependency, prefer the newest '
+    'version in the local archive cache over the newest version in the '
+    'registry.')
+install_parser.add_argument('--offline', action='store_true',
+  help='Do not access the network. Packages are installed from the local '
+    'caches only, which can be filled with `nppm fetch`.')
+install_parser.add_argument('--dedupe', action='store_true',
+  help='Install internal dependencies only once per version into the store '
+    'in the packages directory and link them into the modules directory of '
+    'the packages that require them. See also `nppm dedupe`.')
+install_parser.add_argument('--placement', choices=('auto', 'hardlink', 'reflink', 'symlink', 'copy'),
+  help='How to place the files of registry packages from the content store '
+    'in the cache directory. Defaults to the install.placement option or '
+    '"auto" (hardlink, reflink or copy, whichever works first).')
+install_parser.add_argument('--precompile', action='store_true', default=None,
+  help='Compile the Python files of the installed packages and Pip '
+    'libraries to bytecode after the installation, using one process per '
+    'CPU. Defaults to the install.precompile option, which in turn defaults '
+    'to on with --production.')
+install_parser.add_argument('--no-precompile', dest='precompile', action='store_false',
+  help='Do not compile the installed files to bytecode ahead of time.')
+install_parser.add_argument('--workspace', action='store_true',
+  help='Install the current package and all packages listed in its '
+    '"workspaces" field together. The packages are linked to each other and '
+    'their dependencies are resolved as one set, installing shared '
+    'dependencies once and all Pip dependencies in a single Pip run.')
+install_parser.add_argument('-f', '--force', action='store_true',
+  help='When installing the dependencies of the current package, do not '
+    'skip the installation if nothing changed since the last successful '
+    'run.')
 
 uninstall_parser = subparsers.add_parser('uninstall')
 uninstall_parser.add_argument('packages', nargs='+',
@@ -258,6 +319,102 @@ uninstall_parser.add_argument('--root', action='store_true',
 uninstall_parser.add_argument('--system', action='store_true',
   help='Alias for --root.')
 
+fetch_parser = subparsers.add_parser('fetch')
+fetch_parser.add_argument('-p', '--packagedir',
+  help='The package directory. Defaults to the current working directory.')
+fetch_parser.add_argument('--production', action='store_true',
+  help='Do not fetch development dependencies.')
+fetch_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of packages to fetch concurrently.')
+fetch_parser.add_argument('--no-pip', action='store_true',
+  help='Do not download the Pip dependencies.')
+
+dedupe_parser = subparsers.add_parser('dedupe')
+dedupe_parser.add_argument('-g', '--global', dest='global_', action='store_true',
+  help='Deduplicate the global package directory.')
+dedupe_parser.add_argument('--root', action='store_true',
+  help='Deduplicate the system-wide package directory.')
+dedupe_parser.add_argument('--system', action='store_true',
+  help='Alias for --root.')
+dedupe_parser.add_argument('--dry', action='store_true',
+  help='Only report what would be done.')
+
+verify_parser = subparsers.add_parser('verify')
+verify_parser.add_argument('-g', '--global', dest='global_', action='store_true',
+  help='Verify the global package directory.')
+verify_parser.add_argument('--root', action='store_true',
+  help='Verify the system-wide package directory.')
+verify_parser.add_argument('--system', action='store_true',
+  help='Alias for --root.')
+verify_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of files to hash concurrently.')
+verify_parser.add_argument('--fast', action='store_true',
+  help='Do not hash files that have the recorded size and were not '
+    'modified after the package was installed.')
+verify_parser.add_argument('--deps', action='store_true',
+  help='Also check that the dependencies of the installed packages are '
+    'installed in versions that satisfy their requirements.')
+
+bundle_parser = subparsers.add_parser('bundle')
+bundle_parser.add_argument('-o', '--output', required=True, metavar='FILE',
+  help='The bundle to create. Its extension selects the compression: '
+    '.tar.zst (requires the zstandard module), .tar.gz, .tar.xz or .tar.')
+bundle_parser.add_argument('--packagedir', metavar='DIR',
+  help='The directory of the package to bundle. Defaults to the current '
+    'working directory.')
+bundle_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of threads to use for the installation.')
+bundle_parser.add_argument('--offline', action='store_true',
+  help='Do not access the network, install from the local caches only.')
+bundle_parser.add_argument('--no-precompile', dest='precompile', action='store_false',
+  default=None, help='Do not include the bytecode of the Python files. '
+    'Defaults to the install.precompile option, or to include it.')
+
+unbundle_parser = subparsers.add_parser('unbundle')
+unbundle_parser.add_argument('bundle',
+  help='The bundle created with `nppm bundle` to unpack.')
+unbundle_parser.add_argument('-C', '--directory', default='.', metavar='DIR',
+  help='The directory to unpack the bundle into. Defaults to the current '
+    'working directory.')
+unbundle_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of threads that write the unpacked files.')
+
+snapshot_parser = subparsers.add_parser('snapshot')
+snapshot_parser.add_argument('action', choices=('save', 'restore'),
+  help='Save the dependencies installed in the current working directory '
+    'as a snapshot in the cache directory, or restore them from there. '
+    'Snapshots are keyed by the manifest, the interpreter and the platform.')
+snapshot_parser.add_argument('--packagedir', metavar='DIR',
+  help='The directory of the package whose dependencies are installed. '
+    'Defaults to the current working directory.')
+snapshot_parser.add_argument('--production', action='store_true',
+  help='The snapshot is of an installation without development '
+    'dependencies.')
+snapshot_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of threads that write the restored files.')
+
+cache_parser = subparsers.add_parser('cache')
+cache_parser.add_argument('action', choices=('export', 'import'),
+  help='Write the package archives, the content store, the Git mirrors, '
+    'the Pip distributions and the install history in the cache directory '
+    'to one archive, or unpack such an archive into the cache directory '
+    '(keeping the files that are already cached).')
+cache_parser.add_argument('file',
+  help='The archive to write or read. Its extension selects the '
+    'compression: .tar.zst (requires the zstandard module), .tar.gz, '
+    '.tar.xz or .tar.')
+cache_parser.add_argument('--installed', action='store_true',
+  help='Only export what the installed packages and Pip libraries use '
+    '(Git mirrors are not exported).')
+cache_parser.add_argument('-g', '--global', dest='global_', action='store_true',
+  help='Use the packages installed globally with --installed.')
+cache_parser.add_argument('--root', action='store_true',
+  help='Use the packages installed system-wide with --installed.')
+cache_parser.add_argument('--system', action='store_true',
+  help='Alias for --root.')
+cache_parser.add_argument('-j', '--jobs', type=int, metavar='N',
+  help='The number of threads that write the imported files.')
+
 dist_parser = subparsers.add_parser('dist')
 
 bin_parser = subparsers.add_parser('bin')
@@ -334,22 +491,70 @@ def do_install(args):
 
   pure_install = (not args.packages and not args.develop and not args.pip)
 
+  # Collect the members of the workspace.
+  workspace = None
+  if args.workspace:
+    if not pure_install:
+      fatal('--workspace can not be combined with packages to install')
+    if manifest_data is None:
+      fatal('--workspace requires a {}'.format(PACKAGE_MANIFEST))
+    workspace = _install.find_workspace_members(manifest_data)
+    if workspace is None:
+      fatal('{} has no "workspaces" field'.format(manifest_filename))
+
+  if args.precompile is None:
+    args.precompile = _bytecode.get_precompile_option(args.production)
+
   # Default to --dev if no packages are specified.
   if (not args.dev and not args.production):
     args.dev = pure_install
     args.production = not args.dev
 
+  # If nothing changed since the last successful installation of the
+  # current package's dependencies, there is nothing to do.
+  if pure_install and manifest_data is not None:
+    location = get_install_location(args.global_, args.root)
+    dirs = env.get_directories(location)
+    state_file = os.path.join(dirs['packages'], fingerprint.STATE_FILE)
+    state_options = {'version': __version__, 'location': location,
+      'dev': args.dev, 'recursive': args.recursive, 'internal': args.internal,
+      'pure': args.pure, 'optional_timeout': args.optional_timeout,
+      'prefer': args.prefer, 'workspace': workspace, 'offline': args.offline,
+      'dedupe': args.dedupe, 'placement': args.placement,
+      'precompile': args.precompile,
+      'pip_ignore_installed': args.pip_ignore_installed,
+      'pip_separate_process': args.pip_separate_process,
+      'pip_use_target_option': args.pip_use_target_option}
+    state = fingerprint.compute(manifest_filename, dirs, state_options)
+    if not args.force and state and state == fingerprint.load(state_file):
+      print('Dependencies of "{}" are up to date.'.format(args.packagedir))
+      return 0
+
   installer = create_installer(args)
 
   # If no packages to install are specified, install the dependencies of the
   # current packages. Imply --upgrade and --develop.
   if pure_install:
     installer.upgrade = True
-    success, _manifest = installer.install_from_directory(
-        args.packagedir, develop=True, dev=args.dev)
+    if workspace is not None:
+      members = [load_manifest(os.path.join(path, PACKAGE_MANIFEST)) for path in workspace]
+      success = installer.install_workspace(manifest_data, members, dev=args.dev)
+    else:
+      success, _manifest = installer.install_from_directory(
+          args.packagedir, develop=True, dev=args.dev)
     if not success:
       return 1
+    optional_success = installer.install_deferred()
     installer.relink_pip_scripts()
+    installer.precompile_installed()
+    installer.scheduler.history.save()
+    if args.verbose:
+      installer.stats.report()
+      installer.scheduler.report()
+    if manifest_data is not None and optional_success:
+      state = fingerprint.compute(manifest_filename, dirs, state_options)
+      if state:
+        fingerprint.save(state_file, state)
     return 0
 
   # Parse the requirements from the command-line.
@@ -399,7 +604,13 @@ def do_install(args):
     if req.type == 'registry':
       req.selector = semver.Selector('~' + str(info[1]))
 
+  installer.install_deferred()
   installer.relink_pip_scripts()
+  installer.precompile_installed()
+  installer.scheduler.history.save()
+  if args.verbose:
+    installer.stats.report()
+    installer.scheduler.report()
 
   # Insert extensions.
   if args.save_ext and npy_packages:
@@ -448,6 +659,21 @@ def do_install(args):
   print()
 
 
+def do_fetch(args):
+  manifest_filename = os.path.join(args.packagedir or '.', PACKAGE_MANIFEST)
+  if not os.path.isfile(manifest_filename):
+    fatal('{} not found'.format(manifest_filename))
+  manifest_data = load_manifest(manifest_filename)
+
+  installer = _install.Installer(upgrade=True, jobs=args.jobs)
+  fetcher = _fetch.Fetcher(installer, pip=not args.no_pip)
+  if not fetcher.fetch(manifest_data, dev=not args.production):
+    return 1
+  print('Fetched the dependencies of "{}". Use `nppm install --offline` to '
+    'install them.'.format(manifest_data.identifier))
+  return 0
+
+
 def do_uninstall(args):
   packages = []
   for pkg in args.packages:
@@ -463,6 +689,67 @@ def do_uninstall(args):
     installer.uninstall(pkg)
 
 
+def do_dedupe(args):
+  location = get_install_location(args.global_, args.root or args.system)
+  installer = _install.Installer(install_location=location)
+  freed = _dedupe.dedupe(installer, dry=args.dry)
+  print('{} {:.1f} MiB.'.format('Would free' if args.dry else 'Freed',
+    freed / 1024.0 / 1024.0))
+  return 0
+
+
+def do_verify(args):
+  location = get_install_location(args.global_, args.root or args.system)
+  installer = _install.Installer(install_location=location)
+  verified, unrecorded, failed = _verify.verify(installer, jobs=args.jobs, fast=args.fast)
+  print('Verified {} package(s), {} do not match, {} have no record.'.format(
+    verified, failed, unrecorded))
+  if args.deps:
+    unsatisfied = _verify.verify_dependencies(installer)
+    print('{} unsatisfied dependencies.'.format(unsatisfied))
+    failed += unsatisfied
+  return 1 if failed else 0
+
+
+def do_bundle(args):
+  filename = os.path.join(args.packagedir or '.', PACKAGE_MANIFEST)
+  if not os.path.isfile(filename):
+    fatal('{} not found'.format(filename))
+  if args.precompile is None:
+    args.precompile = _bytecode.get_precompile_option(True)
+  success = _bundle.bundle(load_manifest(filename), args.output, jobs=args.jobs,
+      precompile=args.precompile, offline=args.offline)
+  return 0 if success else 1
+
+
+def do_unbundle(args):
+  return 0 if _bundle.unbundle(args.bundle, args.directory, jobs=args.jobs) else 1
+
+
+def do_snapshot(args):
+  filename = os.path.join(args.packagedir or '.', PACKAGE_MANIFEST)
+  if not os.path.isfile(filename):
+    fatal('{} not found'.format(filename))
+  manifest_data = load_manifest(filename)
+  if args.action == 'save':
+    success = _snapshot.save(manifest_data, dev=not args.production)
+  else:
+    success = _snapshot.restore(manifest_data, dev=not args.production, jobs=args.jobs)
+  return 0 if success else 1
+
+
+def do_cache(args):
+  if args.action == 'export':
+    installer = None
+    if args.installed:
+      location = get_install_location(args.global_, args.root or args.system)
+      installer = _install.Installer(install_location=location)
+    success = _cache_export.export_cache(args.file, installer)
+  else:
+    success = _cache_export.import_cache(args.file, jobs=args.jobs)
+  return 0 if success else 1
+
+
 def do_dist(args):
   PackageLifecycle().dist()
 
@@ -34,9 +34,13 @@ from six.moves import configparser
 import contextlib
 import os
 import sys
+import threading
 
 import { is_virtualenv } from './env'
 
+# The configuration file is shared by all threads of the process.
+_lock = threading.RLock()
+
 
 @contextlib.contextmanager
 def brewfix(prefix_dir='', force=False):
@@ -45,29 +49,30 @@ def brewfix(prefix_dir='', force=False):
       yield
       return
 
-  print("Note: macOS detected, applying homebrew fix (see nodepy/ppym#9)")
-  print("      [install] prefix={}".format(prefix_dir))
-  filename = os.path.expanduser('~/.pydistutils.cfg')
-  backupfile = filename + '.nppm-backup'
-  parser = configparser.SafeConfigParser()
+  with _lock:
+    print("Note: macOS detected, applying homebrew fix (see nodepy/ppym#9)")
+    print("      [install] prefix={}".format(prefix_dir))
+    filename = os.path.expanduser('~/.pydistutils.cfg')
+    backupfile = filename + '.nppm-backup'
+    parser = configparser.SafeConfigParser()
 
-  if os.path.isfile(filename):
-    parser.read([filename])
-    os.rename(filename, backupfile)
+    if os.path.isfile(filename):
+      parser.read([filename])
+      os.rename(filename, backupfile)
 
-  if not parser.has_section('install'):
-    parser.add_section('install')
+    if not parser.has_section('install'):
+      parser.add_section('install')
 
-  parser.set('install', 'prefix', prefix_dir)
-  with open(filename, 'w') as fp:
-    parser.write(fp)
+    parser.set('install', 'prefix', prefix_dir)
+    with open(filename, 'w') as fp:
+      parser.write(fp)
 
-  try:
-    yield
-  finally:
-    os.remove(filename)
-    if os.path.isfile(backupfile):
-      os.rename(backupfile, filename)
+    try:
+      yield
+    finally:
+      os.remove(filename)
+      if os.path.isfile(backupfile):
+        os.rename(backupfile, filename)
 
 
 module.exports = brewfix
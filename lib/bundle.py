@@ -0,0 +1,289 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Implements `nppm bundle` and `nppm unbundle`. A bundle is a single archive
+of a package together with its installed production dependencies: the
+Node.py packages in the modules directory and the Pip libraries and scripts
+in the `.nodepy/` directory. Unpacking a bundle on a machine with the same
+Python version and platform replaces an installation with one sequential
+read of one file.
+
+Bundles are deterministic: the members are sorted and have the same
+timestamp, owner and normalized permissions. The first member records the
+directory and the interpreter that the dependencies were installed with,
+which are replaced in the generated scripts and link files when the bundle
+is unpacked.
+"""
+
+from __future__ import print_function
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+
+import _bytecode from './bytecode'
+import _install from './install'
+import env from './env'
+import _archive from './util/archive'
+import fileops from './util/fileops'
+
+#: The name of the first member of a bundle, which describes the bundle.
+BUNDLE_INFO = '.nppm-bundle.json'
+
+#: The timestamp of all files in a bundle, which can be overridden with the
+#: `SOURCE_DATE_EPOCH` environment variable (the default is 1980-01-01).
+BUNDLE_MTIME = int(os.getenv('SOURCE_DATE_EPOCH', 315532800))
+
+@contextlib.contextmanager
+def _chdir(directory):
+  cwd = os.getcwd()
+  os.chdir(directory)
+  try:
+    yield
+  finally:
+    os.chdir(cwd)
+
+
+def _is_temporary(name):
+  """
+  Returns True for the lock files and the temporary directories that the
+  #Installer keeps in the packages directory.
+  """
+
+  return name == _install.LOCK_DIRECTORY or (name.startswith('.') and
+      (name.endswith('.lock') or name.startswith(('.tmp-', '.trash-'))))
+
+
+def bundle(manifest, output, jobs=None, precompile=True, offline=False):
+  """
+  Installs the production dependencies of the package *manifest* into a
+  staging directory next to *output* and writes the package, its
+  dependencies and their scripts to the bundle *output*. The compression
+  of the bundle is chosen by the extension of *output* (see
+  #archive.COMPRESSIONS). With *precompile*, the Python files are compiled to
+  bytecode, which is included in the bundle.
+
+  Note that the bundle contains the absolute path of the staging directory
+  and of the interpreter, thus the same bundle is only created again from
+  the same directory with the same interpreter.
+
+  Returns True on success, False if the installation failed.
+  """
+
+  try:
+    _archive.get_compression(output)
+  except ValueError as exc:
+    print('Error: {}'.format(exc))
+    return False
+
+  output = os.path.abspath(output)
+  staging = os.path.join(os.path.dirname(output), '.' + os.path.basename(output) + '.staging')
+  if os.path.exists(staging):
+    shutil.rmtree(staging)
+  os.makedirs(staging)
+  try:
+    # The output may be inside of the package directory, thus the bundle
+    # itself, its temporary file and the staging directory are left out.
+    skip = set(os.path.normcase(x) for x in (output, output + '.part'))
+    def included(filename):
+      path = os.path.normcase(os.path.abspath(filename))
+      return path not in skip and not path.startswith(os.path.normcase(staging) + os.sep)
+    files = (x for x in _install.walk_package_files(manifest) if included(x[0]))
+    print('Copying "{}" to "{}" ...'.format(manifest.identifier, staging))
+    fileops.copy_files(files, staging, jobs=jobs)
+
+    # The local install location is relative to the working directory. The
+    # files are copied from the store so that their timestamps can be set.
+    with _chdir(staging):
+      installer = _install.Installer(upgrade=True, jobs=jobs, offline=offline,
+          placement='copy')
+      if not installer.install_dependencies_for(manifest, dev=False):
+        return False
+      installer.install_deferred()
+      installer.relink_pip_scripts()
+      installer.scheduler.history.save()
+      bin_dirs = sorted(set(os.path.normpath(installer.dirs[x]) for x in ('bin', 'pip_bin')))
+
+    info, files = describe(staging, manifest, bin_dirs)
+    for rel in info['links']:
+      with open(os.path.join(staging, *rel.split('/'))) as fp:
+        target = os.path.abspath(fp.read().rstrip('\n'))
+      if not target.startswith(staging + os.sep):
+        print('Warning: "{}" links to "{}", which is not part of the bundle'.format(rel, target))
+
+    # The timestamps are set before the files are compiled, as the bytecode
+    # records the timestamp of its source file.
+    for path in files:
+      if not os.path.islink(path):
+        os.utime(path, (BUNDLE_MTIME, BUNDLE_MTIME))
+    if precompile:
+      print('Compiling Python files to bytecode...')
+      compiled, failed, fresh = _bytecode.compile_files(
+          (x for x in files if x.endswith('.py')), jobs)
+      print('  Compiled {} files ({} left to compile on import)'.format(compiled, failed))
+
+    print('Creating bundle "{}" ...'.format(output))
+    count = write_bundle(staging, output, info)
+    print('  Added {} files.'.format(count))
+  finally:
+    shutil.rmtree(staging, ignore_errors=True)
+  return True
+
+
+def describe(directory, manifest, bin_dirs, paths=None):
+  """
+  Creates the description of a bundle of *directory* (or of the relative
+  *paths* in it) with the dependencies of the package *manifest*.
+  *bin_dirs* are the relative directories that contain scripts.
+
+  # Returns
+  A tuple of the description, which becomes the first member of the
+  bundle, and the list of the files (not directories) to bundle.
+  """
+
+  info = {
+    'name': manifest['name'],
+    'version': str(manifest['version']),
+    'root': directory,
+    'python': sys.executable,
+    'python_version': '{}.{}'.format(*sys.version_info[:2]),
+    'platform': sys.platform,
+    'scripts': [],
+    'links': []
+  }
+  files = []
+  for rel in _archive.walk(directory, paths, _is_temporary):
+    path = os.path.join(directory, *rel.split('/'))
+    if os.path.isdir(path) and not os.path.islink(path):
+      continue
+    files.append(path)
+    if rel.endswith(env.LINK_SUFFIX):
+      info['links'].append(rel)
+    elif any(rel.startswith(x.replace(os.sep, '/') + '/') for x in bin_dirs):
+      info['scripts'].append(rel)
+  return info, files
+
+
+def write_bundle(directory, output, info, paths=None, mtime=BUNDLE_MTIME):
+  """
+  Writes the *info* (see #describe()) and the contents of *directory* (or
+  of the relative *paths* in it) to the bundle *output*. All members get
+  the timestamp *mtime*, or keep their own if it is #None.
+
+  Returns the number of files that were added.
+  """
+
+  tmp = output + '.part'
+  with _archive.open_compressed(tmp, 'w', _archive.get_compression(output)) as stream:
+    archive = tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT)
+    data = json.dumps(info, sort_keys=True).encode('utf8')
+    member = _archive.tarinfo(BUNDLE_INFO, size=len(data),
+        mtime=BUNDLE_MTIME if mtime is None else mtime)
+    archive.addfile(member, io.BytesIO(data))
+    count = _archive.add_files(archive, directory,
+        _archive.walk(directory, paths, _is_temporary), mtime)
+    archive.close()
+  if os.name == 'nt' and os.path.isfile(output):
+    os.remove(output)
+  os.rename(tmp, output)
+  return count
+
+
+def unbundle(filename, directory='.', jobs=None):
+  """
+  Unpacks the bundle *filename* into *directory*. The archive is read
+  sequentially while up to *jobs* threads write the files. Afterwards, the
+  directory and interpreter that the bundle was created with are replaced
+  in its scripts and link files.
+
+  Returns True on success, False if *filename* is not a bundle.
+  """
+
+  try:
+    compression = _archive.get_compression(filename)
+  except ValueError as exc:
+    print('Error: {}'.format(exc))
+    return False
+
+  directory = os.path.abspath(directory)
+  with _archive.open_compressed(filename, 'r', compression) as stream:
+    archive = tarfile.open(fileobj=stream, mode='r|')
+    member = archive.next()
+    if member is None or member.name != BUNDLE_INFO:
+      print('Error: "{}" is not a bundle'.format(filename))
+      return False
+    info = json.loads(archive.extractfile(member).read().decode('utf8'))
+    print('Unpacking "{}@{}" to "{}" ...'.format(info['name'], info['version'], directory))
+    python_version = '{}.{}'.format(*sys.version_info[:2])
+    if (info['python_version'], info['platform']) != (python_version, sys.platform):
+      print('Warning: the bundle was created with Python {} on {}, this is '
+          'Python {} on {}'.format(info['python_version'], info['platform'],
+          python_version, sys.platform))
+    members = (x for x in archive if x.name != BUNDLE_INFO)
+    count = _archive.extract(archive, _install.check_archive_members(members, directory),
+        directory, jobs)
+  print('  Unpacked {} files.'.format(count))
+
+  replacements = [(info['root'], directory)]
+  if info['python'] != sys.executable:
+    replacements.append((info['python'], sys.executable))
+  for rel in info['scripts'] + info['links']:
+    _replace_paths(os.path.join(directory, *rel.split('/')), replacements)
+  return True
+
+
+def _remove(path):
+  if os.path.lexists(path) and not os.path.isdir(path):
+    os.remove(path)
+
+
+def _replace_paths(filename, replacements):
+  """
+  Replaces the `(old, new)` path *replacements* in the text file *filename*,
+  also where they are escaped as in a Python string literal. Binary files
+  (eg. the launchers that #distlib creates on Windows) are skipped with a
+  warning.
+  """
+
+  encoding = sys.getfilesystemencoding() or 'utf8'
+  with open(filename, 'rb') as fp:
+    data = fp.read()
+  if b'\0' in data:
+    print('Warning: can not update the paths in binary file "{}"'.format(filename))
+    return
+  new_data = data
+  for old, new in replacements:
+    for escape in (lambda x: x, lambda x: x.replace('\\', '\\\\')):
+      new_data = new_data.replace(escape(old).encode(encoding), escape(new).encode(encoding))
+  if new_data != data:
+    mode = stat.S_IMODE(os.stat(filename).st_mode)
+    _remove(filename)
+    with open(filename, 'wb') as fp:
+      fp.write(new_data)
+    os.chmod(filename, mode)
@@ -0,0 +1,58 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import json
+import os
+import shutil
+import tempfile
+import _bundle from './bundle'
+import manifest from './manifest'
+import { PACKAGE_MANIFEST } from './env'
+
+
+def test_bundle_twice():
+  directory = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  try:
+    package = os.path.join(directory, 'app')
+    os.makedirs(package)
+    with open(os.path.join(package, PACKAGE_MANIFEST), 'w') as fp:
+      json.dump({'name': 'app', 'version': '1.0.0'}, fp)
+    with open(os.path.join(package, 'index.py'), 'w') as fp:
+      fp.write('print("hello")\n')
+    os.chdir(package)
+
+    # The bundle is written into the package directory, thus the second
+    # bundle must not contain the first one.
+    output = os.path.join(package, 'app.tar.gz')
+    mf = manifest.load(os.path.join(package, PACKAGE_MANIFEST))
+    assert_true(_bundle.bundle(mf, output, precompile=False, offline=True))
+    with open(output, 'rb') as fp:
+      first = fp.read()
+    assert_true(_bundle.bundle(mf, output, precompile=False, offline=True))
+    with open(output, 'rb') as fp:
+      assert_equals(fp.read(), first)
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(directory, ignore_errors=True)
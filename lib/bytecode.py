@@ -0,0 +1,135 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Compiles the Python files of installed packages to bytecode ahead of time,
+so that they do not need to be compiled when they are first imported (which
+silently fails on read-only filesystems). Compiling is bound by the CPU,
+thus the files are handed to a number of `python -m compileall` processes.
+"""
+
+import os
+import subprocess
+import sys
+
+import env from './env'
+import pool from './util/pool'
+
+try:
+  from importlib.util import cache_from_source
+except ImportError:
+  def cache_from_source(filename):
+    return filename + 'c'
+
+#: The maximum number of files that are passed to one compileall process.
+CHUNK_SIZE = 200
+
+
+def get_precompile_option(default=False):
+  """
+  Returns the value of the `install.precompile` option, or *default* if it
+  is not set.
+  """
+
+  try:
+    value = require.context.config['install.precompile']
+  except KeyError:
+    return default
+  return str(value).strip().lower() in ('yes', 'on', 'true', '1')
+
+
+def source_files(directory):
+  """
+  Yields the `.py` files in *directory*. The modules directory of the
+  package (which can be nested, eg. `.nodepy/modules`) is not entered, as
+  the packages in there are compiled on their own when they are installed.
+  """
+
+  modules = os.path.normpath(env.MODULES_DIRECTORY)
+  for root, dirs, files in os.walk(directory):
+    parent = os.path.relpath(root, directory)
+    dirs[:] = [x for x in dirs if x != '__pycache__' and
+               os.path.normpath(os.path.join(parent, x)) != modules]
+    for name in files:
+      if name.endswith('.py'):
+        yield os.path.join(root, name)
+
+
+def is_stale(filename):
+  """
+  Returns True if there is no bytecode for *filename* that is at least as
+  recent as the file itself.
+  """
+
+  try:
+    return os.path.getmtime(cache_from_source(filename)) < os.path.getmtime(filename)
+  except OSError:
+    return True
+
+
+def cached_files(files):
+  """
+  Given *files*, an iterable of `(abspath, relpath)` tuples, yields the
+  same kind of tuples for the bytecode of the Python files among them that
+  is up to date. This is used to keep the bytecode of unchanged files when
+  a package is upgraded.
+  """
+
+  for filename, rel in files:
+    if filename.endswith('.py') and not is_stale(filename):
+      cfile = cache_from_source(filename)
+      yield cfile, os.path.join(os.path.dirname(rel),
+          os.path.relpath(cfile, os.path.dirname(filename)))
+
+
+def compile_files(filenames, jobs=None):
+  """
+  Compiles the *filenames* that are stale (see #is_stale()) using up to
+  *jobs* processes, which defaults to the number of CPUs. Files that can
+  not be compiled, eg. because they use the import syntax of Node.py, are
+  left to be compiled when they are imported.
+
+  # Returns
+  A tuple `(compiled, failed, fresh)` with the number of files that were
+  compiled, that could not be compiled and that were already up to date.
+  """
+
+  filenames = list(filenames)
+  stale = [x for x in filenames if is_stale(x)]
+  if not stale:
+    return 0, 0, len(filenames)
+
+  if jobs is None:
+    jobs = pool.cpu_count()
+  size = min(CHUNK_SIZE, (len(stale) + jobs - 1) // jobs)
+  chunks = [stale[i:i+size] for i in range(0, len(stale), size)]
+
+  def run(chunk):
+    # Errors are counted below instead, compileall reports them on stdout.
+    with open(os.devnull, 'w') as devnull:
+      subprocess.call([sys.executable, '-m', 'compileall', '-q', '-f'] + chunk,
+          stdout=devnull, stderr=devnull)
+
+  pool.map_threaded(run, chunks, jobs)
+  failed = sum(1 for x in stale if is_stale(x))
+  return len(stale) - failed, failed, len(filenames) - len(stale)
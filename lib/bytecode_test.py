@@ -0,0 +1,55 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import os
+import shutil
+import tempfile
+import bytecode from './bytecode'
+import env from './env'
+
+
+def test_compile_files():
+  directory = tempfile.mkdtemp()
+  try:
+    good = os.path.join(directory, 'good.py')
+    bad = os.path.join(directory, 'bad.py')
+    nested = os.path.join(directory, env.MODULES_DIRECTORY, 'dep', 'index.py')
+    os.makedirs(os.path.dirname(nested))
+    for filename, code in [(good, 'x = 1\n'), (bad, 'import x from "./x"\n'), (nested, '')]:
+      with open(filename, 'w') as fp:
+        fp.write(code)
+
+    files = sorted(bytecode.source_files(directory))
+    assert_equals(files, [bad, good])
+    assert_true(bytecode.is_stale(good))
+    assert_equals(bytecode.compile_files(files, jobs=2), (1, 1, 0))
+    assert_false(bytecode.is_stale(good))
+    assert_true(os.path.isfile(bytecode.cache_from_source(good)))
+    assert_equals(bytecode.compile_files(files), (0, 1, 1))
+
+    cached = list(bytecode.cached_files([(good, 'lib/good.py'), (bad, 'bad.py')]))
+    assert_equals(len(cached), 1)
+    assert_equals(cached[0][0], bytecode.cache_from_source(good))
+    assert_equals(os.path.dirname(cached[0][1].replace(os.sep, '/')).split('/')[0], 'lib')
+  finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,204 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Implements `nppm cache export` and `nppm cache import`, which write the
+caches in the cache directory (the package archives, the content store, the
+Git mirrors, the Pip distributions and the install history) as a single
+archive and unpack it again, eg. to save and restore the caches of a CI
+build. The archive is written and read as a stream.
+
+With *installed*, the export only contains what the packages and Pip
+libraries of an install location use, thus its size is proportional to
+what a project actually depends on.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import re
+import tarfile
+import time
+
+import _cache from './cache'
+import { check_archive_members } from './install'
+import { PACKAGE_MANIFEST } from './env'
+import _store from './store'
+import { find_packages } from './verify'
+import _archive from './util/archive'
+
+#: The folders and files in the cache directory that are exported.
+EXPORTED = ['archives', 'git', 'pip', 'store', 'install-times.json']
+
+_PIP_METADATA = re.compile(r'^(.+?)-([^-]+?)(-py\d.*)?\.(dist|egg)-info$')
+_SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tgz', '.zip')
+
+
+def _is_temporary(name):
+  return name.endswith(('.part', '.lock', '.tmp'))
+
+
+def _normalize(name):
+  return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _pip_distribution(filename):
+  """
+  Returns the normalized name and the version of the Pip distribution
+  *filename* (a wheel or source archive), or #None.
+  """
+
+  if filename.endswith('.whl'):
+    parts = filename[:-4].split('-')
+    return (_normalize(parts[0]), parts[1]) if len(parts) >= 5 else None
+  for ext in _SDIST_EXTENSIONS:
+    if filename.endswith(ext):
+      name, sep, version = filename[:-len(ext)].rpartition('-')
+      return (_normalize(name), version) if sep else None
+  return None
+
+
+def _used_files(installer, directory):
+  """
+  Returns the set of the files (relative to the cache *directory*, with
+  forward slashes) that the packages and Pip libraries installed by the
+  #Installer use. Git mirrors are not included as installed packages do
+  not record where they were cloned from.
+  """
+
+  cache = _cache.ArchiveCache(directory)
+  store = _store.ContentStore(directory)
+  result = set()
+  def add(path):
+    result.add(os.path.relpath(path, directory).replace(os.sep, '/'))
+
+  for name, package_dir in find_packages(installer):
+    try:
+      with open(os.path.join(package_dir, PACKAGE_MANIFEST)) as fp:
+        version = json.load(fp)['version']
+    except (IOError, OSError, ValueError, KeyError):
+      continue
+    archive = cache.get(name, version)
+    if archive:
+      add(archive)
+      if os.path.isfile(archive + '.sha256'):
+        add(archive + '.sha256')
+    for path in store.stored_files(name, version):
+      add(path)
+
+  pip_lib = installer.dirs.get('pip_lib')
+  installed = set()
+  for name in os.listdir(pip_lib) if pip_lib and os.path.isdir(pip_lib) else ():
+    match = _PIP_METADATA.match(name)
+    if match:
+      installed.add((_normalize(match.group(1)), match.group(2)))
+  pip_dir = os.path.join(directory, 'pip')
+  for name in os.listdir(pip_dir) if os.path.isdir(pip_dir) else ():
+    if _pip_distribution(name) in installed:
+      add(os.path.join(pip_dir, name))
+  return result
+
+
+def export_cache(filename, installer=None, directory=None):
+  """
+  Writes the caches in the cache *directory* (defaults to
+  #cache.get_cache_directory()) to the archive *filename*, compressed by
+  its extension (see #archive.COMPRESSIONS). If the #Installer *installer*
+  is specified, only the files used by its installed packages are written.
+
+  Returns True on success.
+  """
+
+  try:
+    compression = _archive.get_compression(filename)
+  except ValueError as exc:
+    print('Error: {}'.format(exc))
+    return False
+
+  if directory is None:
+    directory = _cache.get_cache_directory()
+  start = time.time()
+  rels = [x for x in _archive.walk(directory, EXPORTED[:-1], _is_temporary)
+          if x != 'store/tmp' and not x.startswith('store/tmp/')]
+  if os.path.isfile(os.path.join(directory, EXPORTED[-1])):
+    rels.append(EXPORTED[-1])
+  if installer is not None:
+    used = _used_files(installer, directory)
+    used.add(EXPORTED[-1])
+    rels = [x for x in rels if x in used]
+
+  print('Exporting "{}" to "{}" ...'.format(directory, filename))
+  tmp = filename + '.part'
+  with _archive.open_compressed(tmp, 'w', compression) as stream:
+    archive = tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT)
+    count = _archive.add_files(archive, directory, rels)
+    archive.close()
+  if os.name == 'nt' and os.path.isfile(filename):
+    os.remove(filename)
+  os.rename(tmp, filename)
+  print('  Exported {} files ({:.1f} MiB) in {:.1f}s.'.format(count,
+      os.path.getsize(filename) / (1024.0 * 1024.0), time.time() - start))
+  return True
+
+
+def _read_only_store(members):
+  """
+  Yields the tar *members* with the files of the content store made
+  read-only again, as #archive.add_files() normalizes the permissions (see
+  #store.ContentStore).
+  """
+
+  for member in members:
+    if member.isfile() and member.name.startswith('store/files/'):
+      member.mode = 0o555 if member.mode & 0o100 else 0o444
+    yield member
+
+
+def import_cache(filename, directory=None, jobs=None):
+  """
+  Unpacks the archive *filename* created by #export_cache() into the cache
+  *directory* (defaults to #cache.get_cache_directory()). Files that are
+  already in the cache are kept. The files of the content store are
+  read-only after the import, like the ones added to it by nppm.
+
+  Returns True on success.
+  """
+
+  try:
+    compression = _archive.get_compression(filename)
+  except ValueError as exc:
+    print('Error: {}'.format(exc))
+    return False
+
+  if directory is None:
+    directory = _cache.get_cache_directory()
+  directory = os.path.abspath(directory)
+  start = time.time()
+  print('Importing "{}" to "{}" ...'.format(filename, directory))
+  with _archive.open_compressed(filename, 'r', compression) as stream:
+    archive = tarfile.open(fileobj=stream, mode='r|')
+    members = _read_only_store(check_archive_members(archive, directory))
+    count = _archive.extract(archive, members, directory, jobs, replace=False)
+  print('  Imported {} files in {:.1f}s.'.format(count, time.time() - start))
+  return True
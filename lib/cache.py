@@ -0,0 +1,316 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+The local caches of package distribution archives downloaded from a registry,
+of Git repositories and of Python distributions downloaded with Pip.
+Archives are stored by package name and version, thus a version that was
+downloaded once never needs to be downloaded again.
+
+Besides the writable cache directory, any number of read-only cache
+directories can be configured (eg. a cache that is shared by all users of
+a system image). They are searched after the writable cache directory, and
+archives found there are hardlinked into it or used in place.
+"""
+
+import appdirs
+import errno
+import hashlib
+import os
+import shutil
+import six
+import subprocess
+import tempfile
+
+import _download from './util/download'
+import hashing from './util/hashing'
+import { FileLock } from './util/lock'
+import {get_package_archive_name} from './registry'
+import semver from './semver'
+
+
+def get_cache_directory():
+  """
+  Returns the root directory of nppm's caches. It can be configured with
+  the `cache.directory` option and defaults to the user's cache directory.
+  """
+
+  try:
+    directory = require.context.config['cache.directory']
+  except KeyError:
+    directory = appdirs.user_cache_dir('nppm')
+  return os.path.expanduser(directory)
+
+
+def get_readonly_cache_directories():
+  """
+  Returns the list of read-only cache directories that are searched after
+  #get_cache_directory(). They can be configured with the
+  `cache.readonly_directories` option, separated by #os.pathsep.
+  """
+
+  try:
+    value = require.context.config['cache.readonly_directories']
+  except KeyError:
+    return []
+  return [os.path.expanduser(x.strip()) for x in str(value).split(os.pathsep) if x.strip()]
+
+
+def get_pip_directory():
+  """
+  Returns the directory that `nppm fetch` downloads Python distributions to
+  and that `nppm install --offline` installs them from.
+  """
+
+  return os.path.join(get_cache_directory(), 'pip')
+
+
+class ArchiveCache(object):
+  """
+  Manages the package archives in the `archives/` folder of a cache
+  *directory*, which defaults to #get_cache_directory(). Archives that are
+  not cached there are looked up in the *readonly_directories* (default
+  #get_readonly_cache_directories() with the default *directory*).
+  """
+
+  def __init__(self, directory=None, readonly_directories=None):
+    if directory is None:
+      directory = get_cache_directory()
+      if readonly_directories is None:
+        readonly_directories = get_readonly_cache_directories()
+    self.directory = os.path.join(directory, 'archives')
+    self.readonly = [os.path.join(x, 'archives') for x in readonly_directories or ()]
+
+  def _package_dir(self, package_name, directory=None):
+    return os.path.join(directory or self.directory, *six.text_type(package_name).split('/'))
+
+  def get(self, package_name, version):
+    """
+    Returns the filename of the cached archive for *package_name* and
+    *version*, or #None if it is not cached. An archive that is only in a
+    read-only cache directory is hardlinked into the cache (with its
+    checksum), or used in place if that is not possible.
+    """
+
+    name = get_package_archive_name(package_name, version)
+    filename = os.path.join(self._package_dir(package_name), name)
+    if os.path.isfile(filename):
+      return filename
+    for directory in self.readonly:
+      source = os.path.join(self._package_dir(package_name, directory), name)
+      if os.path.isfile(source):
+        try:
+          if os.path.isfile(source + '.sha256'):
+            _link(source + '.sha256', filename + '.sha256')
+          _link(source, filename)
+        except (IOError, OSError):
+          return source
+        return filename
+    return None
+
+  def lock_file(self, package_name, version):
+    """
+    Returns the name of the lock file that is held while the archive for
+    *package_name* and *version* is downloaded into the cache.
+    """
+
+    return os.path.join(self._package_dir(package_name),
+        get_package_archive_name(package_name, version)) + '.lock'
+
+  def versions(self, package_name):
+    """
+    Returns a list of the #semver.Version#s of *package_name* that are in
+    the cache.
+    """
+
+    prefix = six.text_type(package_name).replace('/', '-') + '-'
+    suffix = '.tar.gz'
+    names = set()
+    for directory in [self.directory] + self.readonly:
+      try:
+        names.update(os.listdir(self._package_dir(package_name, directory)))
+      except OSError:
+        pass
+    result = []
+    for name in sorted(names):
+      if name.startswith(prefix) and name.endswith(suffix):
+        try:
+          result.append(semver.Version(name[len(prefix):-len(suffix)]))
+        except ValueError:
+          pass
+    return result
+
+  def put(self, package_name, version, response, progress=None):
+    """
+    Downloads the #requests.Response *response* into the cache as the
+    archive for *package_name* and *version* and returns its filename. The
+    archive only becomes visible in the cache once it is complete. Its
+    SHA256 checksum is recorded next to it for #verify(), which is also
+    replaced atomically after the archive. The caller must hold the
+    #lock_file() of the archive.
+    """
+
+    directory = self._package_dir(package_name)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    filename = os.path.join(directory, get_package_archive_name(package_name, version))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+    tmp_sum = None
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        writer = hashing.HashingWriter(fp)
+        _download.download_to_fileobj(response, writer, progress=progress)
+      fd, tmp_sum = tempfile.mkstemp(dir=directory, suffix='.part')
+      with os.fdopen(fd, 'w') as fp:
+        fp.write(writer.hexdigest() + '\n')
+      # A checksum of a previous archive must never be paired with the new
+      # one, while an archive without a checksum is accepted by #verify().
+      if os.path.isfile(filename + '.sha256'):
+        os.remove(filename + '.sha256')
+      _replace(tmp, filename)
+      _replace(tmp_sum, filename + '.sha256')
+    finally:
+      for path in (tmp, tmp_sum):
+        if path and os.path.isfile(path):
+          os.remove(path)
+    return filename
+
+  def verify(self, filename):
+    """
+    Checks the archive *filename* against the checksum that was recorded
+    when it was downloaded. Returns False if it does not match, True if
+    it matches or if no checksum was recorded.
+    """
+
+    try:
+      with open(filename + '.sha256', 'r') as fp:
+        expected = fp.read().strip()
+    except (IOError, OSError):
+      return True
+    return hashing.file_digest(filename) == expected
+
+
+class GitCache(object):
+  """
+  Manages mirrors of Git repositories in the `git/` folder of a cache
+  *directory*. Repositories are identified by the hash of their URL. See
+  #ArchiveCache for the *readonly_directories*.
+  """
+
+  def __init__(self, directory=None, readonly_directories=None):
+    if directory is None:
+      directory = get_cache_directory()
+      if readonly_directories is None:
+        readonly_directories = get_readonly_cache_directories()
+    self.directory = os.path.join(directory, 'git')
+    self.readonly = [os.path.join(x, 'git') for x in readonly_directories or ()]
+
+  def _mirror_dir(self, url, directory=None):
+    return os.path.join(directory or self.directory, hashlib.sha1(url.encode('utf8')).hexdigest())
+
+  def _readonly_mirror(self, url):
+    for directory in self.readonly:
+      mirror = self._mirror_dir(url, directory)
+      if os.path.isdir(mirror):
+        return mirror
+    return None
+
+  def get(self, url):
+    """
+    Returns the directory of the mirror of *url* or #None if the repository
+    is not cached. A mirror in a read-only cache directory is used in place.
+    """
+
+    directory = self._mirror_dir(url)
+    if os.path.isdir(directory):
+      return directory
+    return self._readonly_mirror(url)
+
+  def update(self, url):
+    """
+    Creates or updates the mirror of the repository at *url* while holding
+    a lock on it. A new mirror only becomes visible in the cache once it is
+    complete. If a read-only cache directory has a mirror of *url*, the new
+    mirror is cloned from there (which hardlinks the Git objects where
+    possible) and then updated. Returns the directory of the mirror, or
+    #None if Git failed.
+    """
+
+    directory = self._mirror_dir(url)
+    with FileLock(directory + '.lock', 'Waiting for the Git mirror of "{}"...'.format(url)):
+      if os.path.isdir(directory):
+        args = ['git', '--git-dir', directory, 'remote', 'update', '--prune']
+        return directory if subprocess.call(args) == 0 else None
+
+      source = self._readonly_mirror(url) or url
+      tmp = tempfile.mkdtemp(dir=self.directory, suffix='.part')
+      try:
+        if subprocess.call(['git', 'clone', '--mirror', '--quiet', source, tmp]) != 0:
+          return None
+        if source != url:
+          args = ['git', '--git-dir', tmp, 'remote']
+          if subprocess.call(args + ['set-url', 'origin', url]) != 0 or \
+              subprocess.call(args + ['update', '--prune']) != 0:
+            return None
+        os.rename(tmp, directory)
+      finally:
+        if os.path.isdir(tmp):
+          shutil.rmtree(tmp, ignore_errors=True)
+    return directory
+
+  def read_file(self, url, ref, filename):
+    """
+    Returns the contents of *filename* at the Git *ref* (#None for the
+    default branch) in the mirror of *url*, or #None if it does not exist.
+    """
+
+    directory = self.get(url)
+    if not directory:
+      return None
+    args = ['git', '--git-dir', directory, 'show', '{}:{}'.format(ref or 'HEAD', filename)]
+    try:
+      with open(os.devnull, 'w') as devnull:
+        return subprocess.check_output(args, stderr=devnull).decode('utf8')
+    except (OSError, subprocess.CalledProcessError):
+      return None
+
+
+def _link(src, dst):
+  """
+  Hardlinks *src* to *dst*, creating the parent directory of *dst*. An
+  existing *dst* is kept.
+  """
+
+  directory = os.path.dirname(dst)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  try:
+    os.link(src, dst)
+  except OSError as exc:
+    if exc.errno != errno.EEXIST:
+      raise
+
+
+def _replace(src, dst):
+  if os.name == 'nt' and os.path.isfile(dst):
+    os.remove(dst)
+  os.rename(src, dst)
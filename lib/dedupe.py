@@ -0,0 +1,186 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Implements `nppm dedupe`, which replaces the copies of internal dependencies
+in an existing package tree with link files that point to a single copy per
+version in the store (see #install.STORE_DIRECTORY). This is the same layout
+that `nppm install --dedupe` creates.
+"""
+
+from __future__ import print_function
+
+import collections
+import json
+import os
+import shutil
+
+import env, { PACKAGE_MANIFEST } from './env'
+import { _makedirs, _remove_later, _temporary_directory, write_link_file } from './install'
+
+
+def walk_modules(directory, depth=0):
+  """
+  Yields `(name, directory, depth)` for all package directories (not link
+  files) in the modules directory *directory*, recursing into scopes and
+  into the modules directories of the packages.
+  """
+
+  try:
+    entries = sorted(os.listdir(directory))
+  except OSError:
+    return
+  for entry in entries:
+    path = os.path.join(directory, entry)
+    if entry.startswith('.') or not os.path.isdir(path):
+      continue
+    if entry.startswith('@'):
+      for name, subdir, subdepth in walk_modules(path, depth):
+        yield entry + '/' + name, subdir, subdepth
+      continue
+    if not os.path.isfile(os.path.join(path, PACKAGE_MANIFEST)):
+      continue
+    yield entry, path, depth
+    for item in walk_modules(os.path.join(path, env.MODULES_DIRECTORY), depth + 1):
+      yield item
+
+
+def _walk_links(directory):
+  """
+  Yields the targets of all link files in the package tree *directory*.
+  """
+
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      if name.endswith(env.LINK_SUFFIX):
+        try:
+          with open(os.path.join(root, name)) as fp:
+            yield os.path.normcase(os.path.abspath(fp.read().rstrip('\n')))
+        except (IOError, OSError):
+          pass
+
+
+def _tree_size(directory):
+  size = 0
+  for root, dirs, files in os.walk(directory):
+    for name in files:
+      try:
+        size += os.lstat(os.path.join(root, name)).st_size
+      except OSError:
+        pass
+  return size
+
+
+def store_entries(store):
+  """
+  Yields the package directories in the *store*.
+  """
+
+  for entry in sorted(os.listdir(store)) if os.path.isdir(store) else []:
+    path = os.path.join(store, entry)
+    if entry.startswith('.'):
+      continue
+    if entry.startswith('@') and os.path.isdir(path):
+      for sub in sorted(os.listdir(path)):
+        yield os.path.join(path, sub)
+    elif os.path.isdir(path):
+      yield path
+
+
+def dedupe(installer, dry=False):
+  """
+  Deduplicates the internal dependencies in the packages directory of the
+  #Installer. Every version of a package that is installed as an internal
+  dependency more than once, or that is already in the store, is moved to
+  (or taken from) the store and linked into the modules directory of its
+  parents. Packages with command-line scripts are skipped as their scripts
+  refer to the directory they were installed to. Store entries that are not
+  linked anymore are removed.
+
+  With *dry*, only reports what would be done.
+
+  # Returns
+  The number of bytes that were (or would be) freed.
+  """
+
+  packages_dir = installer.dirs['packages']
+  store = installer.store_directory
+
+  copies = [x for x in walk_modules(packages_dir) if x[2] > 0]
+  for entry in store_entries(store):
+    copies.extend(walk_modules(os.path.join(entry, env.MODULES_DIRECTORY), 1))
+
+  groups = collections.OrderedDict()
+  for name, directory, depth in copies:
+    try:
+      with open(os.path.join(directory, PACKAGE_MANIFEST)) as fp:
+        data = json.load(fp)
+    except (IOError, OSError, ValueError):
+      continue
+    if data.get('bin'):
+      print('Skipping "{}" in "{}" (has command-line scripts)'.format(name, directory))
+      continue
+    groups.setdefault((name, data.get('version')), []).append((depth, directory))
+
+  # Handle the deepest copies first so that the copies nested in a package
+  # are replaced before that package itself is moved or removed.
+  pending = sorted(((depth, directory, key) for key, dirs in groups.items()
+                    for depth, directory in dirs), key=lambda x: -x[0])
+  stored = set(key for key in groups if os.path.isdir(installer.store_path(*key)))
+  freed = 0
+
+  # A copy is only removed once its link file is in place (see
+  # #write_link_file()), so an interrupted run never leaves a dependency
+  # without either. The removal is waited for as the parent of the copy may
+  # be moved to the store next.
+  for depth, directory, key in pending:
+    target = installer.store_path(*key)
+    if key in stored:
+      size = _tree_size(directory)
+      print('Linking "{}@{}" in "{}" ({} bytes)'.format(key[0], key[1], directory, size))
+      freed += size
+      if not dry:
+        write_link_file(directory, target)
+        _remove_later(directory).join()
+    elif len(groups[key]) > 1:
+      print('Moving "{}@{}" from "{}" to the store'.format(key[0], key[1], directory))
+      stored.add(key)
+      if not dry:
+        # The copy is moved to a staging directory next to the store entry
+        # first, as #shutil.move() copies it if the store is on another
+        # filesystem and an incomplete entry must not be linked.
+        _makedirs(os.path.dirname(target))
+        stage = _temporary_directory('.tmp-', target)
+        os.rmdir(stage)
+        shutil.move(directory, stage)
+        os.rename(stage, target)
+        write_link_file(directory, target)
+
+  if not dry:
+    linked = set(_walk_links(packages_dir))
+    for entry in list(store_entries(store)):
+      if os.path.normcase(os.path.abspath(entry)) not in linked:
+        print('Removing unused "{}" from the store'.format(entry))
+        freed += _tree_size(entry)
+        shutil.rmtree(entry)
+
+  return freed
@@ -0,0 +1,431 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A compact representation of a package dependency graph for large trees.
+
+Every package is a node identified by an integer. Package names are interned
+into a table that nodes refer to by index, versions are stored as packed
+`(major, minor, patch)` integers and the edges are stored in compressed
+sparse row format: the dependencies of node `i` are
+`targets[offsets[i]:offsets[i+1]]`. All of these live in #array.array's,
+thus a graph with 100k nodes costs a few megabytes instead of one
+#manifest.PackageManifest and one #manifest.Requirement per node and edge.
+
+Graphs are created with a #GraphBuilder and are immutable afterwards.
+"""
+
+import array
+import collections
+import json
+import os
+
+import env from './env'
+import manifest from './manifest'
+import semver from './semver'
+
+
+class GraphCycleError(Exception):
+  """
+  Raised by #DependencyGraph.topological_order() if the graph contains a
+  cycle. *nodes* is the list of nodes that could not be ordered.
+  """
+
+  def __init__(self, nodes):
+    Exception.__init__(self, 'dependency cycle between {} packages'.format(len(nodes)))
+    self.nodes = nodes
+
+
+class GraphBuilder(object):
+  """
+  Collects nodes and edges for a #DependencyGraph. The same package name
+  can be added multiple times, eg. for different versions that are
+  installed as internal dependencies of different packages.
+  """
+
+  def __init__(self):
+    self.names = []
+    self.name_ids = {}
+    self.node_names = array.array('i')
+    self.versions = array.array('i')
+    self.extensions = {}
+    self.edge_sources = array.array('i')
+    self.edge_targets = array.array('i')
+
+  def __len__(self):
+    return len(self.node_names)
+
+  def intern(self, name):
+    """
+    Returns the index of *name* in the name table.
+    """
+
+    try:
+      return self.name_ids[name]
+    except KeyError:
+      self.name_ids[name] = index = len(self.names)
+      self.names.append(name)
+      return index
+
+  def add_node(self, name, version):
+    """
+    Adds a node for the package *name* with the specified *version* (a
+    string or #semver.Version) and returns its id.
+    """
+
+    if not isinstance(version, semver.Version):
+      version = semver.Version(version)
+    node = len(self.node_names)
+    self.node_names.append(self.intern(name))
+    self.versions.extend(version.mmp)
+    if version.extension or version.build:
+      self.extensions[node] = (version.extension, version.build)
+    return node
+
+  def add_edge(self, node, dependency):
+    """
+    Records that the package *node* depends on the package *dependency*.
+    """
+
+    self.edge_sources.append(node)
+    self.edge_targets.append(dependency)
+
+  def build(self):
+    """
+    Returns the #DependencyGraph. The builder should not be used anymore
+    afterwards as the graph shares its name table and arrays.
+    """
+
+    offsets, targets = _compress(len(self.node_names), self.edge_sources, self.edge_targets)
+    return DependencyGraph(self.names, self.node_names, self.versions,
+        self.extensions, offsets, targets)
+
+
+class DependencyGraph(object):
+  """
+  An immutable dependency graph in compressed sparse row format. Use a
+  #GraphBuilder or #scan() to create one.
+
+  # Attributes
+  names (list of str): The interned package names.
+  node_names (array.array): The index into #names for every node.
+  versions (array.array): Three integers per node.
+  extensions (dict): Maps nodes with a version extension or build
+    number to an `(extension, build)` tuple.
+  offsets (array.array): #len() + 1 offsets into #targets.
+  targets (array.array): The dependencies of all nodes.
+  """
+
+  def __init__(self, names, node_names, versions, extensions, offsets, targets):
+    self.names = names
+    self.node_names = node_names
+    self.versions = versions
+    self.extensions = extensions
+    self.offsets = offsets
+    self.targets = targets
+    self._reverse = None
+    self._by_name = None
+
+  def __len__(self):
+    return len(self.node_names)
+
+  def __repr__(self):
+    return '<DependencyGraph nodes={} edges={}>'.format(len(self), len(self.targets))
+
+  def name(self, node):
+    return self.names[self.node_names[node]]
+
+  def version(self, node):
+    """
+    Returns the packed `(major, minor, patch)` version of *node*.
+    """
+
+    return tuple(self.versions[node * 3:node * 3 + 3])
+
+  def semver(self, node):
+    """
+    Returns the full #semver.Version of *node*.
+    """
+
+    version = '.'.join(map(str, self.version(node)))
+    extension, build = self.extensions.get(node, (None, None))
+    if extension:
+      version += '-' + extension
+    if build:
+      version += '+' + build
+    return semver.Version(version)
+
+  def find(self, name):
+    """
+    Returns a list of the nodes for the package *name*.
+    """
+
+    if self._by_name is None:
+      by_name = collections.defaultdict(list)
+      for node, name_id in enumerate(self.node_names):
+        by_name[self.names[name_id]].append(node)
+      self._by_name = dict(by_name)
+    return self._by_name.get(name, [])
+
+  def dependencies(self, node):
+    """
+    Returns the nodes that *node* depends on.
+    """
+
+    return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+  def dependents(self, node):
+    """
+    Returns the nodes that depend on *node*. The reverse edges are computed
+    on the first call.
+    """
+
+    if self._reverse is None:
+      sources = array.array('i')
+      for node_ in range(len(self)):
+        sources.extend([node_] * (self.offsets[node_ + 1] - self.offsets[node_]))
+      self._reverse = _compress(len(self), self.targets, sources)
+    offsets, sources = self._reverse
+    return sources[offsets[node]:offsets[node + 1]]
+
+  def topological_order(self, strict=True):
+    """
+    Returns an array of all nodes in which every node comes after its
+    dependencies, ie. the order in which they need to be installed.
+
+    If the graph has cycles, a #GraphCycleError is raised if *strict* is
+    True, otherwise the nodes involved in or depending on a cycle are
+    appended in the order of their ids.
+    """
+
+    pending = array.array('i', (self.offsets[i + 1] - self.offsets[i] for i in range(len(self))))
+    order = array.array('i', (i for i in range(len(self)) if pending[i] == 0))
+    index = 0
+    while index < len(order):
+      for dependent in self.dependents(order[index]):
+        pending[dependent] -= 1
+        if pending[dependent] == 0:
+          order.append(dependent)
+      index += 1
+    if len(order) != len(self):
+      remaining = [i for i in range(len(self)) if pending[i] > 0]
+      if strict:
+        raise GraphCycleError(remaining)
+      order.extend(remaining)
+    return order
+
+  def reachable(self, roots):
+    """
+    Returns an array of all nodes reachable from the nodes *roots*,
+    including the roots, in breadth-first order.
+    """
+
+    seen = bytearray(len(self))
+    order = array.array('i')
+    for node in roots:
+      if not seen[node]:
+        seen[node] = 1
+        order.append(node)
+    index = 0
+    while index < len(order):
+      for dependency in self.dependencies(order[index]):
+        if not seen[dependency]:
+          seen[dependency] = 1
+          order.append(dependency)
+      index += 1
+    return order
+
+  def subgraph(self, roots):
+    """
+    Returns a new #DependencyGraph with the nodes reachable from *roots*.
+    The nodes are renumbered in breadth-first order, thus the roots come
+    first. The name table is shared with this graph.
+    """
+
+    nodes = self.reachable(roots)
+    mapping = {old: new for new, old in enumerate(nodes)}
+    node_names = array.array('i', (self.node_names[i] for i in nodes))
+    versions = array.array('i')
+    sources = array.array('i')
+    targets = array.array('i')
+    extensions = {}
+    for new, old in enumerate(nodes):
+      versions.extend(self.versions[old * 3:old * 3 + 3])
+      if old in self.extensions:
+        extensions[new] = self.extensions[old]
+      for dependency in self.dependencies(old):
+        sources.append(new)
+        targets.append(mapping[dependency])
+    offsets, targets = _compress(len(nodes), sources, targets)
+    return DependencyGraph(self.names, node_names, versions, extensions, offsets, targets)
+
+  def nbytes(self):
+    """
+    Returns the approximate number of bytes used by the node and edge
+    arrays (not including the name table).
+    """
+
+    arrays = [self.node_names, self.versions, self.offsets, self.targets]
+    if self._reverse:
+      arrays.extend(self._reverse)
+    return sum(a.itemsize * len(a) for a in arrays)
+
+
+def _compress(num_nodes, sources, targets):
+  """
+  Sorts the edges `(sources[i], targets[i])` by source with a counting sort
+  and returns the `(offsets, targets)` arrays. The order of the edges of
+  a node is preserved.
+  """
+
+  offsets = array.array('i', [0]) * (num_nodes + 1)
+  for source in sources:
+    offsets[source + 1] += 1
+  for i in range(num_nodes):
+    offsets[i + 1] += offsets[i]
+  position = offsets[:-1]
+  result = array.array('i', [0]) * len(targets)
+  for source, target in zip(sources, targets):
+    result[position[source]] = target
+    position[source] += 1
+  return offsets, result
+
+
+def _entries(packages_dir):
+  """
+  Yields `(name, path)` for the entries of the packages directory
+  *packages_dir*, including the packages in `@scope` directories.
+  """
+
+  try:
+    entries = sorted(os.listdir(packages_dir))
+  except OSError:
+    return
+  for entry in entries:
+    path = os.path.join(packages_dir, entry)
+    if entry.startswith('@') and os.path.isdir(path):
+      for name, subpath in _entries(path):
+        yield entry + '/' + name, subpath
+    else:
+      yield entry, path
+
+
+def scan(directory, dev=False):
+  """
+  Builds a #DependencyGraph from the packages installed in the packages
+  *directory*, including the internal dependencies installed in their
+  modules directories. Dependencies are resolved the same way as at
+  runtime: first in the package's own modules directory, then in the
+  modules directories of the packages it is nested in. Dependencies that
+  are not installed are not part of the graph.
+
+  Manifests are only parsed as JSON to keep this fast for large trees.
+
+  # Returns
+  (graph, directories) where *directories* is a list of the package
+  directory for every node.
+  """
+
+  return _scan(directory, dev)
+
+
+def check(directory, dev=False):
+  """
+  Checks that the dependencies of the packages installed in the packages
+  *directory* (see #scan()) are installed and, for registry dependencies,
+  that the installed version satisfies the requirement. Optional
+  dependencies may be missing.
+
+  # Returns
+  A list of `(package_dir, name, requirement, version)` tuples for the
+  dependencies that are not satisfied, where *version* is the installed
+  #semver.Version or #None if the dependency is not installed.
+  """
+
+  resolved = []
+  graph, directories = _scan(directory, dev, resolved)
+  result = []
+  for node, name, req, dependency in resolved:
+    if not isinstance(req, manifest.Requirement):
+      req = manifest.Requirement.from_line(req, name=name)
+    if dependency is None:
+      if not req.optional:
+        result.append((directories[node], name, req, None))
+    elif req.type == 'registry' and not req.selector(graph.semver(dependency)):
+      result.append((directories[node], name, req, graph.semver(dependency)))
+  return result
+
+
+def _scan(directory, dev, resolved=None):
+  """
+  Implements #scan(). If *resolved* is a list, a tuple of
+  `(node, name, requirement, dependency)` is appended for every dependency
+  of every node, where *dependency* is #None if it is not installed.
+  """
+
+  builder = GraphBuilder()
+  directories = []
+  pending = []  # (node, dependencies, scopes)
+
+  def visit(packages_dir, scopes):
+    scope = {}
+    scopes = scopes + [scope]
+    for name, path in _entries(packages_dir):
+      if name.endswith(env.LINK_SUFFIX):
+        name = name[:-len(env.LINK_SUFFIX)]
+        with open(path) as fp:
+          package_dir = fp.read().rstrip('\n')
+      elif os.path.isdir(path):
+        package_dir = path
+      else:
+        continue
+      try:
+        with open(os.path.join(package_dir, env.PACKAGE_MANIFEST)) as fp:
+          data = json.load(fp)
+      except (IOError, OSError, ValueError):
+        continue
+      try:
+        node = builder.add_node(data.get('name', name), data.get('version', '0.0.0'))
+      except ValueError:
+        continue
+      scope[name] = node
+      directories.append(package_dir)
+      deps = manifest.eval_fields(data, env.cfgvars(dev), 'dependencies', {})
+      nested = os.path.join(package_dir, env.MODULES_DIRECTORY)
+      if os.path.isdir(nested):
+        pending.append((node, deps, visit(nested, scopes)))
+      else:
+        pending.append((node, deps, scopes))
+    return scopes
+
+  visit(directory, [])
+  for node, deps, scopes in pending:
+    for name, req in deps.items():
+      dependency = None
+      for scope in reversed(scopes):
+        if name in scope:
+          dependency = scope[name]
+          builder.add_edge(node, dependency)
+          break
+      if resolved is not None:
+        resolved.append((node, name, req, dependency))
+  return builder.build(), directories
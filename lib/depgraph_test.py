@@ -0,0 +1,109 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import json
+import os
+import shutil
+import tempfile
+import { GraphBuilder, GraphCycleError, check, scan } from './depgraph'
+import env from './env'
+
+
+def make_graph():
+  # app -> (lib, util), lib -> util, util -> ()
+  builder = GraphBuilder()
+  app = builder.add_node('app', '1.0.0')
+  lib = builder.add_node('lib', '2.1.0-beta')
+  util = builder.add_node('util', '0.3.2')
+  builder.add_edge(app, lib)
+  builder.add_edge(app, util)
+  builder.add_edge(lib, util)
+  return builder.build()
+
+
+def test_graph():
+  graph = make_graph()
+  assert_equals(len(graph), 3)
+  assert_equals(graph.name(1), 'lib')
+  assert_equals(graph.version(1), (2, 1, 0))
+  assert_equals(str(graph.semver(1)), '2.1.0-beta')
+  assert_equals(graph.find('util'), [2])
+  assert_equals(graph.find('missing'), [])
+  assert_equals(list(graph.dependencies(0)), [1, 2])
+  assert_equals(list(graph.dependencies(2)), [])
+  assert_equals(sorted(graph.dependents(2)), [0, 1])
+  assert_equals(list(graph.topological_order()), [2, 1, 0])
+
+
+def test_subgraph():
+  graph = make_graph()
+  sub = graph.subgraph([1])
+  assert_equals([sub.name(i) for i in range(len(sub))], ['lib', 'util'])
+  assert_equals(list(sub.dependencies(0)), [1])
+  assert_equals(str(sub.semver(0)), '2.1.0-beta')
+
+
+def test_cycle():
+  builder = GraphBuilder()
+  a = builder.add_node('a', '1.0.0')
+  b = builder.add_node('b', '1.0.0')
+  c = builder.add_node('c', '1.0.0')
+  builder.add_edge(a, b)
+  builder.add_edge(b, a)
+  builder.add_edge(c, a)
+  graph = builder.build()
+  with assert_raises(GraphCycleError) as cm:
+    graph.topological_order()
+  assert_equals(cm.exception.nodes, [0, 1, 2])
+  assert_equals(list(graph.topological_order(strict=False)), [0, 1, 2])
+
+
+def test_scan():
+  directory = tempfile.mkdtemp()
+  def package(path, name, deps, version='1.0.0'):
+    os.makedirs(path)
+    with open(os.path.join(path, env.PACKAGE_MANIFEST), 'w') as fp:
+      json.dump({'name': name, 'version': version, 'dependencies': deps}, fp)
+  try:
+    package(os.path.join(directory, 'app'), 'app',
+        {'lib': '~1.0.0', 'util': '~1.0.0', '@scope/ext': '~1.0.0'})
+    package(os.path.join(directory, 'util'), 'util', {})
+    package(os.path.join(directory, '@scope', 'ext'), '@scope/ext', {'util': '~2.0.0'})
+    nested = os.path.join(directory, 'app', env.MODULES_DIRECTORY)
+    package(os.path.join(nested, 'lib'), 'lib', {'util': '~1.0.0', 'missing': '~1.0.0',
+        'extra': '--optional ~1.0.0'})
+    graph, directories = scan(directory)
+    assert_equals(len(graph), 4)
+    app, lib, util = graph.find('app')[0], graph.find('lib')[0], graph.find('util')[0]
+    ext = graph.find('@scope/ext')[0]
+    assert_equals(sorted(graph.dependencies(app)), sorted([lib, util, ext]))
+    assert_equals(list(graph.dependencies(lib)), [util])
+    assert_equals(list(graph.dependencies(ext)), [util])
+    assert_equals(directories[lib], os.path.join(nested, 'lib'))
+
+    problems = [(d, name, version) for d, name, __, version in check(directory)]
+    assert_equals(sorted(problems, key=str), sorted([
+      (os.path.join(directory, '@scope', 'ext'), 'util', graph.semver(util)),
+      (os.path.join(nested, 'lib'), 'missing', None)], key=str))
+  finally:
+    shutil.rmtree(directory)
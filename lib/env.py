@@ -36,6 +36,10 @@ PIP_DIRECTORY = module.context.pipprefix_directory
 PROGRAM_DIRECTORY = os.path.join(os.path.dirname(PIP_DIRECTORY), 'bin')
 LINK_SUFFIX = module.context.link_suffix
 
+#: The name of the file in an installed package's directory that records the
+#: installed files (see #record.InstalledFiles).
+INSTALLED_FILES = '.nppm-installed-files.json'
+
 
 def is_virtualenv():
   if hasattr(sys, 'real_prefix'):
@@ -149,7 +153,7 @@ def get_module_dist_info(module, pythonpath=None):
   if not pythonpath:
     pythonpath = sys.path
   sosuffix = distutils.sysconfig.get_config_var('SO')
-  for dirname in sys.path:
+  for dirname in pythonpath:
     if not os.path.isdir(dirname): continue
     for fn in os.listdir(dirname):
       if not fn.endswith('.dist-info'): continue
@@ -0,0 +1,235 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Implements `nppm fetch`, which downloads everything that is needed to install
+the dependencies of a package into the local caches without installing
+anything, such that a subsequent `nppm install --offline` does not need to
+access the network.
+"""
+
+from __future__ import print_function
+
+import collections
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+import traceback
+
+import _cache from './cache'
+import env, { PACKAGE_MANIFEST } from './env'
+import _install from './install'
+import manifest from './manifest'
+import pool from './util/pool'
+
+
+def read_archive_manifest(filename):
+  """
+  Reads the package manifest from the package archive *filename*. Returns
+  #None if the archive contains no manifest.
+  """
+
+  with tarfile.open(filename) as archive:
+    try:
+      fp = archive.extractfile(PACKAGE_MANIFEST)
+    except KeyError:
+      return None
+    data = fp.read().decode('utf8')
+  return manifest.load(io.StringIO(data))
+
+
+class Fetcher(object):
+  """
+  Walks the dependency tree of a package and downloads all registry
+  archives into the #cache.ArchiveCache, mirrors all Git dependencies in the
+  #cache.GitCache and downloads all Pip dependencies to
+  #cache.get_pip_directory(). The tree is walked level by level and the
+  packages of one level are fetched from #Installer.jobs threads.
+
+  Registry dependencies are resolved with
+  #Installer.resolve_from_registry(), thus the *installer* should be
+  created with `upgrade=True` to resolve the versions that a new
+  installation would choose. If *pip* is False, Pip dependencies are not
+  downloaded.
+  """
+
+  def __init__(self, installer, pip=True):
+    self.installer = installer
+    self.pip = pip
+    self.seen = set()
+    self.pip_deps = collections.OrderedDict()
+    self.failed = []
+    self.lock = threading.Lock()
+    self.mirror_locks = collections.defaultdict(threading.Lock)
+
+  def fetch(self, mf, dev=False):
+    """
+    Fetches the dependencies of the #PackageManifest *mf* (including its
+    development dependencies if *dev* is True) and their dependencies,
+    recursively. Returns True if everything was fetched.
+    """
+
+    level = self._dependencies(mf, dev, mf.directory)
+    while level:
+      results = pool.map_threaded(self._fetch_dependency, level, self.installer.jobs)
+      level = [item for children in results for item in children]
+
+    if self.pip and self.pip_deps and not self.fetch_python_dependencies(self.pip_deps):
+      self.failed.append('Pip dependencies')
+    if self.failed:
+      print('Error: could not fetch {}'.format(', '.join(self.failed)))
+      return False
+    return True
+
+  def _dependencies(self, mf, dev, directory):
+    """
+    Returns the `(name, req, directory)` tuples for the dependencies of *mf*
+    and records its Pip dependencies. *directory* is used to resolve relative
+    path dependencies.
+    """
+
+    result = []
+    for name, req in mf.eval_fields(env.cfgvars(dev), 'dependencies', {}).items():
+      if not isinstance(req, manifest.Requirement):
+        req = manifest.Requirement.from_line(req, name=name)
+      result.append((name, req, directory))
+    pip_deps = mf.eval_fields(env.cfgvars(dev), 'pip_dependencies', {})
+    with self.lock:
+      _install.merge_pip_dependencies(self.pip_deps, pip_deps)
+    return result
+
+  def _visit(self, key):
+    with self.lock:
+      if key in self.seen:
+        return False
+      self.seen.add(key)
+      return True
+
+  def _fetch_dependency(self, item):
+    """
+    Fetches a single dependency and returns the list of its dependencies
+    that still need to be fetched.
+    """
+
+    name, req, directory = item
+    try:
+      if req.type == 'registry':
+        mf = self._fetch_registry(name, req)
+      elif req.type == 'git':
+        mf = self._fetch_git(name, req)
+      elif req.type == 'path' and directory is None:
+        print('Warning: ignoring path dependency "{}" ({}) of a non-local package'.format(name, req))
+        mf = None
+      elif req.type == 'path':
+        path = req.path if os.path.isabs(req.path) else os.path.join(directory, req.path)
+        mf = self._read_path(os.path.normpath(os.path.abspath(path)))
+      else:
+        raise RuntimeError('unexpected dependency data: "{}" -> {!r}'.format(name, req))
+      child_dir = mf.directory if mf and req.type == 'path' else None
+    except Exception:
+      traceback.print_exc()
+      mf = False
+    if mf is False:
+      with self.lock:
+        self.failed.append('"{}" ({})'.format(name, req))
+      return []
+    if mf is None:
+      return []
+    return self._dependencies(mf, False, child_dir)
+
+  def _fetch_registry(self, name, req):
+    """
+    Downloads the archive for *req* unless it is already cached. Returns the
+    manifest of the package, #None if it was already visited or False if
+    the package could not be located.
+    """
+
+    if not self._visit(('registry', name, str(req.selector), req.registry)):
+      return None
+    installer = self.installer
+    resolution = installer.resolve_from_registry(name, req.selector, regs=req.registry,
+        progress=False, priority=installer.scheduler.priority(name))
+    if resolution is None:
+      return False
+    if resolution.kind == 'stored':
+      if not self._visit(('stored', name, str(resolution.version))):
+        return None
+      filename = installer.store.get_file(name, resolution.version, PACKAGE_MANIFEST)
+      return manifest.load(filename) if filename else None
+    if resolution.kind != 'archive' or not self._visit(('archive', resolution.location)):
+      return None
+    return read_archive_manifest(resolution.location)
+
+  def _fetch_git(self, name, req):
+    """
+    Creates or updates the mirror of the Git dependency *req*. Returns the
+    manifest at the requested ref, #None if it was already visited or False
+    if the repository could not be mirrored.
+    """
+
+    url, ref = req.git_url, None
+    if '@' in url:
+      url, ref = url.partition('@')[::2]
+    if not self._visit(('git', url, ref)):
+      return None
+    with self.lock:
+      mirror_lock = self.mirror_locks[url]
+    with mirror_lock:
+      if self._visit(('mirror', url)):
+        print('Mirroring repository "{}"...'.format(url))
+        with self.installer.scheduler('connections'):
+          if not self.installer.git_cache.update(url):
+            return False
+    data = self.installer.git_cache.read_file(url, ref, PACKAGE_MANIFEST)
+    if data is None:
+      print('Warning: repository "{}" has no {}'.format(req.git_url, PACKAGE_MANIFEST))
+      return None
+    return manifest.load(io.StringIO(data))
+
+  def _read_path(self, directory):
+    if not self._visit(('path', os.path.normcase(directory))):
+      return None
+    filename = os.path.join(directory, PACKAGE_MANIFEST)
+    if not os.path.isfile(filename):
+      # Archives are installed as is, they are already local.
+      return None
+    return manifest.load(filename)
+
+  def fetch_python_dependencies(self, deps):
+    """
+    Downloads the Python distributions for *deps* and their dependencies to
+    #cache.get_pip_directory() using `pip download` in a separate process.
+    """
+
+    directory = _cache.get_pip_directory()
+    specs = [name + version for name, version in deps.items()]
+    cmd = [sys.executable, '-m', 'pip', 'download', '--dest', directory] + specs
+    print('Downloading Python dependencies via Pip:', ' '.join(cmd[3:]))
+    with self.installer.scheduler('pip'):
+      res = subprocess.call(cmd)
+    if res != 0:
+      print('Error: `pip download` failed with exit-code', res)
+      return False
+    return True
@@ -0,0 +1,147 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Computes a fingerprint of everything that influences the result of a plain
+`nppm install` in a project directory: the manifest, the install options, the
+interpreter and the state of the installed package tree. If the fingerprint
+matches the one recorded after the last successful installation, the
+installation can be skipped entirely.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+
+import env, {PACKAGE_MANIFEST} from './env'
+
+#: Name of the file in the packages directory that stores the fingerprint
+#: of the last successful installation.
+STATE_FILE = '.nppm-install-state'
+
+
+def _stat(path):
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return (st.st_size, st.st_mtime)
+
+
+def _update_tree(update, directory):
+  """
+  Feeds the state of the packages installed in *directory* into *update*.
+  Only the manifests and link files are inspected, including those of the
+  internal dependencies of every package and of linked packages.
+  """
+
+  try:
+    names = sorted(os.listdir(directory))
+  except OSError:
+    update(directory, None)
+    return
+
+  for name in names:
+    # Hidden entries are the bin/ and Pip directories, which are covered
+    # separately, and our own state file.
+    if name.startswith('.'):
+      continue
+    path = os.path.join(directory, name)
+    if name.endswith(env.LINK_SUFFIX):
+      try:
+        with open(path, 'r') as fp:
+          target = fp.read().rstrip('\n')
+      except (IOError, OSError):
+        target = None
+      update(name, target, target and _stat(os.path.join(target, PACKAGE_MANIFEST)))
+    elif name.startswith('@') and os.path.isdir(path):
+      _update_tree(update, path)
+    elif os.path.isdir(path):
+      update(name, _stat(os.path.join(path, PACKAGE_MANIFEST)))
+      nested = os.path.join(path, env.MODULES_DIRECTORY)
+      if os.path.isdir(nested):
+        _update_tree(update, nested)
+    else:
+      update(name, _stat(path))
+
+
+def compute(manifest_filename, dirs, options):
+  """
+  Computes the fingerprint for installing the package described by
+  *manifest_filename* into the directories *dirs* (as returned by
+  #env.get_directories()). *options* must be a dictionary of all the
+  settings that influence the installation.
+
+  Returns a hex string, or #None if the manifest can not be read.
+  """
+
+  hasher = hashlib.sha1()
+  def update(*values):
+    hasher.update(repr(values).encode('utf8'))
+
+  try:
+    with open(manifest_filename, 'rb') as fp:
+      hasher.update(fp.read())
+  except (IOError, OSError):
+    return None
+
+  update(sys.executable, sys.version, sys.platform)
+  update(sorted(options.items()))
+  _update_tree(update, dirs['packages'])
+  for key in ('bin', 'pip_bin', 'pip_lib'):
+    path = dirs.get(key)
+    try:
+      names = sorted(os.listdir(path)) if path else None
+    except OSError:
+      names = None
+    update(key, _stat(path) if path else None, names)
+  return hasher.hexdigest()
+
+
+def load(filename):
+  """
+  Returns the fingerprint stored in *filename* or #None.
+  """
+
+  try:
+    with open(filename, 'r') as fp:
+      return fp.read().strip() or None
+  except (IOError, OSError):
+    return None
+
+
+def save(filename, fingerprint):
+  """
+  Writes the *fingerprint* to *filename*. The file is replaced atomically
+  such that an interrupted write does not leave a partial fingerprint.
+  """
+
+  directory = os.path.dirname(filename)
+  if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+  fd, tmp = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(filename), suffix='.tmp')
+  with os.fdopen(fd, 'w') as fp:
+    fp.write(fingerprint + '\n')
+  if os.name == 'nt' and os.path.exists(filename):
+    os.remove(filename)
+  os.rename(tmp, filename)
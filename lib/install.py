@@ -21,7 +21,6 @@
 # SOFTWARE.
 
 from __future__ import print_function
-from fnmatch import fnmatch
 from nodepy.utils import pathlib
 
 try:
@@ -29,8 +28,12 @@ try:
 except ImportError:
   from pip.commands.install import InstallCommand
 
+import collections
 import contextlib
 import errno
+import glob
+import hashlib
+import json
 import nodepy.main
 import os
 import shlex
@@ -40,22 +43,50 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+import time
 import traceback
 
 import _registry from './registry'
+import _bytecode from './bytecode'
+import _cache from './cache'
 import _download from './util/download'
+import _fileops from './util/fileops'
+import _gitignore from './util/gitignore'
+import { FileLock } from './util/lock'
+import pipeline from './pipeline'
+import _scheduler from './scheduler'
+import pool from './util/pool'
 import _script from './util/script'
+import _record from './record'
 import refstring from './refstring'
-import decorators from './util/decorators'
 import brewfix from './brewfix'
 import PackageLifecycle from './package-lifecycle'
 import env, { PACKAGE_MANIFEST } from './env'
 import manifest from './manifest'
 import semver from './semver'
+import _store from './store'
+
+# Held while Pip runs in-process, as that requires modifying #sys.path and
+# the `PYTHONPATH` of the current process.
+_pip_lock = threading.RLock()
 
 default_exclude_patterns = [
     '.DS_Store', '.svn/*', '.git*', env.MODULES_DIRECTORY + '/*',
-    '*.pyc', '*.pyo', 'dist/*']
+    '*.pyc', '*.pyo', 'dist/*', env.INSTALLED_FILES]
+
+
+#: Name of the file in the packages directory that is locked while Pip
+#: installs into the install location (see #Installer.locked()).
+INDEX_LOCK = '.nppm-index.lock'
+
+#: Name of the directory in the packages directory that holds the lock files
+#: of the package directories (see #Installer.target_lock_file()).
+LOCK_DIRECTORY = '.nppm-locks'
+
+#: Name of the directory in the packages directory that stores one copy of
+#: every version of the internal dependencies installed with `--dedupe`.
+STORE_DIRECTORY = '.store'
 
 
 def _makedirs(path):
@@ -63,24 +94,46 @@ def _makedirs(path):
     os.makedirs(path)
 
 
-def _match_any_pattern(filename, patterns, gitignore_style=False):
-  if not patterns:
-    return False
-  if os.name == 'nt':
-    filename = filename.replace('\\', '/')
-  for pattern in patterns:
-    if filename == pattern or filename.startswith(pattern + '/') or \
-        (gitignore_style and filename.endswith('/' + pattern)):
-      return True
-    if fnmatch(filename, pattern):
-      return True
-  return False
+def write_link_file(directory, target):
+  """
+  Creates a link file for the package *directory* that redirects Node.py to
+  the package in the *target* directory. Returns the link file's name. The
+  link file is written to a temporary file first and renamed into place.
+  """
 
+  linkfn = directory + env.LINK_SUFFIX
+  _makedirs(os.path.dirname(linkfn))
+  fd, tmp = tempfile.mkstemp(prefix='.', suffix='.part', dir=os.path.dirname(linkfn))
+  try:
+    with os.fdopen(fd, 'w') as fp:
+      fp.write(os.path.abspath(target))
+    os.chmod(tmp, 0o644)
+    if os.name == 'nt' and os.path.isfile(linkfn):
+      os.remove(linkfn)
+    os.rename(tmp, linkfn)
+  except:
+    if os.path.isfile(tmp):
+      os.remove(tmp)
+    raise
+  return linkfn
+
+
+def _package_patterns(data, ignore_file=None):
+  """
+  Returns the #gitignore.PatternList for the `include` field of the manifest
+  *data* and True, or the patterns of its `exclude` field, the
+  #default_exclude_patterns and the lines of the *ignore_file* (if it
+  exists) and False.
+  """
 
-def _check_include_file(filename, include, exclude):
+  include = data.get('include', None)
   if include is not None:
-    return _match_any_pattern(filename, include)
-  return not _match_any_pattern(filename, exclude)
+    return _gitignore.PatternList(include), True
+  exclude = list(data.get('exclude', [])) + default_exclude_patterns
+  if ignore_file and os.path.isfile(ignore_file):
+    with open(ignore_file) as fp:
+      exclude.extend(fp)
+  return _gitignore.PatternList(exclude), False
 
 
 class PackageNotFound(Exception):
@@ -100,28 +153,89 @@ class InvalidPackage(object):
 def walk_package_files(manifest):
   """
   Walks over the files included in a package and yields (abspath, relpath).
+  Without an `include` field, directories that are excluded by the `exclude`
+  field, the #default_exclude_patterns or the `.gitignore` file are not
+  entered.
+  """
+
+  patterns, include = _package_patterns(manifest,
+      os.path.join(manifest.directory, '.gitignore'))
+  filename = os.path.join(manifest.directory, PACKAGE_MANIFEST)
+  if os.path.isfile(filename):
+    yield filename, PACKAGE_MANIFEST
+  for filename, rel in patterns.walk(manifest.directory, include):
+    if rel != PACKAGE_MANIFEST:
+      yield filename, rel
+
+
+def find_workspace_members(root):
   """
+  Expands the glob patterns in the `workspaces` field of the #PackageManifest
+  *root* and returns a sorted list of the member package directories (those
+  that contain a package manifest). Returns #None if *root* has no
+  `workspaces` field.
+  """
+
+  patterns = root.get('workspaces')
+  if patterns is None:
+    return None
+  members = set()
+  for pattern in patterns:
+    matches = [path for path in glob.glob(os.path.join(root.directory, pattern))
+               if os.path.isfile(os.path.join(path, PACKAGE_MANIFEST))]
+    if not matches:
+      print('Warning: workspace pattern "{}" matches no packages'.format(pattern))
+    members.update(os.path.normpath(os.path.abspath(path)) for path in matches)
+  members.discard(os.path.normpath(os.path.abspath(root.directory)))
+  return sorted(members)
+
+
+def merge_pip_dependencies(pip_deps, deps):
+  """
+  Merges the Pip dependencies *deps* into the dictionary *pip_deps*. Version
+  specifiers for the same package are joined with a comma.
+  """
+
+  for name, spec in deps.items():
+    if not pip_deps.get(name):
+      pip_deps[name] = spec
+    elif spec and spec not in pip_deps[name].split(','):
+      pip_deps[name] += ',' + spec
+
+
+class InstallContext(object):
+  """
+  Describes where an installation takes place: the packages that are
+  currently being installed (outermost first) as tuples of
+  `(manifest, directory)`, the subset of them that install their
+  dependencies internally and whether command-line scripts are skipped
+  (*pure*).
+
+  Contexts are immutable. Installing a package derives a new context with
+  #push() that is passed down explicitly, which is what allows a single
+  #Installer to be used from multiple threads at once.
+  """
+
+  def __init__(self, installing=(), install_base=(), pure=False):
+    self.installing = tuple(installing)
+    self.install_base = tuple(install_base)
+    self.pure = pure
+
+  def __repr__(self):
+    return '<InstallContext installing={!r} pure={!r}>'.format(
+        [mf['name'] for mf, __ in self.installing], self.pure)
+
+  def push(self, package, internal=False, pure=None):
+    """
+    Returns a new context for installing the dependencies of *package*, a
+    tuple of `(manifest, directory)`. If *internal* is True, they will be
+    installed into the package's directory. *pure* overrides the value
+    of the current context if it is not #None.
+    """
 
-  include = manifest.get('include', None)
-  if include is None:
-    exclude = manifest.get('exclude', []) + default_exclude_patterns
-    ignore_file = os.path.join(manifest.directory, '.gitignore')
-    if os.path.isfile(ignore_file):
-      with open(ignore_file) as fp:
-        for line in fp:
-          line = line.strip()
-          if not line: continue
-          if line.startswith('#') or line.startswith('!'): continue
-          exclude.append(line)
-  else:
-    exclude = None
-
-  for root, __, files in os.walk(manifest.directory):
-    for filename in files:
-      filename = os.path.join(root, filename)
-      rel = os.path.relpath(filename, manifest.directory)
-      if rel == PACKAGE_MANIFEST or _check_include_file(rel, include, exclude):
-        yield (filename, rel)
+    install_base = self.install_base + ((package,) if internal else ())
+    pure = self.pure if pure is None else pure
+    return InstallContext(self.installing + (package,), install_base, pure)
 
 
 class Installer:
@@ -131,7 +245,9 @@ class Installer:
 
   def __init__(self, registry=None, upgrade=False, install_location='local',
       pip_separate_process=False, pip_use_target_option=False, recursive=False,
-      verbose=False):
+      verbose=False, jobs=None, optional_timeout=None, prefer=None, offline=False,
+      dedupe=False, placement=None, precompile=False):
+    assert prefer in (None, 'installed', 'cached'), prefer
     assert install_location in ('local', 'global', 'root')
     self.reg = [registry] if registry else _registry.RegistryClient.get_all()
     self.upgrade = upgrade
@@ -140,6 +256,19 @@ class Installer:
     self.pip_use_target_option = pip_use_target_option
     self.recursive = recursive
     self.verbose = verbose
+    self.jobs = jobs or pool.default_jobs()
+    self.optional_timeout = optional_timeout
+    self.prefer = prefer
+    self.offline = offline
+    self.dedupe = dedupe
+    self.placement = placement or _store.get_placement_strategy()
+    self.precompile = precompile
+    self.cache = _cache.ArchiveCache()
+    self.store = _store.ContentStore()
+    self.git_cache = _cache.GitCache()
+    self.stats = pipeline.StageStats()
+    self.scheduler = _scheduler.Scheduler(_scheduler.InstallHistory(
+        os.path.join(_cache.get_cache_directory(), 'install-times.json')))
     self.dirs = env.get_directories(install_location)
     self.dirs['reference_dir'] = os.path.dirname(self.dirs['packages'])
     self.script = _script.ScriptMaker(self.dirs['bin'], self.install_location)
@@ -148,35 +277,113 @@ class Installer:
       self.script.path.append(self.dirs['pip_bin'])
       self.script.pythonpath.extend([self.dirs['pip_lib']])
     self.installed_python_libs = {}
-    self.currently_installing = []  # stack of currently installing packages
-    self.install_base = []  # stack of last module that was installed internally
-    self.pure_stack = [False]  # stack of indicators that represent if a pure
-                               # installation is performed (pure => dont install scripts)
+    self.verified = set()  # (name, version, directory) of packages checked with --recursive
+    self.deferred = []  # optional dependencies, see install_deferred()
+    self.compile_dirs = set()  # see precompile_installed()
+    self.lock = threading.Lock()  # protects the containers above
+
+  def pip_pythonpath(self):
+    """
+    Returns the list of paths that Pip and the `setup.py` scripts it runs
+    need to find the packages installed by #Installer. Some setup scripts
+    import third party modules (fix for nodepy/ppym#10).
+    """
 
-  @contextlib.contextmanager
-  def pythonpath_update_context(self):
-    self._old_sys_path = sys.path[:]
-    self._old_pythonpath = os.getenv('PYTHONPATH', '')
-    # Restore the previous path.
     if nodepy.runtime.script:
-      sys.path[:] = nodepy.runtime.script['original_path']
-    # Add the path to the local Pip library path to sys.path and the PYTHONPATH
-    # environment variable to ensure that the current installation process can
-    # also find the already installed packages (some setup scripts might import
-    # third party modules). Fix for nodepy/ppym#10.
+      path = list(nodepy.runtime.script['original_path'])
+    else:
+      path = sys.path[:]
     if self.install_location != 'root':
-      sys.path[:] = [self.dirs['pip_lib']] + sys.path
-      os.environ['PYTHONPATH'] = os.path.abspath(self.dirs['pip_lib']) \
-          + os.pathsep + self._old_pythonpath
-    nodepy.utils.machinery.reload_pkg_resources('pkg_resources')
-    nodepy.utils.machinery.reload_pkg_resources('pip._vendor.pkg_resources')
+      path.insert(0, self.dirs['pip_lib'])
+    return path
+
+  def pip_environ(self):
+    """
+    Returns a copy of #os.environ with the `PYTHONPATH` variable extended
+    for running Pip as a separate process.
+    """
+
+    environ = os.environ.copy()
+    if self.install_location != 'root':
+      environ['PYTHONPATH'] = os.path.abspath(self.dirs['pip_lib']) \
+          + os.pathsep + environ.get('PYTHONPATH', '')
+    return environ
+
+  @contextlib.contextmanager
+  def pythonpath_update_context(self):
+    """
+    Updates #sys.path and the `PYTHONPATH` environment variable of the
+    current process to #pip_pythonpath() for running Pip in-process. Only
+    one thread can be inside this context at a time.
+    """
+
+    with _pip_lock:
+      old_sys_path = sys.path[:]
+      old_pythonpath = os.getenv('PYTHONPATH', '')
+      sys.path[:] = self.pip_pythonpath()
+      os.environ['PYTHONPATH'] = self.pip_environ().get('PYTHONPATH', '')
+      nodepy.utils.machinery.reload_pkg_resources('pkg_resources')
+      nodepy.utils.machinery.reload_pkg_resources('pip._vendor.pkg_resources')
+      try:
+        yield
+      finally:
+        sys.path[:] = old_sys_path
+        os.environ['PYTHONPATH'] = old_pythonpath
+        nodepy.utils.machinery.reload_pkg_resources('pkg_resources')
+        nodepy.utils.machinery.reload_pkg_resources('pip._vendor.pkg_resources')
+
+  @contextlib.contextmanager
+  def locked(self, filename, what):
+    """
+    Holds a #FileLock on *filename* for the duration of the context, which
+    protects *what* against concurrent nppm processes (and threads). The
+    time spent waiting for the lock is recorded in the `lock` stage of the
+    #stats.
+    """
+
+    lock = FileLock(filename, '  Waiting for {} to be released by another process...'.format(what))
+    lock.acquire()
+    self.stats.add('lock', lock.waited)
+    if lock.waited >= 1:
+      print('  Waited {:.1f}s for {}'.format(lock.waited, what))
     try:
       yield
     finally:
-      sys.path[:] = self._old_sys_path
-      os.environ['PYTHONPATH'] = self._old_pythonpath
-      nodepy.utils.machinery.reload_pkg_resources('pkg_resources')
-      nodepy.utils.machinery.reload_pkg_resources('pip._vendor.pkg_resources')
+      lock.release()
+
+  def target_lock_file(self, target_dir):
+    """
+    Returns the name of the lock file for the package directory
+    *target_dir*. Lock files can not be removed safely, thus they are kept
+    in the #LOCK_DIRECTORY of the packages directory instead of next to the
+    package directories, named by the hash of *target_dir*.
+    """
+
+    key = os.path.normcase(os.path.abspath(target_dir)).encode('utf8')
+    return os.path.join(self.dirs['packages'], LOCK_DIRECTORY,
+        hashlib.sha1(key).hexdigest() + '.lock')
+
+  @property
+  def store_directory(self):
+    return os.path.join(self.dirs['packages'], STORE_DIRECTORY)
+
+  def store_path(self, package_name, version):
+    """
+    Returns the directory in the #store_directory for the specified version
+    of a package.
+    """
+
+    return os.path.join(self.store_directory, *package_name.split('/')) + '@' + str(version)
+
+  def staging_directory(self):
+    """
+    Creates a new temporary directory for unpacking a package archive. It is
+    created on the same filesystem as the #store such that the unpacked
+    files can be moved into it.
+    """
+
+    _makedirs(self.store.tmp_dir)
+    return tempfile.mkdtemp(prefix='staging-', dir=self.store.tmp_dir)
 
   def _load_manifest(self, filename, directory=None, do_raise=True):
     if not directory:
@@ -190,19 +397,21 @@ class Installer:
       return None
     return mf
 
-  def find_package(self, package, internal=False):
+  def find_package(self, package, internal=False, ctx=None):
     """
     Finds an installed package and returns its #PackageManifest.
     Raises #PackageNotFound if the package could not be found, or possibly
     an #InvalidPackageManifest exception if the manifest is invalid.
+    With *internal*, the package is looked for in the innermost install
+    base of the #InstallContext *ctx*.
 
     If #Installer.strict is set, the package is only looked for in the target
     packages directory instead of all possibly inherited paths.
     """
 
     refstring.parse_package(package)
-    if internal and self.install_base:
-      dirname = os.path.join(self.install_base[-1][1], package)
+    if internal and ctx and ctx.install_base:
+      dirname = os.path.join(ctx.install_base[-1][1], env.MODULES_DIRECTORY, package)
     else:
       dirname = os.path.join(self.dirs['packages'], package)
 
@@ -235,10 +444,12 @@ class Installer:
     else:
       return self.uninstall_directory(manifest.directory)
 
-  def uninstall_directory(self, directory):
+  def uninstall_directory(self, directory, remove=True):
     """
     Uninstalls a package from a directory. Returns True on success, False
-    on failure.
+    on failure. Without *remove*, only the `pre-uninstall` script is run and
+    the scripts and link file of the package are removed, as the directory
+    is about to be replaced (see #_swap_directory()).
     """
 
     link_fn = os.path.join(directory + env.LINK_SUFFIX)
@@ -253,8 +464,9 @@ class Installer:
     except (OSError, IOError) as exc:
       if exc.errno != errno.ENOENT:
         raise
-      print('Removing previous directory: "{}"'.format(directory))
-      shutil.rmtree(directory)
+      if remove:
+        print('Removing previous directory: "{}"'.format(directory))
+        shutil.rmtree(directory)
       return True
     except InvalidPackageManifest as exc:
       print('Can not uninstall: directory "{}": Invalid manifest": {}'.format(directory, exc))
@@ -273,21 +485,16 @@ class Installer:
       return False
 
 
-    for script_name in mf.get('bin', {}).keys():
-      for script_name in self.expand_script_name(script_name):
-        for filename in self.script.get_files_for_script_name(script_name):
-          print('  * Removing script {} ... '.format(os.path.basename(filename)), end='')
-          try:
-            os.remove(filename)
-          except OSError as e:
-            print('ERROR ({})'.format(e))
-          else:
-            print('OK')
+    record = _record.InstalledFiles.load(directory)
+    if record is not None:
+      self._remove_scripts(record.scripts)
+    else:
+      self._remove_scripts(self._script_files(mf.get('bin', {})))
 
-    if os.path.isdir(directory):
+    if remove and os.path.isdir(directory):
       print('  * Removing package directory {} ... '.format(os.path.basename(directory)), end='')
       try:
-        _rmtree(directory)
+        _remove_later(directory)
       except OSError as e:
         print('ERROR ({})'.format(e))
       else:
@@ -304,38 +511,141 @@ class Installer:
 
     return True
 
-  def install_dependencies_for(self, manifest, dev=False, internal=False):
+  def _script_files(self, bin_field):
+    """
+    Returns the files of the scripts that are created for the `bin` field
+    *bin_field* of a package manifest. Used to uninstall packages that have
+    no #record.InstalledFiles.
+    """
+
+    return [filename for script_name in bin_field.keys()
+            for script_name in self.expand_script_name(script_name)
+            for filename in self.script.get_files_for_script_name(script_name)]
+
+  def _remove_scripts(self, filenames):
+    for filename in filenames:
+      if not os.path.lexists(filename):
+        continue
+      print('  * Removing script {} ... '.format(os.path.basename(filename)), end='')
+      try:
+        os.remove(filename)
+      except OSError as e:
+        print('ERROR ({})'.format(e))
+      else:
+        print('OK')
+
+  def _previous_record(self, directory):
+    """
+    Returns the #record.InstalledFiles of the package installed in
+    *directory* if it can be upgraded incrementally, that is if it is a
+    regular package directory with a record and without a `pre-uninstall`
+    script.
+    """
+
+    if os.path.isfile(directory + env.LINK_SUFFIX) or not os.path.isdir(directory):
+      return None
+    previous = _record.InstalledFiles.load(directory)
+    if previous is None:
+      return None
+    try:
+      mf = self._load_manifest(os.path.join(directory, PACKAGE_MANIFEST))
+    except (IOError, OSError, InvalidPackageManifest):
+      return None
+    if 'pre-uninstall' in mf.get('scripts', {}):
+      return None
+    print('  Upgrading "{}" incrementally'.format(mf.identifier))
+    return previous
+
+  def _place_files(self, manifest, target_dir, stored, staged, previous=None,
+                   previous_dir=None):
+    """
+    Places the files of the package *manifest* in *target_dir*. With
+    *stored*, they are placed from the #store (and added to it first if
+    necessary, moving them if they are *staged*), otherwise they are copied.
+    If the #record.InstalledFiles record of the *previous* installation in
+    *previous_dir* is specified, files that did not change are hardlinked
+    from there and only files that were added or changed are written.
+
+    # Returns
+    A new #record.InstalledFiles for the package (without `bin`).
+    """
+
+    if stored:
+      index = self.store.get(manifest['name'], manifest['version'])
+      if index is None:
+        with self.locked(self.store.lock_file(manifest['name'], manifest['version']),
+            'the stored files of "{}"'.format(manifest.identifier)):
+          index = self.store.get(manifest['name'], manifest['version'])
+          if index is None:
+            index = self.store.add(manifest['name'], manifest['version'],
+                walk_package_files(manifest), move=staged)
+      files = collections.OrderedDict((e[0], [e[3], e[1]]) for e in index)
+    else:
+      sources = collections.OrderedDict((rel.replace(os.sep, '/'), src)
+          for src, rel in walk_package_files(manifest))
+      files = _record.describe_files(((v, k) for k, v in sources.items()), self.jobs)
+
+    changed = list(files)
+    if previous is not None:
+      unchanged = []
+      for rel, value in files.items():
+        src = os.path.join(previous_dir, *rel.split('/'))
+        if previous.files.get(rel) == value and os.path.isfile(src) \
+            and os.path.getsize(src) == value[0]:
+          unchanged.append((src, rel))
+      print('  {} of {} files changed, {} removed'.format(len(files) - len(unchanged),
+          len(files), sum(1 for rel in previous.files if rel not in files)))
+      _fileops.copy_files(unchanged, target_dir, 'hardlink', self.jobs)
+      _fileops.copy_files(_bytecode.cached_files(unchanged), target_dir, 'hardlink', self.jobs)
+      unchanged = set(rel for __, rel in unchanged)
+      changed = [rel for rel in files if rel not in unchanged]
+
+    if stored:
+      changed = set(changed)
+      index = [e for e in index if e[0] in changed]
+      print('  Placing {} files ({}) ...'.format(len(index), self.placement))
+      self.store.place(index, target_dir, self.placement)
+    else:
+      print('  Copying {} files ...'.format(len(changed)))
+      _fileops.copy_files([(sources[rel], rel) for rel in changed], target_dir, jobs=self.jobs)
+    return _record.InstalledFiles(files)
+
+  def install_dependencies_for(self, manifest, dev=False, internal=False, ctx=None):
     """
     Installs the Node.py and Python dependencies of a #PackageManifest.
     """
 
+    ctx = ctx or InstallContext()
     deps = manifest.eval_fields(env.cfgvars(dev), 'dependencies', {})
     if deps:
       print('Installing dependencies for "{}"{}...'.format(manifest.identifier,
           ' (dev) ' if dev else ''))
-      if not self.install_dependencies(deps, manifest.directory):
+      if not self.install_dependencies(deps, manifest.directory, ctx):
         return False
 
     deps = manifest.eval_fields(env.cfgvars(dev), 'pip_dependencies', {})
     if deps:
       print('Installing Python dependencies for "{}"{}...'.format(
           manifest.identifier, ' (dev) ' if dev else ''))
-      if not self.install_python_dependencies(deps):
+      if not self.install_python_dependencies(deps, ctx=ctx):
         return False
 
     return True
 
-  def install_dependencies(self, deps, current_dir):
+  def install_dependencies(self, deps, current_dir, ctx=None):
     """
-    Install all dependencies specified in the dictionary *deps*.
+    Install all dependencies specified in the dictionary *deps* in the
+    #InstallContext *ctx*.
     """
 
+    ctx = ctx or InstallContext()
     install_deps = []
+    satisfied = []
     for name, req in deps.items():
       if not isinstance(req, manifest.Requirement):
         req = manifest.Requirement.from_line(req, name=name)
       try:
-        have_package = self.find_package(name, req.internal)
+        have_package = self.find_package(name, req.internal, ctx)
         if isinstance(have_package, InvalidPackage):
           raise PackageNotFound
       except PackageNotFound as exc:
@@ -353,34 +663,244 @@ class Installer:
           print('  Skipping "{}" dependency, have "{}" installed'
             .format(req.type, name, have_package.identifier))
         if self.recursive:
-          self.install_dependencies_for(have_package)
-
-    if not install_deps:
-      return True
+          satisfied.append(have_package)
 
+    required = []
     for name, req in install_deps:
-      print('  Installing "{}" ({})'.format(name, req))
-      if req.type == 'registry':
-        if not self.install_from_registry(name, req.selector, internal=req.internal, regs=req.registry)[0]:
-          return False
-      elif req.type == 'git':
-        if not self.install_from_git(req.git_url, req.recursive, req.internal)[0]:
-          return False
-      elif req.type == 'path':
-        path = req.path
-        if not os.path.isabs(path):
-          path = os.path.join(current_dir, path)
-        if not self.install_from_directory(path, req.link, internal=req.internal)[0]:
-          return False
+      if req.optional:
+        print('  Deferring optional dependency "{}" ({})'.format(name, req))
+        with self.lock:
+          self.deferred.append((name, req, current_dir, ctx))
       else:
-        raise RuntimeError('unexpected dependency data: "{}" -> {!r}'.format(name, req))
+        required.append((name, req))
 
+    # Overlap downloading and unpacking of multiple registry dependencies.
+    registry_deps = [(name, req) for name, req in required if req.type == 'registry']
+    if len(registry_deps) > 1 and self.jobs > 1:
+      if not self.install_registry_dependencies(registry_deps, ctx):
+        return False
+      required = [(name, req) for name, req in required if req.type != 'registry']
+
+    for name, req in self.scheduler.by_priority(required):
+      if not self.install_dependency(name, req, current_dir, ctx):
+        return False
+
+    if satisfied:
+      return self.verify_dependencies(satisfied, ctx)
     return True
 
-  def install_python_dependencies(self, deps, args=()):
+  def install_workspace(self, root, members, dev=False):
+    """
+    Installs the workspace *root* and its *members* (lists of
+    #PackageManifest, see #find_workspace_members()). All packages are
+    linked into the packages directory in develop mode, thus they resolve
+    each other, and their dependencies are installed as one set: a
+    dependency that is shared between members is installed only once and the
+    Pip dependencies of all members are installed in a single Pip run.
+
+    If members require a dependency in different ways, the first requirement
+    is used and a warning is printed for the others.
+
+    Returns True on success, False on failure.
+    """
+
+    ctx = InstallContext()
+    packages = [root] + list(members)
+    names = set(mf['name'] for mf in packages)
+    deps = collections.OrderedDict()
+    pip_deps = collections.OrderedDict()
+    for mf in packages:
+      for name, req in mf.eval_fields(env.cfgvars(dev), 'dependencies', {}).items():
+        if name in names:
+          continue
+        if not isinstance(req, manifest.Requirement):
+          req = manifest.Requirement.from_line(req, name=name)
+        if req.type == 'path' and not os.path.isabs(req.path):
+          req.path = os.path.normpath(os.path.join(mf.directory, req.path))
+        if name in deps and str(deps[name]) != str(req):
+          print('Warning: "{}" requires "{}" as "{}", using "{}"'.format(
+              mf.identifier, name, req, deps[name]))
+          continue
+        deps.setdefault(name, req)
+      merge_pip_dependencies(pip_deps, mf.eval_fields(env.cfgvars(dev), 'pip_dependencies', {}))
+
+    print('Linking {} workspace packages...'.format(len(packages)))
+    for mf in packages:
+      if not self.install_from_directory(mf.directory, develop=True, dev=dev,
+          dependencies=False, ctx=ctx)[0]:
+        return False
+
+    if deps:
+      print('Installing dependencies of the workspace{}...'.format(' (dev)' if dev else ''))
+      if not self.install_dependencies(deps, root.directory, ctx):
+        return False
+    if pip_deps:
+      print('Installing Python dependencies of the workspace{}...'.format(' (dev)' if dev else ''))
+      if not self.install_python_dependencies(pip_deps, ctx=ctx):
+        return False
+    return True
+
+  def install_dependency(self, name, req, current_dir, ctx=None):
+    """
+    Installs a single dependency *name* described by the #manifest.Requirement
+    *req*. Relative paths are resolved from *current_dir*. Returns True on
+    success, False on failure.
+    """
+
+    print('  Installing "{}" ({})'.format(name, req))
+    if req.type == 'registry':
+      return self.install_from_registry(name, req.selector, internal=req.internal,
+          regs=req.registry, ctx=ctx)[0]
+    elif req.type == 'git':
+      return self.install_from_git(req.git_url, req.recursive, req.internal, ctx=ctx)[0]
+    elif req.type == 'path':
+      path = req.path
+      if not os.path.isabs(path):
+        path = os.path.join(current_dir, path)
+      return self.install_from_directory(path, req.link, internal=req.internal, ctx=ctx)[0]
+    else:
+      raise RuntimeError('unexpected dependency data: "{}" -> {!r}'.format(name, req))
+
+  def install_deferred(self):
+    """
+    Installs the optional dependencies that #install_dependencies() deferred
+    until after all required dependencies were installed. The failure of an
+    optional dependency is reported but does not fail the installation.
+
+    If #optional_timeout is set, optional dependencies that were not started
+    within that many seconds are skipped.
+
+    Returns True if all optional dependencies were installed, False if at
+    least one of them failed or was skipped.
+    """
+
+    if not self.deferred:
+      return True
+
+    print('Installing optional dependencies...')
+    start = time.time()
+    failed = []
+    while True:
+      with self.lock:
+        if not self.deferred:
+          break
+        name, req, current_dir, ctx = self.deferred.pop(0)
+      if self.optional_timeout is not None and time.time() - start >= self.optional_timeout:
+        print('  Skipping optional dependency "{}" (time budget of {}s exceeded)'
+            .format(name, self.optional_timeout))
+        failed.append(name)
+        continue
+
+      try:
+        success = self.install_dependency(name, req, current_dir, ctx)
+      except Exception:
+        traceback.print_exc()
+        success = False
+      if not success:
+        print('  Warning: optional dependency "{}" could not be installed'.format(name))
+        failed.append(name)
+
+    if failed:
+      print('Warning: {} optional dependencies were not installed: {}'
+          .format(len(failed), ', '.join(failed)))
+    return not failed
+
+  def precompile_installed(self, jobs=None):
+    """
+    Compiles the Python files of the packages and Pip libraries that were
+    installed since the last call to bytecode, if #precompile is enabled.
+    Only files without up-to-date bytecode are compiled, using up to *jobs*
+    processes (defaults to the number of CPUs). The time spent is recorded
+    in the `precompile` stage of the #stats.
+    """
+
+    with self.lock:
+      directories = sorted(self.compile_dirs)
+      self.compile_dirs.clear()
+    if not directories:
+      return
+
+    print('Compiling Python files to bytecode...')
+    start = time.time()
+    with self.stats.measure('precompile'):
+      files = [x for directory in directories for x in _bytecode.source_files(directory)]
+      compiled, failed, fresh = _bytecode.compile_files(files, jobs)
+    print('  Compiled {} files in {:.1f}s ({} up to date, {} left to compile on import)'
+        .format(compiled, time.time() - start, fresh, failed))
+
+  def verify_dependencies(self, manifests, ctx=None):
+    """
+    Ensures recursively that the dependencies of the installed packages
+    *manifests* are satisfied (used with `-R,--recursive`). Every package is
+    visited only once per #Installer, identified by its name, version and
+    directory, which makes diamond-shaped and cyclic trees cheap to check.
+
+    The lookups for one level of the tree are distributed over #jobs threads.
+    Missing dependencies are installed from the calling thread and the Pip
+    dependencies of all visited packages are passed to Pip in a single run.
+    """
+
+    pip_deps = collections.OrderedDict()
+    queue = list(manifests)
+    while queue:
+      level = []
+      with self.lock:
+        for mf in queue:
+          key = (mf['name'], mf.get('version'), os.path.normcase(os.path.abspath(mf.directory)))
+          if key not in self.verified:
+            self.verified.add(key)
+            level.append(mf)
+
+      queue = []
+      check = lambda mf: self._check_dependencies(mf, ctx)
+      for mf, found, missing in pool.map_threaded(check, level, self.jobs):
+        queue.extend(found)
+        if missing:
+          print('Installing missing dependencies for "{}"...'.format(mf.identifier))
+          if not self.install_dependencies(collections.OrderedDict(missing), mf.directory, ctx):
+            return False
+        merge_pip_dependencies(pip_deps, mf.eval_fields(env.cfgvars(False), 'pip_dependencies', {}))
+
+    if pip_deps:
+      print('Installing Python dependencies of satisfied dependencies...')
+      return self.install_python_dependencies(pip_deps, ctx=ctx)
+    return True
+
+  def _check_dependencies(self, mf, ctx=None):
+    """
+    Looks up the dependencies of the installed package *mf* without
+    modifying any state. Used by #verify_dependencies() from worker threads.
+    Dependencies that are installed in a version that does not satisfy the
+    requirement are reported like in #install_dependencies().
+
+    # Returns
+    (mf, found, missing) where *found* is a list of the installed dependency
+    manifests and *missing* is a list of `(name, req)` tuples.
+    """
+
+    found, missing = [], []
+    for name, req in mf.eval_fields(env.cfgvars(False), 'dependencies', {}).items():
+      if not isinstance(req, manifest.Requirement):
+        req = manifest.Requirement.from_line(req, name=name)
+      try:
+        have_package = self.find_package(name, req.internal, ctx)
+      except PackageNotFound:
+        missing.append((name, req))
+        continue
+      if isinstance(have_package, InvalidPackage):
+        missing.append((name, req))
+      elif have_package is not None:
+        if req.type == 'registry' and not req.selector(semver.Version(have_package['version'])):
+          print('  Warning: Dependency "{}@{}" of "{}" unsatisfied, have "{}" installed'
+              .format(name, req.selector, mf.identifier, have_package.identifier))
+        found.append(have_package)
+    return mf, found, missing
+
+  def install_python_dependencies(self, deps, args=(), ctx=None):
     """
     Install all Python dependencies specified in *deps* using Pip. Make sure
-    to call #relink_pip_scripts().
+    to call #relink_pip_scripts(). If the #InstallContext *ctx* has an
+    install base, the dependencies are installed into that package.
     """
 
     install_modules = []
@@ -392,8 +912,8 @@ class Installer:
 
     # TODO: Upgrade strategy?
 
-    if self.install_base:
-      locs = env.pip_locations_for(self.install_base[-1][1])
+    if ctx and ctx.install_base:
+      locs = env.pip_locations_for(ctx.install_base[-1][1])
     elif self.install_location in ('local', 'global'):
       locs = self.dirs
     elif self.install_location == 'root':
@@ -409,6 +929,10 @@ class Installer:
     else:
       cmd = []
 
+    if self.offline:
+      cmd += ['--no-index', '--find-links', _cache.get_pip_directory()]
+      for directory in _cache.get_readonly_cache_directories():
+        cmd += ['--find-links', os.path.join(directory, 'pip')]
     cmd.extend(args)
     cmd.extend(install_modules)
     if self.ignore_installed:
@@ -417,21 +941,31 @@ class Installer:
       cmd += ['--upgrade']
     if self.verbose:
       cmd.append('--verbose')
+    if self.precompile and locs:
+      # Pip compiles one file after another; see #precompile_installed().
+      cmd.append('--no-compile')
+      with self.lock:
+        self.compile_dirs.add(locs['pip_lib'])
 
     print('  Installing Python dependencies via Pip:', ' '.join(cmd),
         '(as a separate process)' if self.pip_separate_process else '')
-    with brewfix(), self.pythonpath_update_context():
+    index_lock = os.path.join(self.dirs['packages'], INDEX_LOCK)
+    with self.scheduler('pip'), self.locked(index_lock, 'the install location'), \
+        brewfix(), self.stats.measure('pip'):
       if self.pip_separate_process:
-        res = subprocess.call([sys.executable, '-m', 'pip', 'install'] + cmd)
+        res = subprocess.call([sys.executable, '-m', 'pip', 'install'] + cmd,
+            env=self.pip_environ())
       else:
-        res = InstallCommand('install', 'installs stuff').main(cmd)
+        with self.pythonpath_update_context():
+          res = InstallCommand('install', 'installs stuff').main(cmd)
       if res != 0:
         print('Error: `pip install` failed with exit-code', res)
         return False
 
-      # Important to use this function from within the updated pythonpath context.
-      for dep_name in deps:
-        self.installed_python_libs[dep_name] = env.get_module_dist_info(dep_name)
+    pythonpath = [locs['pip_lib']] + sys.path if locs else None
+    dist_infos = [(dep_name, env.get_module_dist_info(dep_name, pythonpath)) for dep_name in deps]
+    with self.lock:
+      self.installed_python_libs.update(dist_infos)
 
     return True
 
@@ -467,7 +1001,7 @@ class Installer:
         print('  Creating', script_name, 'from', target_prog, '...')
         self.script.make_wrapper(script_name, prefix + [target_prog])
 
-  def install_from_requirement(self, req, dev=False):
+  def install_from_requirement(self, req, dev=False, ctx=None):
     """
     Installs from a requirement line or object.
     """
@@ -482,17 +1016,20 @@ class Installer:
 
     if req.selector:
       return self.install_from_registry(req.name, req.selector, dev=dev,
-        registry=registry, internal=req.internal, pure=req.pure)
+        registry=registry, internal=req.internal, pure=req.pure, ctx=ctx)
     if req.git_url:
-      return self.install_from_git(req.git_url, req.recursive, internal=req.internal, pure=req.pure)
+      return self.install_from_git(req.git_url, req.recursive, internal=req.internal,
+        pure=req.pure, ctx=ctx)
     if req.path:
       if os.path.isfile(req.path):
         if req.link:
           print('Warning: Can not install in develop mode from archive "{}"'
             .format(req.path))
-        success, mnf = self.install_from_archive(req.path, dev=dev, internal=req.internal, pure=req.pure)
+        success, mnf = self.install_from_archive(req.path, dev=dev,
+          internal=req.internal, pure=req.pure, ctx=ctx)
       else:
-        success, mnf = self.install_from_directory(req.path, req.link, dev=dev, internal=req.internal, pure=req.pure)
+        success, mnf = self.install_from_directory(req.path, req.link, dev=dev,
+          internal=req.internal, pure=req.pure, ctx=ctx)
       info = (mnf['name'], mnf['version']) if success else None
       return success, info
 
@@ -506,9 +1043,9 @@ class Installer:
     else:
       return [script_name]
 
-  @decorators.finally_()
   def install_from_directory(self, directory, develop=False, dev=False,
-      expect=None, movedir=False, internal=False, pure=None):
+      expect=None, movedir=False, internal=False, pure=None, dependencies=True,
+      staged=False, ctx=None):
     """
     Installs a package from a directory. The directory must have a
     `nodepy.json` file. If *expect* is specified, it must be a tuple of
@@ -529,11 +1066,20 @@ class Installer:
       install.
     internal (bool): Install as an internal dependency.
     pure (bool): Don't install command-line scripts (`"bin"` section).
+      Inherited from *ctx* if #None.
+    dependencies (bool): False to skip installing the package's
+      dependencies. Used by #install_workspace().
+    staged (bool): *directory* is a temporary directory that an archive was
+      unpacked into; its files are moved into the #store instead of copied.
+    ctx (InstallContext): The context to install the package in. The
+      package's dependencies are installed in a context derived from it.
 
     # Returns
     (success, manifest)
     """
 
+    ctx = ctx or InstallContext()
+    start = time.time()
     filename = os.path.normpath(os.path.abspath(os.path.join(directory, PACKAGE_MANIFEST)))
 
     try:
@@ -549,151 +1095,282 @@ class Installer:
 
     if expect is not None and (
         manifest['name'] != expect[0] or
-        (expect[1] and manifest['version'] != expect[1])):
+        (expect[1] and semver.Version(manifest['version']) != semver.Version(expect[1]))):
       print('Error: Expected to install "{}@{}" but got "{}" in "{}"'
           .format(expect[0], expect[1], manifest.identifier, directory))
       return False, manifest
 
-    if pure is None:
-      pure = self.pure_stack[-1]
-    else:
-      self.pure_stack.append(pure)
-      decorators.finally_(lambda: self.pure_stack.pop())
-
     # Determine our final install directory.
-    if self.install_base:
+    if ctx.install_base:
       print('Installing "{}" as internal dependency of "{}" ...'.format(
-        manifest.identifier, self.install_base[-1][0].identifier))
-      target_dir = os.path.join(self.install_base[-1][1], env.MODULES_DIRECTORY, manifest['name'])
+        manifest.identifier, ctx.install_base[-1][0].identifier))
+      target_dir = os.path.join(ctx.install_base[-1][1], env.MODULES_DIRECTORY, manifest['name'])
     else:
       print('Installing "{}"...'.format(manifest.identifier))
       target_dir = os.path.join(self.dirs['packages'], manifest['name'])
 
-    # Push onto the stack of currently installing packages
-    self.currently_installing.append((manifest, directory if develop else target_dir))
-    decorators.finally_(lambda: self.currently_installing.pop())
-
-    if internal and self.currently_installing:
-      # Push the installation directory on the stack.
-      self.install_base.append(self.currently_installing[-1])
-      decorators.finally_(lambda: self.install_base.pop())
-
-    # Error if the target directory already exists. The package must be
-    # uninstalled before it can be installed again.
-    if os.path.exists(target_dir):
-      if not self.upgrade:
-        print('  Note: install directory "{}" already exists, specify --upgrade'.format(target_dir))
+    # With #dedupe, internal dependencies are installed once per version into
+    # the store and only linked into the modules directory of their parent.
+    link_dir = None
+    if self.dedupe and ctx.install_base and not develop and not movedir:
+      link_dir, target_dir = target_dir, self.store_path(manifest['name'], manifest['version'])
+      if os.path.isdir(link_dir):
+        if not self.upgrade:
+          print('  Note: install directory "{}" already exists, specify --upgrade'.format(link_dir))
+          return True, manifest
+        if not self.uninstall_directory(link_dir):
+          return False, manifest
+      if os.path.isdir(target_dir):
+        print('  Linking "{}" from "{}"'.format(manifest.identifier, target_dir))
+        write_link_file(link_dir, target_dir)
         return True, manifest
-      if not self.uninstall_directory(target_dir):
-        return False, manifest
 
-    installed_files = []
+    # The context for the dependencies of this package.
+    ctx = ctx.push((manifest, directory if develop else target_dir), internal, pure)
+    pure = ctx.pure
+
+    # Error if the target directory already exists, unless it is upgraded.
+    # A package that can be upgraded incrementally (see #_previous_record())
+    # reuses the unchanged files of the previous installation, any other
+    # package is only uninstalled once its replacement is ready.
+    # Other processes that install to the same location are kept out of the
+    # target directory with a lock file next to it. The staging and trash
+    # directories that an interrupted installation left next to the target
+    # directory are removed under the lock.
+    target_lock = self.target_lock_file(target_dir)
+    target_what = 'package directory "{}"'.format(target_dir)
+    previous = None
+    record = None
+    stage = None
+    with self.locked(target_lock, target_what):
+      _sweep_temporary(target_dir)
+      if os.path.exists(target_dir):
+        if not self.upgrade:
+          print('  Note: install directory "{}" already exists, specify --upgrade'.format(target_dir))
+          return True, manifest
+        if not develop and not movedir:
+          previous = self._previous_record(target_dir)
+
+      # The movedir option is used for installing from Git repositories. The
+      # clone is already next to the target directory and becomes its
+      # staging directory, which is swapped in after the dependencies are
+      # installed (which go to the modules directory of the target directory).
+      if movedir:
+        stage = _temporary_directory('.tmp-', target_dir)
+        os.rmdir(stage)
+        os.rename(directory, stage)
+        manifest = self._load_manifest(os.path.join(stage, PACKAGE_MANIFEST))
+        directory = target_dir
 
-    # The movedir option is used for installing from Git repositories.
-    # We should move the Git directory to the target directory immediately
-    # as subsequent steps can write into that target directory and moving
-    # later would actually require us to do a merge.
-    if movedir:
-      print('Moving "{}" to "{}" ...'.format(manifest.identifier, target_dir))
-      _makedirs(os.path.dirname(target_dir))
-      shutil.move(directory, target_dir)
-      installed_files.append(target_dir)
-      directory = target_dir
+    installed_files = []
 
     plc = PackageLifecycle(manifest=manifest)
     try:
-      plc.run('pre-install', [], script_only=True)
+      with self.stats.measure('lifecycle'):
+        plc.run('pre-install', [], script_only=True)
     except:
       traceback.print_exc()
       print('Error: pre-install script failed.')
+      if movedir:
+        _rmtree(stage, ignore_errors=True)
       return False, manifest
 
     # Install dependencies.
-    if not self.install_dependencies_for(manifest, dev=dev):
+    deps_start = time.time()
+    if dependencies and not self.install_dependencies_for(manifest, dev=dev, ctx=ctx):
+      if movedir:
+        _rmtree(stage, ignore_errors=True)
       return False, manifest
+    deps_time = time.time() - deps_start
+
+    # The record of the previous installation is read again as another
+    # process may have replaced it while the dependencies were installed.
+    with self.locked(target_lock, target_what):
+      if previous is not None:
+        previous = self._previous_record(target_dir)
+      bin_field = {} if pure else manifest.get('bin', {})
 
-    if not movedir:
       print('Installing "{}" to "{}" ...'.format(manifest.identifier, target_dir))
-      if develop:
-        # Create a link file that contains the path to the actual package directory.
-        print('  Creating "{}"...'.format(os.path.basename(target_dir) + env.LINK_SUFFIX))
-        linkfn = os.path.join(target_dir + env.LINK_SUFFIX)
-        _makedirs(os.path.dirname(linkfn))
-        with open(linkfn, 'w') as fp:
-          fp.write(os.path.abspath(directory))
-        installed_files.append(linkfn)
-      else:
-        _makedirs(target_dir)
-        for src, rel in walk_package_files(manifest):
-          dst = os.path.join(target_dir, rel)
-          _makedirs(os.path.dirname(dst))
-          print('  Copying', rel, '...')
-          shutil.copyfile(src, dst)
-          installed_files.append(dst)
-
-    if not pure:
-      # Create scripts for the 'bin' field in the package manifest.
-      for script_name, filename in manifest.get('bin', {}).items():
-        script_names = self.expand_script_name(script_name)
-        for script_name in script_names:
-          print('  Installing script "{}" to "{}"...'.format(script_name, self.script.directory))
-          filename = os.path.abspath(os.path.join(target_dir, filename))
-          installed_files += self.script.make_nodepy(
-              script_name, filename)
-
-    # Write down the names of the installed files.
-    #with open(os.path.join(target_dir, env.INSTALLED_FILES), 'w') as fp:
-    #  for fn in installed_files:
-    #    fp.write(fn)
-    #    fp.write('\n')
+      if not develop and not movedir:
+        # The files are placed in a staging directory next to the target
+        # directory, which is then swapped in with a rename.
+        with self.stats.measure('place'):
+          _makedirs(os.path.dirname(target_dir))
+          stage = _temporary_directory('.tmp-', target_dir)
+          try:
+            record = self._place_files(manifest, stage, expect is not None,
+                staged, previous, target_dir)
+          except:
+            _rmtree(stage, ignore_errors=True)
+            raise
+
+      try:
+        # Run the pre-uninstall script and remove the scripts of a previous
+        # installation that is replaced entirely. The directory itself is
+        # replaced by #_swap_directory(), or removed for a link file.
+        if previous is None and os.path.lexists(target_dir):
+          if not self.uninstall_directory(target_dir, remove=develop):
+            return False, manifest
+
+        # Create scripts for the 'bin' field in the package manifest. They are
+        # kept if an incremental upgrade does not change the field.
+        if previous is not None and previous.bin == bin_field:
+          scripts = previous.scripts
+        else:
+          if previous is not None:
+            self._remove_scripts(previous.scripts)
+          scripts = []
+          for script_name, filename in bin_field.items():
+            script_names = self.expand_script_name(script_name)
+            for script_name in script_names:
+              print('  Installing script "{}" to "{}"...'.format(script_name, self.script.directory))
+              filename = os.path.abspath(os.path.join(target_dir, filename))
+              with self.stats.measure('scripts'):
+                scripts += self.script.make_nodepy(script_name, filename)
+        installed_files += scripts
+
+        if develop:
+          # Create a link file that contains the path to the actual package directory.
+          print('  Creating "{}"...'.format(os.path.basename(target_dir) + env.LINK_SUFFIX))
+          installed_files.append(write_link_file(target_dir, directory))
+        else:
+          if movedir:
+            # Only the files of the package are kept from the clone (not
+            # `.git/` or the files that are excluded), as in the record.
+            record = _record.InstalledFiles(_record.describe_files(
+                walk_package_files(manifest), self.jobs))
+            _prune_directory(stage, record.files)
+          record.bin, record.scripts = bin_field, scripts
+          record.save(stage)
+          _makedirs(os.path.dirname(target_dir))
+          _swap_directory(stage, target_dir)
+          stage = None
+          installed_files += [os.path.join(target_dir, *rel.split('/')) for rel in record.files]
+      finally:
+        if stage is not None:
+          _rmtree(stage, ignore_errors=True)
+
+    if self.precompile and not develop:
+      with self.lock:
+        self.compile_dirs.add(target_dir)
 
     try:
-      plc.run('post-install', [], script_only=True, directory=target_dir, globals={'installer': self})
+      with self.stats.measure('lifecycle'):
+        plc.run('post-install', [], script_only=True, directory=target_dir, globals={'installer': self, 'install_context': ctx})
     except:
       traceback.print_exc()
       print('Error: post-install script failed.')
       return False, manifest
 
+    if link_dir:
+      print('  Linking "{}" from "{}"'.format(manifest.identifier, target_dir))
+      write_link_file(link_dir, target_dir)
+
+    self.scheduler.history.record(manifest['name'], time.time() - start - deps_time,
+        manifest.eval_fields(env.cfgvars(dev), 'dependencies', {}).keys())
     return True, manifest
 
-  def install_from_archive(self, archive, dev=False, expect=None, pure=None):
+  def install_from_archive(self, archive, dev=False, expect=None, internal=False,
+                           pure=None, ctx=None):
     """
     Install a package from an archive.
     """
 
-    directory = tempfile.mkdtemp(suffix='_' + os.path.basename(archive) + '_unpacked')
     print('Unpacking "{}"...'.format(archive))
+    directory = _extract_archive(archive, self.staging_directory())
     try:
-      with tarfile.open(archive) as tar:
-        tar.extractall(directory)
-      return self.install_from_directory(directory, dev=dev, expect=expect, pure=pure)
+      return self.install_from_directory(directory, dev=dev, expect=expect,
+        internal=internal, pure=pure, staged=True, ctx=ctx)
     finally:
       _rmtree(directory)
 
-  def install_from_registry(self, package_name, selector, dev=False, regs=None,
-                            internal=False, pure=None):
+  def find_installed_elsewhere(self, package_name, selector):
     """
-    Install a package from a registry.
+    Looks for a version of *package_name* that satisfies *selector* in the
+    packages directories of the other install locations. Returns the
+    package's manifest or #None. Used with `--prefer-installed`.
+    """
+
+    for location in ('local', 'global', 'root'):
+      packages_dir = env.get_directories(location)['packages']
+      if os.path.abspath(packages_dir) == os.path.abspath(self.dirs['packages']):
+        continue
+      filename = os.path.join(packages_dir, package_name, PACKAGE_MANIFEST)
+      if not os.path.isfile(filename):
+        continue
+      try:
+        mf = self._load_manifest(filename)
+      except InvalidPackageManifest:
+        continue
+      if selector(semver.Version(mf['version'])):
+        return mf
+    return None
+
+  def resolve_from_registry(self, package_name, selector, regs=None,
+                            internal=False, progress=True, priority=0, ctx=None):
+    """
+    Determines where the package *package_name* matching *selector* will be
+    installed from and downloads its archive if necessary. This does not
+    modify the state of the #Installer and may be called from worker threads
+    (in which case *progress* should be False).
+
+    With #prefer set to `'installed'`, a version that is already installed
+    and satisfies *selector* is kept even with #upgrade, or copied from
+    another install location. With #prefer set to `'cached'` (also implied
+    by `'installed'`), the newest cached or stored version that satisfies
+    *selector* is used without contacting the registry. With #offline, only
+    cached and stored versions are considered and the package can not be
+    located if there is none that satisfies *selector* (see `nppm fetch`).
+
+    Registry requests hold a `connections` slot of the #scheduler with the
+    specified *priority*.
 
     # Returns
-    (success, (package_name, package_version))
+    A #Resolution or #None if the package could not be located.
     """
 
     # Check if the package already exists.
     try:
-      package = self.find_package(package_name, internal)
+      package = self.find_package(package_name, internal, ctx)
       if isinstance(package, InvalidPackage):
         raise PackageNotFound
     except PackageNotFound:
       pass
     else:
-      if not selector(package.version):
+      version = semver.Version(package['version'])
+      satisfied = selector(version)
+      if not satisfied:
         print('  Warning: Dependency "{}@{}" unsatisfied, have "{}" installed'
             .format(package_name, selector, package.identifier))
+      if satisfied and self.prefer == 'installed':
+        print('package "{}" already installed'.format(package.identifier))
+        return Resolution('installed', package['name'], version, package.directory)
       if not self.upgrade:
-        print('package "{}@{}" already installed, specify --upgrade'.format(
-            package.name, package.version))
-        return True, (package.name, package.version)
+        print('package "{}" already installed, specify --upgrade'.format(
+            package.identifier))
+        return Resolution('installed', package['name'], version, package.directory)
+
+    if self.prefer == 'installed':
+      package = self.find_installed_elsewhere(package_name, selector)
+      if package is not None:
+        print('Re-using "{}" from "{}"...'.format(package.identifier, package.directory))
+        return Resolution('directory', package_name,
+            semver.Version(package['version']), package.directory)
+
+    if self.prefer in ('installed', 'cached') or self.offline:
+      stored = self.store.versions(package_name)
+      version = selector.best_of(self.cache.versions(package_name) + stored)
+      if version is not None and version in stored:
+        print('Using stored "{}@{}"...'.format(package_name, version))
+        return Resolution('stored', package_name, version, None)
+      if version is not None:
+        print('Using cached "{}@{}"...'.format(package_name, version))
+        return Resolution('archive', package_name, version,
+            self.cache.get(package_name, version))
+      if self.offline:
+        print('Error: package "{}@{}" is not in the cache (--offline, see `nppm fetch`)'
+            .format(package_name, selector))
+        return None
 
     if isinstance(regs, six.string_types):
       regs = [_registry.RegistryClient(regs, regs)]
@@ -704,42 +1381,160 @@ class Installer:
 
     print('Finding package matching "{}@{}"...'.format(package_name, selector))
     for registry in regs:
-      print('  Checking registry "{}" ({})...'.format(registry.name, registry.base_url), end=' ')
       try:
-        info = registry.find_package(package_name, selector)
+        with self.scheduler('connections', priority):
+          info = registry.find_package(package_name, selector)
       except _registry.PackageNotFound as exc:
-        print('NOT FOUND')
+        print('  Checking registry "{}" ({})... NOT FOUND'.format(registry.name, registry.base_url))
         continue
       else:
-        print('FOUND ({}@{})'.format(info.name, info.version))
+        print('  Checking registry "{}" ({})... FOUND ({}@{})'.format(
+            registry.name, registry.base_url, info.name, info.version))
         break
     else:
       print('Error: package "{}@{}" could not be located'.format(package_name, selector))
-      return False, None
+      return None
     assert info.name == package_name, info
 
-    print('Downloading "{}@{}"...'.format(info.name, info.version))
-    response = registry.download(info.name, info.version)
-    filename = _download.get_response_filename(response)
+    if self.store.get(info.name, info.version) is not None:
+      print('Using stored "{}@{}"...'.format(info.name, info.version))
+      return Resolution('stored', package_name, info.version, None)
+
+    # Another process may be downloading the same archive.
+    with self.locked(self.cache.lock_file(info.name, info.version),
+        'the cached archive of "{}@{}"'.format(info.name, info.version)):
+      filename = self.cache.get(info.name, info.version)
+      if filename:
+        print('Using cached "{}@{}"...'.format(info.name, info.version))
+      else:
+        print('Downloading "{}@{}"...'.format(info.name, info.version))
+        progress = _download.DownloadProgress(30, prefix='  ') if progress else None
+        with self.scheduler('connections', priority):
+          response = registry.download(info.name, info.version)
+          filename = self.cache.put(info.name, info.version, response, progress=progress)
+
+    return Resolution('archive', package_name, info.version, filename)
+
+  def install_resolved(self, resolution, dev=False, internal=False, pure=None, ctx=None):
+    """
+    Installs a package from a #Resolution returned by
+    #resolve_from_registry().
+
+    # Returns
+    (success, (package_name, package_version))
+    """
+
+    info = (resolution.name, resolution.version)
+    if resolution.kind == 'installed':
+      return True, info
+    elif resolution.kind == 'archive':
+      success, _ = self.install_from_archive(resolution.location, dev=dev,
+        pure=pure, expect=info, internal=internal, ctx=ctx)
+    elif resolution.kind in ('directory', 'extracted'):
+      success, _ = self.install_from_directory(resolution.location, dev=dev,
+        pure=pure, expect=info, internal=internal,
+        staged=(resolution.kind == 'extracted'), ctx=ctx)
+    elif resolution.kind == 'stored':
+      # Materialize the package with hardlinks so that the lifecycle scripts
+      # and the manifest can be read from a directory. The files are placed
+      # into the target directory from the store again.
+      index = self.store.get(resolution.name, resolution.version)
+      directory = self.staging_directory()
+      with later(_rmtree, directory, ignore_errors=True):
+        self.store.place(index, directory, 'hardlink')
+        success, _ = self.install_from_directory(directory, dev=dev,
+          pure=pure, expect=info, internal=internal, ctx=ctx)
+    else:
+      raise RuntimeError('unexpected resolution: {!r}'.format(resolution))
+    return success, info
 
-    tmp = None
+  def install_from_registry(self, package_name, selector, dev=False, regs=None,
+                            internal=False, pure=None, ctx=None):
+    """
+    Install a package from a registry. Downloaded archives are kept in the
+    #cache.ArchiveCache and are re-used when the same version is installed
+    again. See #resolve_from_registry() for the effect of #prefer.
+
+    # Returns
+    (success, (package_name, package_version))
+    """
+
+    resolution = self.resolve_from_registry(package_name, selector, regs, internal, ctx=ctx)
+    if resolution is None:
+      return False, None
+    return self.install_resolved(resolution, dev=dev, internal=internal, pure=pure, ctx=ctx)
+
+  def install_registry_dependencies(self, deps, ctx=None):
+    """
+    Installs the registry dependencies *deps*, a list of `(name, req)`
+    tuples, through a #pipeline.Pipeline. Resolving and downloading
+    (`fetch`), checking archives against their recorded checksum (`verify`)
+    and unpacking them (`extract`) happen on worker threads for the next
+    packages while the calling thread installs the current one. The time
+    spent in every stage is recorded in #stats. Packages with the longest
+    recorded dependency chain are started first.
+    """
+
+    def fetch(item):
+      name, req = item
+      resolution = self.resolve_from_registry(name, req.selector,
+          regs=req.registry, internal=req.internal, progress=False,
+          priority=self.scheduler.priority(name), ctx=ctx)
+      if resolution is None:
+        raise InstallError('package "{}@{}" could not be located'.format(name, req.selector))
+      return name, req, resolution
+
+    def verify(value):
+      resolution = value[2]
+      if resolution.kind == 'archive' and not self.cache.verify(resolution.location):
+        raise InstallError('archive "{}" does not match its recorded checksum'
+            .format(resolution.location))
+      return value
+
+    def extract(value):
+      name, req, resolution = value
+      if resolution.kind == 'archive':
+        with self.scheduler('files', self.scheduler.priority(name)):
+          resolution = resolution._replace(kind='extracted',
+              location=_extract_archive(resolution.location, self.staging_directory()))
+      return name, req, resolution
+
+    def discard(value):
+      if len(value) == 3 and value[2].kind == 'extracted':
+        _rmtree(value[2].location, ignore_errors=True)
+
+    stages = [
+      pipeline.Stage('fetch', fetch, self.jobs),
+      pipeline.Stage('verify', verify, pool.cpu_count()),
+      pipeline.Stage('extract', extract, pool.cpu_count())
+    ]
+    pipe = pipeline.Pipeline(stages, limit=self.jobs, discard=discard, stats=self.stats)
+    results = pipe.run(self.scheduler.by_priority(deps))
     try:
-      with tempfile.NamedTemporaryFile(suffix='_' + filename, delete=False) as tmp:
-        progress = _download.DownloadProgress(30, prefix='  ')
-        _download.download_to_fileobj(response, tmp, progress=progress)
-      success = self.install_from_archive(tmp.name, dev=dev, pure=pure,
-        expect=(package_name, info.version), internal=internal)
+      for (name, req), value, error in results:
+        if error:
+          print('Error: could not install "{}" ({})'.format(name, req))
+          print(error)
+          return False
+        resolution = value[2]
+        print('  Installing "{}" ({})'.format(name, req))
+        try:
+          success = self.install_resolved(resolution, internal=req.internal, ctx=ctx)[0]
+        finally:
+          if resolution.kind == 'extracted':
+            _rmtree(resolution.location)
+        if not success:
+          return False
     finally:
-      if tmp and os.path.isfile(tmp.name):
-        os.remove(tmp.name)
-
-    return success, (package_name, info.version)
+      results.close()
+    return True
 
-  def install_from_git(self, url, recursive=True, internal=False, pure=False):
+  def install_from_git(self, url, recursive=True, internal=False, pure=None, ctx=None):
     """
     Install a package from a Git repository. The package will first be cloned
     into a temporary directory, that be copied into the correct location and
-    binaries will be installed.
+    binaries will be installed. With #offline, the repository is cloned from
+    its mirror in the #cache.GitCache instead (see `nppm fetch`).
 
     # Returns
     (success, (package_name, package_version))
@@ -750,21 +1545,38 @@ class Installer:
     else:
       ref = None
 
-    dest = os.path.join(self.dirs['packages'], '.tmp')
-    args = ['git', 'clone', url, dest]
+    source = url
+    if self.offline:
+      source = self.git_cache.get(url)
+      if not source:
+        print('Error: repository "{}" is not in the cache (--offline, see `nppm fetch`)'.format(url))
+        return False, None
+
+    # Clone next to the install directory so that the clone can be renamed
+    # into place.
+    ctx = ctx or InstallContext()
+    if ctx.install_base:
+      parent = os.path.join(ctx.install_base[-1][1], env.MODULES_DIRECTORY)
+    else:
+      parent = self.dirs['packages']
+    _makedirs(parent)
+    dest = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    args = ['git', 'clone', source, dest]
     if ref:
       args += ['-b', ref]
     if recursive:
       args += ['--recursive']
     print('Cloning repository: $', args)
-    res = subprocess.call(args)
+    with self.scheduler('connections'):
+      res = subprocess.call(args)
     if res != 0:
       print('Error: Git clone failed')
+      _rmtree(dest, ignore_errors=True)
       return False, None
 
     with later(_rmtree, dest):
       success, manifest = self.install_from_directory(dest, movedir=True,
-        internal=internal, pure=pure)
+        internal=internal, pure=pure, ctx=ctx)
 
     if manifest:
       return success, (manifest['name'], manifest['version'])
@@ -775,6 +1587,194 @@ class InstallError(Exception):
   pass
 
 
+class Resolution(collections.namedtuple('Resolution', 'kind name version location')):
+  """
+  Describes where a package will be installed from. *kind* is one of
+  `'installed'` (nothing to do), `'directory'`, `'archive'`, `'extracted'`
+  (a temporary directory that the archive was unpacked into) or `'stored'`
+  (the version is in the #store.ContentStore). *location* is the respective
+  directory or archive filename, or #None for `'stored'`.
+  """
+
+  __slots__ = ()
+
+
+def check_archive_members(members, directory):
+  """
+  Yields the tar *members* and raises an #InstallError for members that
+  would be extracted outside of *directory*: members with a path outside of
+  it, device files, links with an absolute target or a target that contains
+  `..`, and members below a symlink from the same archive (which could
+  point anywhere once it is extracted).
+  """
+
+  root = os.path.abspath(directory)
+  def inside(path):
+    return path == root or path.startswith(root + os.sep)
+  symlinks = set()
+  for member in members:
+    path = os.path.abspath(os.path.join(root, member.name))
+    if not inside(path) or member.isdev():
+      raise InstallError('unsafe archive member: {!r}'.format(member.name))
+    parts = os.path.normcase(os.path.relpath(path, root)).split(os.sep)
+    if any('/'.join(parts[:i]) in symlinks for i in range(1, len(parts))):
+      raise InstallError('unsafe archive member: {!r} (below a symlink)'.format(member.name))
+    if member.issym() or member.islnk():
+      target = member.linkname.replace('\\', '/')
+      if os.path.isabs(member.linkname) or target.startswith('/') or '..' in target.split('/'):
+        raise InstallError('unsafe archive member: {!r} -> {!r}'.format(
+            member.name, member.linkname))
+    if member.issym():
+      symlinks.add('/'.join(parts))
+    yield member
+
+
+def _archive_filter(data):
+  """
+  Returns a function that checks if a member of a package archive should be
+  unpacked according to the `include` and `exclude` fields of the manifest
+  *data* (like #walk_package_files(), but without the `.gitignore` file,
+  which is not part of the archive).
+  """
+
+  patterns, include = _package_patterns(data)
+  return lambda rel: rel == PACKAGE_MANIFEST or \
+      patterns.match_path(rel, include=include) == include
+
+
+def _extract_archive(archive, directory=None):
+  """
+  Unpacks the *archive* (a filename or a file-like object) into *directory*
+  or a new temporary directory and returns it. The archive is read as a
+  stream, every member is checked with #check_archive_members() and written
+  as it is read. If the package manifest is the first member (as in the
+  archives created by `nppm dist`), members that are not included by the
+  manifest are skipped; otherwise all members are unpacked.
+  """
+
+  if directory is None:
+    directory = tempfile.mkdtemp(suffix='_' + os.path.basename(archive) + '_unpacked')
+  try:
+    if isinstance(archive, six.string_types):
+      tar = tarfile.open(archive, 'r|*')
+    else:
+      tar = tarfile.open(fileobj=archive, mode='r|*')
+    with tar:
+      check = None
+      for member in check_archive_members(tar, directory):
+        if member.isdir():
+          continue  # parent directories are created with their files
+        rel = os.path.normpath(member.name)
+        if check is None and rel == PACKAGE_MANIFEST and member.isfile():
+          data = tar.extractfile(member).read()
+          with open(os.path.join(directory, PACKAGE_MANIFEST), 'wb') as fp:
+            fp.write(data)
+          try:
+            check = _archive_filter(json.loads(data.decode('utf8')))
+          except ValueError:
+            check = False
+          continue
+        check = check or False
+        if check and not check(rel):
+          continue
+        tar.extract(member, directory)
+  except:
+    _rmtree(directory, ignore_errors=True)
+    raise
+  return directory
+
+
+def _temporary_directory(kind, target_dir):
+  """
+  Creates a staging (*kind* `.tmp-`) or trash (`.trash-`) directory next to
+  *target_dir*. Its name starts with the name of *target_dir*, so that
+  #_sweep_temporary() finds it if the installation is interrupted.
+  """
+
+  target_dir = os.path.abspath(target_dir)
+  prefix = kind + os.path.basename(target_dir) + '@'
+  return tempfile.mkdtemp(prefix=prefix, dir=os.path.dirname(target_dir))
+
+
+def _sweep_temporary(target_dir):
+  """
+  Removes the staging and trash directories of *target_dir* (see
+  #_temporary_directory()) that an interrupted installation left behind.
+  Must be called with the lock of *target_dir* held.
+  """
+
+  target_dir = os.path.abspath(target_dir)
+  parent = os.path.dirname(target_dir)
+  prefixes = tuple(kind + os.path.basename(target_dir) + '@' for kind in ('.tmp-', '.trash-'))
+  try:
+    names = os.listdir(parent)
+  except OSError:
+    return
+  for name in names:
+    if name.startswith(prefixes):
+      _rmtree(os.path.join(parent, name), ignore_errors=True)
+
+
+def _remove_later(directory):
+  """
+  Renames *directory* to a unique name next to it and removes it from a
+  background thread, so that removing large trees does not block the
+  installation. The interpreter waits for the thread before it exits.
+  """
+
+  trash = _temporary_directory('.trash-', directory)
+  os.rename(directory, os.path.join(trash, os.path.basename(directory)))
+  thread = threading.Thread(target=_rmtree, args=(trash, True))
+  thread.start()
+  return thread
+
+
+def _prune_directory(directory, keep):
+  """
+  Removes the files and directories in *directory* that are not in or
+  above the relative paths *keep* (with forward slashes).
+  """
+
+  keep_dirs = set()
+  for rel in keep:
+    parts = rel.split('/')
+    keep_dirs.update('/'.join(parts[:i]) for i in range(1, len(parts)))
+  for root, dirs, files in os.walk(directory):
+    base = os.path.relpath(root, directory).replace(os.sep, '/')
+    prefix = '' if base == '.' else base + '/'
+    for name in list(dirs):
+      if prefix + name not in keep_dirs:
+        dirs.remove(name)
+        path = os.path.join(root, name)
+        if os.path.islink(path):
+          os.remove(path)
+        else:
+          _rmtree(path)
+    for name in files:
+      if prefix + name not in keep:
+        os.remove(os.path.join(root, name))
+
+
+def _swap_directory(stage, target_dir):
+  """
+  Replaces *target_dir* with the *stage* directory, which must be on the
+  same filesystem. The modules directory of the current *target_dir* (the
+  dependencies, which are installed before the package files are placed)
+  is moved into *stage* first, the old tree is removed with
+  #_remove_later().
+  """
+
+  modules = os.path.join(target_dir, env.MODULES_DIRECTORY)
+  staged_modules = os.path.join(stage, env.MODULES_DIRECTORY)
+  if os.path.isdir(modules) and not os.path.exists(staged_modules):
+    # The modules directory can be nested (eg. `.nodepy/modules`).
+    _makedirs(os.path.dirname(staged_modules))
+    os.rename(modules, staged_modules)
+  if os.path.lexists(target_dir):
+    _remove_later(target_dir)
+  os.rename(stage, target_dir)
+
+
 @contextlib.contextmanager
 def later(__func, *args, **kwargs):
   try:
@@ -0,0 +1,136 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import collections
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import { InstallError, _extract_archive, _swap_directory } from './install'
+import { _prune_directory, check_archive_members, merge_pip_dependencies } from './install'
+import { _remove_later, _sweep_temporary, _temporary_directory } from './install'
+import env from './env'
+
+
+def test_swap_directory():
+  directory = tempfile.mkdtemp()
+  try:
+    target = os.path.join(directory, 'app')
+    nested = os.path.join(target, env.MODULES_DIRECTORY, 'dep', 'index.py')
+    os.makedirs(os.path.dirname(nested))
+    for filename in (os.path.join(target, 'old.py'), nested):
+      open(filename, 'w').close()
+    stage = tempfile.mkdtemp(prefix='.tmp-', dir=directory)
+    open(os.path.join(stage, 'new.py'), 'w').close()
+
+    _swap_directory(stage, target)
+    assert not os.path.exists(stage)
+    assert os.path.isfile(os.path.join(target, 'new.py'))
+    assert not os.path.exists(os.path.join(target, 'old.py'))
+    assert os.path.isfile(os.path.join(target, env.MODULES_DIRECTORY, 'dep', 'index.py'))
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_merge_pip_dependencies():
+  pip_deps = collections.OrderedDict()
+  merge_pip_dependencies(pip_deps, {'six': '', 'requests': '>=2.0'})
+  merge_pip_dependencies(pip_deps, {'six': '>=1.10', 'requests': '<3'})
+  merge_pip_dependencies(pip_deps, {'six': '', 'requests': '>=2.0'})
+  assert_equals(pip_deps, {'six': '>=1.10', 'requests': '>=2.0,<3'})
+
+
+def _make_archive(members):
+  """
+  Creates a tar archive from a list of `(name, linkname_or_data)` tuples,
+  where strings become symlinks and bytes become files.
+  """
+
+  stream = io.BytesIO()
+  with tarfile.open(fileobj=stream, mode='w') as tar:
+    for name, value in members:
+      info = tarfile.TarInfo(name)
+      if isinstance(value, bytes):
+        info.size = len(value)
+        tar.addfile(info, io.BytesIO(value))
+      else:
+        info.type, info.linkname = tarfile.SYMTYPE, value
+        tar.addfile(info)
+  stream.seek(0)
+  return stream
+
+
+def test_check_archive_members():
+  parent = tempfile.mkdtemp()
+  try:
+    directory = os.path.join(parent, 'root')
+    os.makedirs(directory)
+
+    # A symlink chain that resolves to the parent of the directory.
+    archive = _make_archive([('c', '.'), ('a', 'c/c/../..'), ('a/pwned.txt', b'x')])
+    with assert_raises(InstallError):
+      _extract_archive(archive, directory)
+    assert not os.path.exists(os.path.join(parent, 'pwned.txt'))
+
+    for members in ([('c', '.'), ('c/pwned.txt', b'x')], [('a', '/tmp')],
+                    [('x/../a', '..')], [('../pwned.txt', b'x')]):
+      with tarfile.open(fileobj=_make_archive(members)) as tar:
+        with assert_raises(InstallError):
+          list(check_archive_members(tar, directory))
+
+    with tarfile.open(fileobj=_make_archive([('lib/a.py', b'x'), ('b.py', 'lib/a.py')])) as tar:
+      assert_equals(len(list(check_archive_members(tar, directory))), 2)
+  finally:
+    shutil.rmtree(parent)
+
+
+def test_prune_directory():
+  directory = tempfile.mkdtemp()
+  try:
+    for rel in ('nodepy.json', 'lib/a.py', 'lib/b.pyc', 'docs/index.md', '.git/HEAD'):
+      filename = os.path.join(directory, *rel.split('/'))
+      if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      open(filename, 'w').close()
+    _prune_directory(directory, ['nodepy.json', 'lib/a.py'])
+    assert_equals(sorted(os.listdir(directory)), ['lib', 'nodepy.json'])
+    assert_equals(os.listdir(os.path.join(directory, 'lib')), ['a.py'])
+  finally:
+    shutil.rmtree(directory)
+
+
+def test_sweep_temporary():
+  directory = tempfile.mkdtemp()
+  try:
+    target = os.path.join(directory, 'app')
+    os.makedirs(target)
+    _remove_later(target).join()
+    stage = _temporary_directory('.tmp-', target)
+    other = _temporary_directory('.tmp-', os.path.join(directory, 'app-utils'))
+    assert os.path.basename(stage).startswith('.tmp-app@')
+    _sweep_temporary(target)
+    assert_equals(os.listdir(directory), [os.path.basename(other)])
+  finally:
+    shutil.rmtree(directory)
@@ -120,6 +120,15 @@ def _validate_pip_dependencies(field):
       field.errors.append(str(exc))
 
 
+@register_validator('workspaces')
+def _validate_workspaces(field):
+  if not isinstance(field.value, list) or \
+      not all(isinstance(x, six.string_types) for x in field.value):
+    field.errors.append('Expected a list of glob patterns.')
+  elif any(os.path.isabs(x) or '..' in x.replace('\\', '/').split('/') for x in field.value):
+    field.errors.append('Workspace patterns must be relative to the package directory.')
+
+
 def iter_fields(manifest, name=None):
   """
   Iterates over all fields in the manifest. If no *name* is specified, the
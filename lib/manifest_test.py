@@ -60,3 +60,12 @@ def test_eval_fields():
 
   result = manifest.eval_fields(example_manifest, {'prod': True})['dependencies']
   assert_equals(result, {'nodepy-nosetests': '~0.0.5', 'werkzeug-reloader-patch': '--pure git+https://github.com/nodepy/werkzeug-reloader-patch.git', 'production-tracker': '--optional vendor/production-tracker'})
+
+
+def test_validate_workspaces():
+  def errors(value):
+    data = {'name': 'workspace', 'version': '1.0.0', 'workspaces': value}
+    return [e for f in manifest.validate(data) if f.name == 'workspaces' for e in f.errors]
+  assert_equals(errors(['packages/*', 'tools']), [])
+  assert_equals(len(errors('packages/*')), 1)
+  assert_equals(len(errors(['../other'])), 1)
@@ -29,6 +29,7 @@ import shlex
 import six
 import subprocess
 import tarfile
+import threading
 
 from nodepy.utils import pathlib
 from six.moves import input
@@ -46,6 +47,10 @@ import _manifest from './manifest'
 import {RegistryClient, get_package_archive_name} from './registry'
 import env from './env'
 
+# Held while a script is executed in-process, as that requires modifying the
+# `PATH` of the current process and the main module of the require context.
+_script_lock = threading.RLock()
+
 
 def find_nearest_bin_directory(path):
   for path in nodepy.utils.path.upiter(path):
@@ -94,8 +99,12 @@ class PackageLifecycle(object):
       os.makedirs(self.dist_dir)
 
     print('Creating archive "{}"...'.format(filename))
+    # The manifest goes first so that the installer can filter the members
+    # while it unpacks the archive as a stream.
+    files = sorted(_install.walk_package_files(self.manifest),
+        key=lambda x: x[1] != env.PACKAGE_MANIFEST)
     archive = tarfile.open(filename, 'w:gz')
-    for name, rel in _install.walk_package_files(self.manifest):
+    for name, rel in files:
       print('  Adding "{}"...'.format(rel))
       archive.add(name, rel)
     archive.close()
@@ -155,21 +164,22 @@ class PackageLifecycle(object):
     bindir = find_nearest_bin_directory(pathlib.Path.cwd())
     if not bindir:
       bindir = env.get_directories('local')['bin']
-    oldpath = os.environ.get('PATH', '')
-    os.environ['PATH'] = str(bindir) + os.pathsep + oldpath
-    try:
-      if (not self.manifest or script not in self.manifest.get('scripts', {})) and not script_only:
-        self._run_command(shlex_quote(script) + ' ' + ' '.join(map(shlex_quote, args)))
-      else:
-        self._run_script(script, args, directory=directory, globals=globals)
-    finally:
-      os.environ['PATH'] = oldpath
+    environ = os.environ.copy()
+    environ['PATH'] = str(bindir) + os.pathsep + environ.get('PATH', '')
+    if (not self.manifest or script not in self.manifest.get('scripts', {})) and not script_only:
+      self._run_command(shlex_quote(script) + ' ' + ' '.join(map(shlex_quote, args)), environ)
+    else:
+      self._run_script(script, args, directory=directory, globals=globals, environ=environ)
     return True
 
-  def _run_script(self, script, args, directory=None, globals=None):
+  def _run_script(self, script, args, directory=None, globals=None, environ=None):
     """
     Invoke a script for the specified *event* name. Does nothing if no script
     for the specified event is specified.
+
+    Commands are run with the environment variables *environ*. Scripts that
+    are executed in-process see them in #os.environ while they run, which is
+    why only one such script runs at a time.
     """
 
     if script not in self.manifest.get('scripts', {}):
@@ -177,29 +187,36 @@ class PackageLifecycle(object):
 
     args = list(args)
     if script != 'pre-script':
-      self._run_script('pre-script', [script] + args)
+      self._run_script('pre-script', [script] + args, environ=environ)
 
     request = self.manifest.get('scripts', {})[script].strip()
     if request.startswith('$'):
-      return self._run_command(request[1:].strip())
+      return self._run_command(request[1:].strip(), environ)
     else:
       args = shlex.split(request) + args
       request = args.pop(0)
       request = os.path.abspath(os.path.join(directory or self.manifest.directory, request))
-      module = require.resolve(request)
-      module.init()
-      vars(module.namespace).update(globals or {})
-      with require.context.push_main(module):
-        require.context.load_module(module, do_init=False)
-
-  def _run_command(self, command):
+      with _script_lock:
+        oldpath = os.environ.get('PATH', '')
+        if environ is not None:
+          os.environ['PATH'] = environ['PATH']
+        try:
+          module = require.resolve(request)
+          module.init()
+          vars(module.namespace).update(globals or {})
+          with require.context.push_main(module):
+            require.context.load_module(module, do_init=False)
+        finally:
+          os.environ['PATH'] = oldpath
+
+  def _run_command(self, command, environ=None):
     # TODO: On Windows, fall back to CMD.exe if SHELL is not defined.
     command = [os.environ['SHELL'], '-c', command]
     print('$', ' '.join(shlex_quote(x) for x in command))
     try:
-      return subprocess.call(command)
+      return subprocess.call(command, env=environ)
     except (OSError, IOError) as exc:
-      print('Error: can not run "{}" ({})'.format(cmd, exc))
+      print('Error: can not run "{}" ({})'.format(command, exc))
       return getattr(exc, 'errno', 127)
 
 
@@ -0,0 +1,191 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A small pipeline that moves items through a sequence of stages, each with
+its own number of worker threads. This allows, for example, downloading one
+package while another one is being extracted. The number of items that are
+in flight at once is bounded, and the time spent in every stage is recorded
+in a #StageStats object.
+"""
+
+from __future__ import print_function
+
+import collections
+import contextlib
+import sys
+import threading
+import time
+import traceback
+
+from six.moves import queue
+
+
+class StageStats(object):
+  """
+  Accumulates the time spent in named stages from any number of threads.
+  The report shows how busy every stage was relative to the time that has
+  passed since the object was created, which hints at the bottleneck.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.start = time.time()
+    self.stages = collections.OrderedDict()
+
+  def add(self, stage, seconds, items=1, workers=1):
+    with self.lock:
+      data = self.stages.setdefault(stage, {'items': 0, 'busy': 0.0, 'workers': 1})
+      data['items'] += items
+      data['busy'] += seconds
+      data['workers'] = max(data['workers'], workers)
+
+  @contextlib.contextmanager
+  def measure(self, stage):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.add(stage, time.time() - start)
+
+  def report(self, file=None):
+    file = file or sys.stdout
+    elapsed = max(time.time() - self.start, 1e-6)
+    print('Stage utilization ({:.2f}s elapsed):'.format(elapsed), file=file)
+    with self.lock:
+      for name, data in self.stages.items():
+        utilization = data['busy'] / (elapsed * data['workers'])
+        print('  {:<10} {:>5} items  {:>8.2f}s busy  {:>3} workers  {:>5.1f}% utilized'
+            .format(name, data['items'], data['busy'], data['workers'],
+                    utilization * 100), file=file)
+
+
+class Stage(object):
+  """
+  A pipeline stage that applies *func* to every value passing through it
+  using *workers* threads.
+  """
+
+  def __init__(self, name, func, workers=1):
+    self.name = name
+    self.func = func
+    self.workers = max(1, workers)
+
+
+class _Job(object):
+
+  def __init__(self, item):
+    self.item = item
+    self.value = item
+    self.error = None
+    self.traceback = None
+
+
+class Pipeline(object):
+  """
+  Moves items through the *stages*. At most *limit* items are in flight
+  at a time (ie. fed into the pipeline and not yet processed by the consumer
+  of #run()). If
+  the consumer stops early, *discard* is called with the values of the items
+  that completed but were never yielded, which allows cleaning up temporary
+  files.
+  """
+
+  def __init__(self, stages, limit=None, discard=None, stats=None):
+    self.stages = list(stages)
+    self.limit = limit or max(s.workers for s in self.stages) * 2
+    self.discard = discard
+    self.stats = stats if stats is not None else StageStats()
+
+  def run(self, items):
+    """
+    Feeds *items* into the pipeline and yields `(item, value, error)`
+    tuples in the order in which the items complete. If a stage raised an
+    exception, *error* is the formatted traceback and the remaining stages
+    are skipped for that item.
+    """
+
+    items = list(items)
+    if not items:
+      return
+
+    queues = [queue.Queue() for __ in range(len(self.stages) + 1)]
+    slots = threading.Semaphore(self.limit)
+    cancelled = threading.Event()
+    fed = [0]
+    fed_lock = threading.Lock()
+
+    def worker(index):
+      stage = self.stages[index]
+      while True:
+        job = queues[index].get()
+        if job is None:
+          break
+        if job.error is None and not cancelled.is_set():
+          start = time.time()
+          try:
+            job.value = stage.func(job.value)
+          except Exception as exc:
+            job.error = exc
+            job.traceback = traceback.format_exc()
+          self.stats.add(stage.name, time.time() - start, workers=stage.workers)
+        queues[index + 1].put(job)
+
+    def feeder():
+      for item in items:
+        slots.acquire()
+        if cancelled.is_set():
+          break
+        with fed_lock:
+          fed[0] += 1
+        queues[0].put(_Job(item))
+
+    threads = [threading.Thread(target=feeder)]
+    for index, stage in enumerate(self.stages):
+      for __ in range(stage.workers):
+        threads.append(threading.Thread(target=worker, args=(index,)))
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    received = 0
+    try:
+      while received < len(items):
+        job = queues[-1].get()
+        received += 1
+        yield job.item, job.value, job.traceback
+        slots.release()
+    finally:
+      cancelled.set()
+      for __ in range(self.limit):
+        slots.release()
+      threads[0].join()
+      while received < fed[0]:
+        job = queues[-1].get()
+        received += 1
+        if job.error is None and self.discard:
+          self.discard(job.value)
+      for index, stage in enumerate(self.stages):
+        for __ in range(stage.workers):
+          queues[index].put(None)
+      for thread in threads[1:]:
+        thread.join()
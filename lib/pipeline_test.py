@@ -0,0 +1,57 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import threading
+import { Pipeline, Stage } from './pipeline'
+
+
+def test_pipeline():
+  def fail_on_three(x):
+    if x == 3:
+      raise ValueError('three')
+    return x * 10
+  pipe = Pipeline([Stage('a', lambda x: x + 1, 4), Stage('b', fail_on_three, 2)])
+  results = list(pipe.run(range(5)))
+  assert_equals(sorted(v for i, v, e in results if not e), [10, 20, 40, 50])
+  assert_equals([i for i, v, e in results if e], [2])
+  assert_equals(pipe.stats.stages['a']['items'], 5)
+  assert_equals(pipe.stats.stages['b']['items'], 5)
+
+
+def test_pipeline_discard():
+  # Every item waits until three items are in the stage, thus exactly three
+  # items have been fed when the consumer stops after the first one.
+  entered = [0]
+  condition = threading.Condition()
+  def wait_for_three(x):
+    with condition:
+      entered[0] += 1
+      condition.notify_all()
+      while entered[0] < 3:
+        condition.wait()
+    return x
+  discarded = []
+  pipe = Pipeline([Stage('a', wait_for_three, 3)], limit=3, discard=discarded.append)
+  for item, value, error in pipe.run(range(10)):
+    break
+  assert_equals(len(discarded), 2)
@@ -0,0 +1,166 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+The record of the files that were installed for a package. It is stored as
+#env.INSTALLED_FILES in the package directory, written atomically when the
+package is installed, and used to upgrade packages incrementally, to remove
+their scripts and to check the integrity of installed packages.
+"""
+
+import collections
+import json
+import os
+import tempfile
+
+import env from './env'
+import hashing from './util/hashing'
+import pool from './util/pool'
+
+
+class InstalledFiles(object):
+  """
+  *files* maps the paths of the installed files relative to the package
+  directory (with `/` separators) to `[size, sha256]`. *bin* is the `bin`
+  field of the manifest that the scripts were created for (empty for pure
+  installs) and *scripts* is the list of the absolute paths of the created
+  script files.
+  """
+
+  def __init__(self, files=None, bin=None, scripts=None):
+    self.files = collections.OrderedDict(files or ())
+    self.bin = dict(bin or {})
+    self.scripts = list(scripts or ())
+    self.mtime = None  # modification time of the record when loaded
+
+  @classmethod
+  def load(cls, directory):
+    """
+    Loads the record of the package in *directory*. Returns #None if there
+    is no record or if it can not be read.
+    """
+
+    try:
+      with open(os.path.join(directory, env.INSTALLED_FILES)) as fp:
+        data = json.load(fp, object_pairs_hook=collections.OrderedDict)
+        mtime = os.fstat(fp.fileno()).st_mtime
+      record = cls(((k, list(v)) for k, v in data['files'].items()),
+          data.get('bin'), data.get('scripts'))
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+      return None
+    record.mtime = mtime
+    return record
+
+  def save(self, directory):
+    """
+    Writes the record to *directory*. The file is replaced atomically.
+    """
+
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=env.INSTALLED_FILES, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w') as fp:
+        json.dump({'files': self.files, 'bin': self.bin, 'scripts': self.scripts},
+            fp, separators=(',', ':'))
+      filename = os.path.join(directory, env.INSTALLED_FILES)
+      if os.name == 'nt' and os.path.isfile(filename):
+        os.remove(filename)
+      os.rename(tmp, filename)
+    finally:
+      if os.path.isfile(tmp):
+        os.remove(tmp)
+
+
+  def status(self, directory, rel, fast=False):
+    """
+    Checks the recorded file *rel* in the package *directory*. Returns
+    `'missing'`, `'modified'` or #None if the file matches the record. With
+    *fast*, files that have the recorded size and were not modified after
+    the record was written are not hashed.
+    """
+
+    filename = os.path.join(directory, *rel.split('/'))
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return 'missing'
+    size, digest = self.files[rel]
+    if st.st_size != size:
+      return 'modified'
+    if fast and self.mtime is not None and st.st_mtime <= self.mtime:
+      return None
+    if hashing.file_digest(filename) != digest:
+      return 'modified'
+    return None
+
+  def extra_files(self, directory):
+    """
+    Returns the relative paths of the files in the package *directory* that
+    are not in the record. The modules directory and Python bytecode are
+    not taken into account.
+    """
+
+    # The modules directory can be nested (eg. `.nodepy/modules`), thus it
+    # is compared with the path relative to *directory*.
+    modules = os.path.normpath(env.MODULES_DIRECTORY)
+    result = []
+    for root, dirs, files in os.walk(directory):
+      parent = os.path.relpath(root, directory)
+      dirs[:] = [x for x in dirs if x != '__pycache__' and
+                 os.path.normpath(os.path.join(parent, x)) != modules]
+      for name in files:
+        if name.endswith(('.pyc', '.pyo')):
+          continue
+        rel = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+        if rel != env.INSTALLED_FILES and rel not in self.files:
+          result.append(rel)
+    return sorted(result)
+
+  def check(self, directory, jobs=None, fast=False):
+    """
+    Compares the record with the files in *directory* (see #status() and
+    #extra_files()). Returns a tuple of three lists, the relative paths of
+    the files that were modified, that are missing and that are not in the
+    record.
+    """
+
+    results = pool.map_threaded(lambda rel: self.status(directory, rel, fast),
+        list(self.files), jobs)
+    modified = [rel for rel, x in zip(self.files, results) if x == 'modified']
+    missing = [rel for rel, x in zip(self.files, results) if x == 'missing']
+    return modified, missing, self.extra_files(directory)
+
+
+def describe_files(files, jobs=None):
+  """
+  Returns an #collections.OrderedDict that maps the relative paths of the
+  *files*, an iterable of `(abspath, relpath)` tuples, to `[size, sha256]`
+  for an #InstalledFiles record. The files are hashed from up to *jobs*
+  threads.
+  """
+
+  files = list(files)
+  def describe(item):
+    return [os.path.getsize(item[0]), hashing.file_digest(item[0])]
+  results = pool.map_threaded(describe, files, jobs)
+  return collections.OrderedDict((rel.replace(os.sep, '/'), value)
+      for (__, rel), value in zip(files, results))
@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import os
+import shutil
+import tempfile
+import { InstalledFiles, describe_files } from './record'
+import env from './env'
+
+
+def test_record():
+  directory = tempfile.mkdtemp()
+  try:
+    os.makedirs(os.path.join(directory, 'lib'))
+    for rel, data in [('a.py', 'a'), ('lib/b.py', 'bb'), ('lib/c.py', 'ccc')]:
+      with open(os.path.join(directory, *rel.split('/')), 'w') as fp:
+        fp.write(data)
+    files = describe_files([(os.path.join(directory, 'a.py'), 'a.py'),
+        (os.path.join(directory, 'lib', 'b.py'), os.path.join('lib', 'b.py')),
+        (os.path.join(directory, 'lib', 'c.py'), os.path.join('lib', 'c.py'))])
+    assert_equals(list(files), ['a.py', 'lib/b.py', 'lib/c.py'])
+    assert_equals(files['lib/b.py'][0], 2)
+
+    InstalledFiles(files, {'foo': 'a.py'}, ['/bin/foo']).save(directory)
+    assert_equals(sorted(os.listdir(directory)), sorted(['a.py', 'lib', env.INSTALLED_FILES]))
+    record = InstalledFiles.load(directory)
+    assert_equals(record.files, files)
+    assert_equals(record.bin, {'foo': 'a.py'})
+    assert_equals(record.scripts, ['/bin/foo'])
+    assert_equals(record.check(directory), ([], [], []))
+
+    with open(os.path.join(directory, 'lib', 'b.py'), 'w') as fp:
+      fp.write('xx')
+    os.remove(os.path.join(directory, 'lib', 'c.py'))
+    open(os.path.join(directory, 'lib', 'd.py'), 'w').close()
+    open(os.path.join(directory, 'lib', 'd.pyc'), 'w').close()
+    assert_equals(record.check(directory), (['lib/b.py'], ['lib/c.py'], ['lib/d.py']))
+
+    # Same size, but modified after the record was written.
+    record.mtime -= 10
+    assert_equals(record.check(directory, fast=True)[0], ['lib/b.py'])
+    record.mtime += 20
+    assert_equals(record.check(directory, fast=True)[0], [])
+    assert_equals(InstalledFiles.load(os.path.join(directory, 'lib')), None)
+
+    # The modules directory (which can be nested) is not taken into account.
+    nested = os.path.join(directory, env.MODULES_DIRECTORY, 'dep', 'index.py')
+    os.makedirs(os.path.dirname(nested))
+    open(nested, 'w').close()
+    assert_equals(record.extra_files(directory), ['lib/d.py'])
+  finally:
+    shutil.rmtree(directory)
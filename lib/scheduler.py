@@ -0,0 +1,186 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Coordinates the use of limited resources (network connections, Pip processes
+and open files) between all operations of an installation. Waiting operations
+are served by priority, which is derived from the install times recorded in
+previous runs: packages at the start of the longest remaining dependency chain
+go first, so the total install time approaches the critical path.
+"""
+
+from __future__ import print_function
+
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+import { FileLock } from './util/lock'
+
+
+def _config_int(key, default):
+  try:
+    return int(require.context.config[key])
+  except KeyError:
+    return default
+
+
+class Resource(object):
+  """
+  A counting semaphore with *limit* slots whose waiters are served in the
+  order of their priority (highest first), then in the order of arrival.
+  The total time spent waiting is recorded in #wait_time.
+  """
+
+  _counter = itertools.count()
+
+  def __init__(self, name, limit):
+    self.name = name
+    self.limit = max(1, limit)
+    self.in_use = 0
+    self.waiters = []
+    self.wait_time = 0.0
+    self.cond = threading.Condition()
+
+  def acquire(self, priority=0):
+    start = time.time()
+    with self.cond:
+      entry = (-priority, next(self._counter))
+      heapq.heappush(self.waiters, entry)
+      while self.in_use >= self.limit or self.waiters[0] != entry:
+        self.cond.wait()
+      heapq.heappop(self.waiters)
+      self.in_use += 1
+      self.wait_time += time.time() - start
+      self.cond.notify_all()
+
+  def release(self):
+    with self.cond:
+      self.in_use -= 1
+      self.cond.notify_all()
+
+  @contextlib.contextmanager
+  def __call__(self, priority=0):
+    self.acquire(priority)
+    try:
+      yield
+    finally:
+      self.release()
+
+
+class InstallHistory(object):
+  """
+  Records how long it took to install every package (excluding its
+  dependencies) and the length of its dependency chain, ie. its own time
+  plus the longest chain of its dependencies. Stored as JSON in *filename*,
+  which can be shared by concurrent processes: #save() merges the changes
+  into the current contents of the file while holding a file lock.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.lock = threading.Lock()
+    self.changes = {}
+    try:
+      with open(filename) as fp:
+        self.data = json.load(fp)
+    except (IOError, OSError, ValueError):
+      self.data = {}
+
+  def chain(self, package_name):
+    """
+    Returns the recorded length of the dependency chain that starts at
+    *package_name* in seconds, or 0 if it is unknown.
+    """
+
+    return self.data.get(package_name, {}).get('chain', 0.0)
+
+  def record(self, package_name, seconds, dependencies=()):
+    with self.lock:
+      chain = seconds + max([self.chain(x) for x in dependencies] or [0.0])
+      self.data[package_name] = {'time': seconds, 'chain': chain}
+      self.changes[package_name] = self.data[package_name]
+
+  def save(self):
+    with self.lock:
+      if not self.changes:
+        return
+      with FileLock(self.filename + '.lock'):
+        try:
+          with open(self.filename) as fp:
+            data = json.load(fp)
+        except (IOError, OSError, ValueError):
+          data = {}
+        data.update(self.changes)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.filename) or '.',
+            prefix=os.path.basename(self.filename), suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+          json.dump(data, fp, sort_keys=True)
+        if os.name == 'nt' and os.path.isfile(self.filename):
+          os.remove(self.filename)
+        os.rename(tmp, self.filename)
+      self.changes = {}
+
+
+class Scheduler(object):
+  """
+  Holds the #Resource#s that are shared by all operations of an
+  installation and the #InstallHistory used to prioritize them. The limits
+  can be configured with the `install.max_connections`,
+  `install.max_pip_processes` and `install.max_open_files` options.
+  """
+
+  def __init__(self, history):
+    self.history = history
+    self.resources = {
+      'connections': Resource('connections', _config_int('install.max_connections', 8)),
+      'pip': Resource('pip', _config_int('install.max_pip_processes', 1)),
+      'files': Resource('files', _config_int('install.max_open_files', 64)),
+    }
+
+  def __call__(self, resource, priority=0):
+    """
+    Returns a context manager that holds a slot of the named *resource*.
+    """
+
+    return self.resources[resource](priority)
+
+  def report(self, file=None):
+    print('Resource wait times:', file=file)
+    for name, resource in sorted(self.resources.items()):
+      print('  {:<12} {:>3} slots  {:>8.2f}s waited'.format(
+          name, resource.limit, resource.wait_time), file=file)
+
+  def priority(self, package_name):
+    return self.history.chain(package_name)
+
+  def by_priority(self, deps):
+    """
+    Sorts a list of `(name, req)` tuples by descending priority.
+    """
+
+    return sorted(deps, key=lambda x: -self.priority(x[0]))
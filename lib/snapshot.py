@@ -0,0 +1,135 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Implements `nppm snapshot`, which saves the installed dependencies of a
+project (the modules directory, the bin directory and the Pip prefix of the
+local install location) as a bundle in the cache directory, and restores
+them in place of an installation. Snapshots are keyed by the manifests of
+the project, whether development dependencies are installed, and the
+interpreter and platform.
+
+Snapshots do not track the packages that the manifests resolve to: a
+snapshot keeps the versions that were installed when it was saved until
+the manifest changes.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import platform
+import shutil
+import sys
+
+import _bundle from './bundle'
+import _cache from './cache'
+import { find_workspace_members } from './install'
+import env, { PACKAGE_MANIFEST } from './env'
+import { FileLock } from './util/lock'
+
+
+def get_snapshot_directory():
+  """
+  Returns the `snapshots/` folder of the cache directory.
+  """
+
+  return os.path.join(_cache.get_cache_directory(), 'snapshots')
+
+
+def compute_key(manifest, dev):
+  """
+  Returns the key of the snapshot of the dependencies of the package
+  *manifest* (and of its workspace members), installed with or without
+  development dependencies (*dev*) by the current interpreter.
+  """
+
+  hasher = hashlib.sha256()
+  filenames = [os.path.join(manifest.directory, PACKAGE_MANIFEST)]
+  filenames += [os.path.join(x, PACKAGE_MANIFEST) for x in find_workspace_members(manifest) or ()]
+  for filename in filenames:
+    with open(filename, 'rb') as fp:
+      hasher.update(fp.read())
+  hasher.update(repr((dev, platform.python_implementation(), sys.version,
+      sys.platform, platform.machine())).encode('utf8'))
+  return hasher.hexdigest()
+
+
+def _local_paths():
+  """
+  Returns the relative directories of the local install location that are
+  part of a snapshot, and those among them that contain scripts.
+  """
+
+  dirs = env.get_directories('local')
+  return [dirs['packages'], dirs['bin'], dirs['pip_prefix']], [dirs['bin'], dirs['pip_bin']]
+
+
+def save(manifest, dev, directory='.'):
+  """
+  Saves the dependencies installed in *directory* as the snapshot for the
+  package *manifest* (see #compute_key()). Returns True on success.
+  """
+
+  directory = os.path.abspath(directory)
+  paths, bin_dirs = _local_paths()
+  if not os.path.isdir(os.path.join(directory, paths[0])):
+    print('Error: no dependencies are installed in "{}"'.format(directory))
+    return False
+
+  filename = os.path.join(get_snapshot_directory(), compute_key(manifest, dev) + '.tar')
+  if not os.path.isdir(os.path.dirname(filename)):
+    os.makedirs(os.path.dirname(filename))
+  print('Saving snapshot "{}" ...'.format(filename))
+  with FileLock(filename + '.lock'):
+    info, __ = _bundle.describe(directory, manifest, bin_dirs, paths)
+    count = _bundle.write_bundle(directory, filename, info, paths, mtime=None)
+  print('  Added {} files.'.format(count))
+  return True
+
+
+def restore(manifest, dev, directory='.', jobs=None):
+  """
+  Replaces the dependencies installed in *directory* with the snapshot for
+  the package *manifest*, which is also looked up in the read-only cache
+  directories. Returns False if there is no snapshot.
+  """
+
+  name = compute_key(manifest, dev) + '.tar'
+  directories = [get_snapshot_directory()]
+  directories += [os.path.join(x, 'snapshots') for x in _cache.get_readonly_cache_directories()]
+  for filename in (os.path.join(x, name) for x in directories):
+    if os.path.isfile(filename):
+      break
+  else:
+    print('No snapshot of "{}" found.'.format(manifest.identifier))
+    return False
+
+  directory = os.path.abspath(directory)
+  paths = _local_paths()[0]
+  for path in paths:
+    path = os.path.join(directory, path)
+    if os.path.isdir(path):
+      print('Removing "{}" ...'.format(path))
+      shutil.rmtree(path)
+  return _bundle.unbundle(filename, directory, jobs)
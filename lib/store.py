@@ -0,0 +1,299 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A user-level, content-addressable store of the files of registry packages.
+Every file is stored once under the SHA256 of its contents, no matter how
+many package versions contain it, and every package version is described
+by an index of its files. Installing a stored version only needs to place
+the files in the target directory, which is done with hardlinks, reflinks,
+symlinks or copies depending on the `install.placement` option.
+
+Stored files are read-only. With the `hardlink` strategy, the installed
+files share the inode with the store and are read-only as well.
+
+The stores in the read-only cache directories (see
+#cache.get_readonly_cache_directories()) are searched for package versions
+that are not in the user's store, and their files are placed from there.
+New files are only ever added to the user's store.
+"""
+
+import errno
+import json
+import os
+import stat
+import tempfile
+
+import _cache from './cache'
+import semver from './semver'
+import fileops from './util/fileops'
+import hashing from './util/hashing'
+
+
+def get_placement_strategy():
+  """
+  Returns the value of the `install.placement` option (default `auto`).
+  """
+
+  try:
+    strategy = require.context.config['install.placement']
+  except KeyError:
+    return 'auto'
+  if strategy not in fileops.STRATEGIES:
+    raise ValueError('install.placement: expected one of {}, got {!r}'.format(
+        ', '.join(fileops.STRATEGIES), strategy))
+  return strategy
+
+
+class ContentStore(object):
+  """
+  Manages the content-addressable store in the `store/` folder of a cache
+  *directory*. Files are kept in `files/`, the package indices in
+  `packages/`. The stores in the *readonly_directories* are searched after
+  this store (see #cache.ArchiveCache).
+  """
+
+  def __init__(self, directory=None, readonly_directories=None):
+    if directory is None:
+      directory = _cache.get_cache_directory()
+      if readonly_directories is None:
+        readonly_directories = _cache.get_readonly_cache_directories()
+    self.directory = os.path.join(directory, 'store')
+    self.files_dir = os.path.join(self.directory, 'files')
+    self.index_dir = os.path.join(self.directory, 'packages')
+    self.tmp_dir = os.path.join(self.directory, 'tmp')
+    self.readonly = [os.path.join(x, 'store') for x in readonly_directories or ()]
+
+  def _index_file(self, package_name, version, directory=None):
+    index_dir = os.path.join(directory, 'packages') if directory else self.index_dir
+    return os.path.join(index_dir, *package_name.split('/')) + '@' + str(version) + '.json'
+
+  def _blob(self, digest, executable, directory=None):
+    files_dir = os.path.join(directory, 'files') if directory else self.files_dir
+    return os.path.join(files_dir, digest[:2], digest + ('.x' if executable else ''))
+
+  def _find_index(self, package_name, version):
+    """
+    Returns the index file of the specified package version in this store
+    or the first read-only store that has it, or #None.
+    """
+
+    for directory in [None] + self.readonly:
+      filename = self._index_file(package_name, version, directory)
+      if os.path.isfile(filename):
+        return filename
+    return None
+
+  def _find_blob(self, digest, executable):
+    """
+    Returns the path of a stored file in this store or the first read-only
+    store that has it. If none has it, the path in this store is returned.
+    """
+
+    blob = self._blob(digest, executable)
+    if not os.path.isfile(blob):
+      for directory in self.readonly:
+        filename = self._blob(digest, executable, directory)
+        if os.path.isfile(filename):
+          return filename
+    return blob
+
+  def get(self, package_name, version):
+    """
+    Returns the index of the stored package version, a list of
+    `[relpath, digest, executable, size]` entries, or #None if it is not
+    stored.
+    """
+
+    filename = self._find_index(package_name, version)
+    if filename is None:
+      return None
+    try:
+      with open(filename, 'r') as fp:
+        return json.load(fp)
+    except (IOError, OSError, ValueError):
+      return None
+
+  def versions(self, package_name):
+    """
+    Returns a list of the #semver.Version#s of *package_name* that are in
+    this store or one of the read-only stores.
+    """
+
+    parts = package_name.split('/')
+    prefix = parts[-1] + '@'
+    suffix = '.json'
+    names = set()
+    for directory in [self.index_dir] + [os.path.join(x, 'packages') for x in self.readonly]:
+      try:
+        names.update(os.listdir(os.path.join(directory, *parts[:-1])))
+      except OSError:
+        pass
+    result = []
+    for name in sorted(names):
+      if name.startswith(prefix) and name.endswith(suffix):
+        try:
+          result.append(semver.Version(name[len(prefix):-len(suffix)]))
+        except ValueError:
+          pass
+    return result
+
+  def lock_file(self, package_name, version):
+    """
+    Returns the name of the lock file that is held while the specified
+    package version is added to the store.
+    """
+
+    return self._index_file(package_name, version) + '.lock'
+
+  def stored_files(self, package_name, version):
+    """
+    Returns the paths of the files in the store that make up the specified
+    package version, its index first, or an empty list if it is not stored.
+    """
+
+    index = self.get(package_name, version)
+    if index is None:
+      return []
+    blobs = set(self._find_blob(digest, executable) for __, digest, executable, __ in index)
+    return [self._find_index(package_name, version)] + sorted(blobs)
+
+  def get_file(self, package_name, version, filename):
+    """
+    Returns the path to the stored file *filename* (relative to the package
+    root) of the specified package version, or #None if the version is not
+    stored or has no such file. The file must not be modified.
+    """
+
+    for rel, digest, executable, __ in self.get(package_name, version) or ():
+      if rel == filename:
+        return self._find_blob(digest, executable)
+    return None
+
+  def add(self, package_name, version, files, move=False):
+    """
+    Adds the *files*, an iterable of `(abspath, relpath)` tuples (eg. from
+    #walk_package_files()), to the store as the specified version of the
+    package and returns its index. Files that are already in the store are
+    not stored again. With *move*, the files are moved into the store if
+    they are on the same filesystem, which leaves them in an unspecified
+    state.
+    """
+
+    index = []
+    for filename, rel in files:
+      st = os.stat(filename)
+      executable = bool(st.st_mode & stat.S_IXUSR)
+      if move:
+        digest = self._move(filename, executable)
+      else:
+        digest = self._put(filename, executable)
+      index.append([rel.replace(os.sep, '/'), digest, executable, st.st_size])
+
+    filename = self._index_file(package_name, version)
+    _makedirs(os.path.dirname(filename))
+    _makedirs(self.tmp_dir)
+    fd, tmp = tempfile.mkstemp(dir=self.tmp_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as fp:
+      json.dump(index, fp)
+    _replace(tmp, filename)
+    return index
+
+  def _put(self, filename, executable):
+    """
+    Stores the contents of *filename* and returns their digest.
+    """
+
+    _makedirs(self.tmp_dir)
+    fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+    try:
+      with os.fdopen(fd, 'wb') as dst, open(filename, 'rb') as src:
+        writer = hashing.HashingWriter(dst)
+        for chunk in iter(lambda: src.read(1024 * 1024), b''):
+          writer.write(chunk)
+      digest = writer.hexdigest()
+      blob = self._blob(digest, executable)
+      if not os.path.isfile(blob):
+        os.chmod(tmp, 0o555 if executable else 0o444)
+        _makedirs(os.path.dirname(blob))
+        _replace(tmp, blob)
+    finally:
+      if os.path.isfile(tmp):
+        os.remove(tmp)
+    return digest
+
+  def _move(self, filename, executable):
+    """
+    Moves *filename* into the store and returns the digest of its contents.
+    """
+
+    digest = hashing.file_digest(filename)
+    blob = self._blob(digest, executable)
+    if not os.path.isfile(blob):
+      _makedirs(os.path.dirname(blob))
+      try:
+        os.chmod(filename, 0o555 if executable else 0o444)
+        _replace(filename, blob)
+      except OSError as exc:
+        if exc.errno != errno.EXDEV:
+          raise
+        self._put(filename, executable)
+    return digest
+
+  def place(self, index, directory, strategy='auto'):
+    """
+    Places the files of the package *index* in *directory* using the
+    specified *strategy* (see #fileops.place()). Files that are copied or
+    cloned are made writable. Files that are only in a read-only store are
+    placed from there.
+
+    # Returns
+    A list of the placed files.
+    """
+
+    created = set()
+    result = []
+    for rel, digest, executable, __ in index:
+      dst = os.path.join(directory, *rel.split('/'))
+      parent = os.path.dirname(dst)
+      if parent not in created:
+        _makedirs(parent)
+        created.add(parent)
+      used = fileops.place(self._find_blob(digest, executable), dst, strategy)
+      if used in ('copy', 'reflink'):
+        os.chmod(dst, 0o755 if executable else 0o644)
+      result.append(dst)
+    return result
+
+
+def _makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as exc:
+    if exc.errno != errno.EEXIST:
+      raise
+
+
+def _replace(src, dst):
+  if os.name == 'nt' and os.path.exists(dst):
+    os.remove(dst)
+  os.rename(src, dst)
@@ -0,0 +1,264 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Helpers for the tar archives that nppm writes and reads as a stream, such
+as bundles and cache exports: compression by file extension, deterministic
+members and extraction with parallel writes.
+"""
+
+import contextlib
+import errno
+import gzip
+import os
+import shutil
+import stat
+import tarfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import pool from './pool'
+
+#: The compression of an archive by the extension of its filename.
+COMPRESSIONS = [('.tar.zst', 'zst'), ('.tzst', 'zst'), ('.tar.gz', 'gz'),
+  ('.tgz', 'gz'), ('.tar.xz', 'xz'), ('.txz', 'xz'), ('.tar', None)]
+
+# Files up to this size are read from the archive and handed to the threads
+# that write them, larger files are written while they are read.
+_BUFFERED_SIZE = 4 * 1024 * 1024
+
+
+def get_compression(filename):
+  """
+  Returns the compression for the archive *filename* (see #COMPRESSIONS).
+  Raises a #ValueError if the extension is not supported or if the module
+  for the compression is not available.
+  """
+
+  for ext, compression in COMPRESSIONS:
+    if filename.endswith(ext):
+      break
+  else:
+    raise ValueError('unsupported archive extension: "{}" (supported are {})'
+        .format(filename, ', '.join(x[0] for x in COMPRESSIONS)))
+  if compression == 'zst':
+    try:
+      import zstandard
+    except ImportError:
+      raise ValueError('.tar.zst archives require the "zstandard" module, '
+          'install it or use .tar.gz instead')
+  elif compression == 'xz':
+    try:
+      import lzma
+    except ImportError:
+      raise ValueError('.tar.xz archives require the "lzma" module, '
+          'use .tar.gz instead')
+  return compression
+
+
+@contextlib.contextmanager
+def open_compressed(filename, mode, compression):
+  """
+  Opens *filename* for reading (*mode* `r`) or writing (`w`) through the
+  *compression* (see #get_compression()) and yields the file-like object.
+  """
+
+  with open(filename, mode + 'b') as fp:
+    if compression == 'gz':
+      # The gzip header would contain the current time otherwise.
+      stream = gzip.GzipFile(filename='', mode=mode + 'b', fileobj=fp, mtime=0)
+    elif compression == 'xz':
+      import lzma
+      stream = lzma.LZMAFile(fp, mode)
+    elif compression == 'zst':
+      import zstandard
+      if mode == 'w':
+        stream = zstandard.ZstdCompressor(threads=-1).stream_writer(fp)
+      else:
+        stream = zstandard.ZstdDecompressor().stream_reader(fp)
+    else:
+      stream = fp
+    try:
+      yield stream
+    finally:
+      if stream is not fp:
+        stream.close()
+
+
+def walk(directory, paths=None, skip=None):
+  """
+  Yields the sorted relative paths (with forward slashes) of the files,
+  symlinks and directories in *directory*, or only of those in the relative
+  *paths* (directories) in it that exist. Files and directories for whose
+  name *skip* returns True are left out.
+  """
+
+  if paths is not None:
+    for path in paths:
+      if os.path.isdir(os.path.join(directory, path)):
+        path = path.replace(os.sep, '/')
+        yield path
+        for rel in walk(os.path.join(directory, path), skip=skip):
+          yield path + '/' + rel
+    return
+
+  skip = skip or (lambda name: False)
+  for root, dirs, files in os.walk(directory):
+    rel_root = os.path.relpath(root, directory).replace(os.sep, '/')
+    prefix = '' if rel_root == '.' else rel_root + '/'
+    links = [x for x in dirs if os.path.islink(os.path.join(root, x))]
+    dirs[:] = sorted(x for x in dirs if x not in links and not skip(x))
+    entries = [x for x in files + links if not skip(x)] + dirs
+    for name in sorted(entries):
+      yield prefix + name
+
+
+def tarinfo(name, type=tarfile.REGTYPE, mode=0o644, size=0, mtime=0):
+  """
+  Returns a #tarfile.TarInfo without an owner.
+  """
+
+  info = tarfile.TarInfo(name)
+  info.type = type
+  info.mode = mode
+  info.size = size
+  info.mtime = mtime
+  info.uid = info.gid = 0
+  info.uname = info.gname = ''
+  return info
+
+
+def add_files(archive, directory, rels, mtime=None):
+  """
+  Adds the files, symlinks and directories *rels* (relative to *directory*,
+  eg. from #walk()) to the tar *archive*. Permissions are normalized to
+  `0644` and `0755`. All members get the timestamp *mtime*, or keep their
+  own if it is #None.
+
+  Returns the number of files and symlinks that were added.
+  """
+
+  count = 0
+  for rel in rels:
+    path = os.path.join(directory, *rel.split('/'))
+    st = os.lstat(path)
+    member_mtime = int(st.st_mtime) if mtime is None else mtime
+    if stat.S_ISDIR(st.st_mode):
+      archive.addfile(tarinfo(rel, tarfile.DIRTYPE, 0o755, mtime=member_mtime))
+      continue
+    if stat.S_ISLNK(st.st_mode):
+      member = tarinfo(rel, tarfile.SYMTYPE, 0o777, mtime=member_mtime)
+      member.linkname = os.readlink(path)
+      archive.addfile(member)
+    else:
+      mode = 0o755 if st.st_mode & stat.S_IXUSR else 0o644
+      with open(path, 'rb') as fp:
+        archive.addfile(tarinfo(rel, mode=mode, size=st.st_size, mtime=member_mtime), fp)
+    count += 1
+  return count
+
+
+def extract(archive, members, directory, jobs=None, replace=True):
+  """
+  Extracts the *members* of the tar *archive*, which is read as a stream,
+  into *directory*. The members must have been checked to stay inside of
+  *directory*. Files are written from up to *jobs* threads while the
+  archive is read. Existing files are replaced, not written to, as they may
+  be hardlinks, or kept if *replace* is False.
+
+  Returns the number of files that were extracted.
+  """
+
+  if jobs is None:
+    jobs = pool.default_jobs()
+  workers = ThreadPool(jobs)
+  slots = threading.BoundedSemaphore(jobs * 4)
+  pending = []
+
+  def write(path, data, mode, mtime):
+    try:
+      _remove(path)
+      with open(path, 'wb') as fp:
+        fp.write(data)
+      os.chmod(path, mode)
+      os.utime(path, (mtime, mtime))
+    finally:
+      slots.release()
+
+  def wait():
+    for result in pending:
+      result.get()
+    del pending[:]
+
+  count = 0
+  created = set()
+  try:
+    for member in members:
+      path = os.path.join(directory, *member.name.split('/'))
+      if member.isdir():
+        if path not in created:
+          _makedirs(path)
+          created.add(path)
+        continue
+      if not replace and os.path.lexists(path):
+        continue
+      parent = os.path.dirname(path)
+      if parent not in created:
+        _makedirs(parent)
+        created.add(parent)
+      count += 1
+      if member.issym():
+        _remove(path)
+        os.symlink(member.linkname, path)
+      elif member.islnk():
+        wait()
+        _remove(path)
+        os.link(os.path.join(directory, *member.linkname.split('/')), path)
+      elif member.size <= _BUFFERED_SIZE:
+        data = archive.extractfile(member).read()
+        slots.acquire()
+        pending.append(workers.apply_async(write, (path, data, member.mode, member.mtime)))
+      else:
+        _remove(path)
+        with open(path, 'wb') as fp:
+          shutil.copyfileobj(archive.extractfile(member), fp, 1024 * 1024)
+        os.chmod(path, member.mode)
+        os.utime(path, (member.mtime, member.mtime))
+    wait()
+  finally:
+    workers.close()
+    workers.join()
+  return count
+
+
+def _makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as exc:
+    if exc.errno != errno.EEXIST:
+      raise
+
+
+def _remove(path):
+  if os.path.lexists(path) and not os.path.isdir(path):
+    os.remove(path)
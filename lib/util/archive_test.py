@@ -0,0 +1,78 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from nose.tools import *
+import os
+import shutil
+import tarfile
+import tempfile
+import archive from './archive'
+
+
+def test_get_compression():
+  assert_equals(archive.get_compression('a.tar.gz'), 'gz')
+  assert_equals(archive.get_compression('a.tgz'), 'gz')
+  assert_equals(archive.get_compression('a.tar'), None)
+  with assert_raises(ValueError):
+    archive.get_compression('a.zip')
+
+
+def test_roundtrip():
+  directory = tempfile.mkdtemp()
+  try:
+    src = os.path.join(directory, 'src')
+    os.makedirs(os.path.join(src, 'a', 'b'))
+    with open(os.path.join(src, 'a', 'b', 'file.txt'), 'w') as fp:
+      fp.write('content')
+    with open(os.path.join(src, 'a', 'skip.part'), 'w') as fp:
+      fp.write('partial')
+    os.symlink('b/file.txt', os.path.join(src, 'a', 'link.txt'))
+
+    rels = list(archive.walk(src, skip=lambda x: x.endswith('.part')))
+    assert_equals(rels, ['a', 'a/b', 'a/link.txt', 'a/b/file.txt'])
+
+    # The same files give the same archive.
+    results = []
+    for name in ('one.tar.gz', 'two.tar.gz'):
+      filename = os.path.join(directory, name)
+      with archive.open_compressed(filename, 'w', 'gz') as stream:
+        tar = tarfile.open(fileobj=stream, mode='w|')
+        assert_equals(archive.add_files(tar, src, rels, mtime=0), 2)
+        tar.close()
+      with open(filename, 'rb') as fp:
+        results.append(fp.read())
+    assert_equals(results[0], results[1])
+
+    dst = os.path.join(directory, 'dst')
+    os.makedirs(os.path.join(dst, 'a'))
+    with open(os.path.join(dst, 'a', 'link.txt'), 'w') as fp:
+      fp.write('kept')
+    with archive.open_compressed(filename, 'r', 'gz') as stream:
+      tar = tarfile.open(fileobj=stream, mode='r|')
+      assert_equals(archive.extract(tar, tar, dst, jobs=2, replace=False), 1)
+    with open(os.path.join(dst, 'a', 'b', 'file.txt')) as fp:
+      assert_equals(fp.read(), 'content')
+    with open(os.path.join(dst, 'a', 'link.txt')) as fp:
+      assert_equals(fp.read(), 'kept')
+    assert_equals(os.path.getmtime(os.path.join(dst, 'a', 'b', 'file.txt')), 0)
+  finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,158 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Primitives to place files: copy-on-write clones (reflinks), hardlinks,
+symlinks and copies that let the kernel move the data where possible.
+"""
+
+import errno
+import os
+import shutil
+import sys
+
+import pool from './pool'
+
+#: The strategies accepted by #place().
+STRATEGIES = ('auto', 'hardlink', 'reflink', 'symlink', 'copy')
+
+#: The order in which the `auto` strategy tries to place a file.
+AUTO_ORDER = ('hardlink', 'reflink', 'copy')
+
+# The FICLONE ioctl of Linux, `_IOW(0x94, 9, int)`.
+_FICLONE = 0x40049409
+_EOPNOTSUPP = getattr(errno, 'EOPNOTSUPP', errno.EINVAL)
+
+
+def reflink(src, dst):
+  """
+  Creates *dst* as a copy-on-write clone of *src*. Raises an #OSError if the
+  platform or filesystem does not support it (eg. `EXDEV`, `EOPNOTSUPP`).
+  """
+
+  if not sys.platform.startswith('linux'):
+    raise OSError(_EOPNOTSUPP, 'reflinks are not supported on this platform')
+  import fcntl
+  with open(src, 'rb') as sfp:
+    with open(dst, 'wb') as dfp:
+      try:
+        fcntl.ioctl(dfp.fileno(), _FICLONE, sfp.fileno())
+      except (IOError, OSError):
+        dfp.close()
+        os.remove(dst)
+        raise
+
+
+def copyfile(src, dst):
+  """
+  Copies the contents of *src* to *dst*. Uses `copy_file_range()` or
+  `sendfile()` where available, which avoids copying the data through user
+  space (and may create a reflink on filesystems that support it), and
+  falls back to #shutil.copyfile().
+  """
+
+  copy_file_range = getattr(os, 'copy_file_range', None)
+  sendfile = getattr(os, 'sendfile', None) if os.name == 'posix' else None
+  if not copy_file_range and not sendfile:
+    shutil.copyfile(src, dst)
+    return
+
+  with open(src, 'rb') as sfp:
+    size = os.fstat(sfp.fileno()).st_size
+    with open(dst, 'wb') as dfp:
+      offset = 0
+      try:
+        while offset < size:
+          if copy_file_range:
+            n = copy_file_range(sfp.fileno(), dfp.fileno(), size - offset)
+          else:
+            n = sendfile(dfp.fileno(), sfp.fileno(), offset, size - offset)
+          if n == 0:
+            break
+          offset += n
+      except OSError as exc:
+        if offset or exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+            _EOPNOTSUPP, errno.EBADF, errno.EPERM):
+          raise
+        offset = None
+  if offset is None:
+    shutil.copyfile(src, dst)
+
+
+def place(src, dst, strategy='copy'):
+  """
+  Places the file *src* at *dst* using the specified *strategy* (one of
+  #STRATEGIES). If a link can not be created, eg. because *src* and *dst*
+  are on different filesystems, the file is copied instead. Copies and
+  clones get the permission bits of *src*. *dst* must not exist.
+
+  Returns the strategy that was actually used.
+  """
+
+  if strategy == 'auto':
+    strategies = AUTO_ORDER
+  elif strategy == 'copy':
+    strategies = ('copy',)
+  elif strategy in STRATEGIES:
+    strategies = (strategy, 'copy')
+  else:
+    raise ValueError('unknown placement strategy: {!r}'.format(strategy))
+
+  for strategy in strategies:
+    try:
+      if strategy == 'hardlink':
+        os.link(src, dst)
+      elif strategy == 'reflink':
+        reflink(src, dst)
+        shutil.copymode(src, dst)
+      elif strategy == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+      else:
+        copyfile(src, dst)
+        shutil.copymode(src, dst)
+      return strategy
+    except (AttributeError, NotImplementedError):
+      continue  # os.link() or os.symlink() not available
+    except (IOError, OSError) as exc:
+      if strategy == 'copy' or exc.errno == errno.ENOENT:
+        raise
+  raise RuntimeError('unreachable')
+
+
+def copy_files(files, directory, strategy='copy', jobs=None):
+  """
+  Places the *files*, an iterable of `(abspath, relpath)` tuples (eg. from
+  #walk_package_files()), in *directory* with #place() from up to *jobs*
+  threads. Every directory is created only once, before any file is placed.
+  With the default *strategy*, #copyfile() lets the kernel copy the data
+  (which some filesystems implement as a clone).
+
+  # Returns
+  A list of the placed files.
+  """
+
+  pairs = [(src, os.path.join(directory, rel)) for src, rel in files]
+  for parent in sorted(set(os.path.dirname(dst) for __, dst in pairs)):
+    if not os.path.isdir(parent):
+      os.makedirs(parent)
+  pool.map_threaded(lambda x: place(x[0], x[1], strategy), pairs, jobs)
+  return [dst for __, dst in pairs]
@@ -0,0 +1,72 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import os
+import shutil
+import stat
+import tempfile
+import fileops from './fileops'
+
+
+def _tempdir():
+  directory = tempfile.mkdtemp()
+  with open(os.path.join(directory, 'src'), 'wb') as fp:
+    fp.write(b'hello world\n' * 1000)
+  os.chmod(os.path.join(directory, 'src'), 0o755)
+  return directory
+
+
+def test_copyfile():
+  directory = _tempdir()
+  try:
+    src, dst = os.path.join(directory, 'src'), os.path.join(directory, 'dst')
+    fileops.copyfile(src, dst)
+    with open(src, 'rb') as a, open(dst, 'rb') as b:
+      assert_equals(a.read(), b.read())
+  finally:
+    shutil.rmtree(directory)
+
+
+def test_place():
+  directory = _tempdir()
+  try:
+    src = os.path.join(directory, 'src')
+    for strategy in fileops.STRATEGIES:
+      dst = os.path.join(directory, strategy)
+      used = fileops.place(src, dst, strategy)
+      assert_in(used, fileops.STRATEGIES)
+      with open(dst, 'rb') as fp:
+        assert_equals(fp.read(), b'hello world\n' * 1000)
+      if used == 'hardlink':
+        assert_true(os.path.samefile(src, dst))
+      elif used == 'symlink':
+        assert_true(os.path.islink(dst))
+      elif used == 'copy':
+        assert_true(os.stat(dst).st_mode & stat.S_IXUSR)
+    assert_equals(fileops.place(src, os.path.join(directory, 'copy2'), 'copy'), 'copy')
+    assert_raises(ValueError, fileops.place, src, os.path.join(directory, 'x'), 'foo')
+    assert_raises(OSError, fileops.place, os.path.join(directory, 'missing'),
+        os.path.join(directory, 'y'), 'hardlink')
+  finally:
+    shutil.rmtree(directory)
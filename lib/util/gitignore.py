@@ -0,0 +1,237 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Matches paths against lists of patterns with the semantics of `.gitignore`
+files: later patterns override earlier ones, `!` negates a pattern, a
+trailing `/` matches directories only, a pattern that contains a `/` is
+anchored to the root directory, and `**` matches across directories. The
+patterns are compiled to regular expressions once.
+"""
+
+import os
+import re
+
+try:
+  _scandir = os.scandir
+except AttributeError:
+  _scandir = None
+
+
+class Pattern(object):
+  """
+  A single compiled pattern. Use #Pattern.parse() to create an instance
+  from a line in a `.gitignore` file.
+  """
+
+  def __init__(self, pattern, regex, negated=False, dir_only=False):
+    self.pattern = pattern
+    self.regex = regex
+    self.negated = negated
+    self.dir_only = dir_only
+
+  def __repr__(self):
+    return 'Pattern({!r})'.format(self.pattern)
+
+  @classmethod
+  def parse(cls, line):
+    """
+    Parses a pattern. Returns #None for empty lines and comments.
+    """
+
+    pattern = line.rstrip('\n')
+    if not pattern.endswith('\\ '):
+      pattern = pattern.rstrip()
+    if not pattern or pattern.startswith('#'):
+      return None
+    negated = pattern.startswith('!')
+    if negated:
+      pattern = pattern[1:]
+    elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+      pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+      return None
+    anchored = '/' in pattern
+    regex = translate(pattern.lstrip('/'))
+    if not anchored:
+      regex = '(?:.*/)?' + regex
+    return cls(line.strip(), re.compile(regex + r'\Z', re.S), negated, dir_only)
+
+  def match(self, path, is_dir=False):
+    if self.dir_only and not is_dir:
+      return False
+    return self.regex.match(path) is not None
+
+
+def translate(pattern):
+  """
+  Translates a glob *pattern* to a regular expression. `*` and `?` do not
+  match a `/`, `**` does.
+  """
+
+  result = []
+  i, n = 0, len(pattern)
+  while i < n:
+    char = pattern[i]
+    if pattern.startswith('**', i):
+      at_start = i == 0 or pattern[i - 1] == '/'
+      if at_start and pattern.startswith('**/', i):
+        result.append('(?:.*/)?')
+        i += 3
+        continue
+      result.append('.*')
+      i += 2
+      continue
+    elif char == '*':
+      result.append('[^/]*')
+    elif char == '?':
+      result.append('[^/]')
+    elif char == '[':
+      start = i + 1
+      if pattern[start:start + 1] in ('!', '^'):
+        start += 1
+      if pattern[start:start + 1] == ']':
+        start += 1
+      end = pattern.find(']', start)
+      if end < 0:
+        result.append(re.escape(char))
+      else:
+        body = pattern[i + 1:end]
+        if body[:1] in ('!', '^'):
+          body = '^' + body[1:]
+        result.append('[' + body.replace('\\', '\\\\') + ']')
+        i = end
+    elif char == '\\' and i + 1 < n:
+      i += 1
+      result.append(re.escape(pattern[i]))
+    else:
+      result.append(re.escape(char))
+    i += 1
+  return ''.join(result)
+
+
+class PatternList(object):
+  """
+  A list of #Pattern#s. If none of the patterns is negated, all of them are
+  combined into a single regular expression.
+  """
+
+  def __init__(self, patterns=()):
+    self.patterns = []
+    for pattern in patterns:
+      if not isinstance(pattern, Pattern):
+        pattern = Pattern.parse(pattern)
+      if pattern is not None:
+        self.patterns.append(pattern)
+    self._files = self._dirs = None
+    if not any(p.negated for p in self.patterns):
+      self._files = self._combine(p for p in self.patterns if not p.dir_only)
+      self._dirs = self._combine(self.patterns)
+
+  @staticmethod
+  def _combine(patterns):
+    regexes = ['(?:' + p.regex.pattern + ')' for p in patterns]
+    return re.compile('|'.join(regexes), re.S) if regexes else None
+
+  def __len__(self):
+    return len(self.patterns)
+
+  def match(self, path, is_dir=False):
+    """
+    Matches *path* (relative to the root directory) against the patterns.
+    Returns True if the last matching pattern is a positive pattern, False
+    if it is negated and #None if no pattern matches. Parent directories of
+    *path* are not taken into account, see #match_path().
+    """
+
+    path = path.replace(os.sep, '/')
+    if self._files is not None or not self.patterns:
+      regex = self._dirs if is_dir else self._files
+      return True if regex is not None and regex.match(path) else None
+    for pattern in reversed(self.patterns):
+      if pattern.match(path, is_dir):
+        return not pattern.negated
+    return None
+
+  def match_path(self, path, is_dir=False, include=False):
+    """
+    Checks *path* and its parent directories. With *include* set to False,
+    returns True if *path* or one of its parents is excluded, like Git does
+    (a file in an excluded directory can not be re-included). With
+    *include*, returns True if the innermost of *path* and its parents
+    that matches a pattern matches a positive pattern.
+    """
+
+    parts = path.replace(os.sep, '/').split('/')
+    state = False
+    for i in range(1, len(parts) + 1):
+      result = self.match('/'.join(parts[:i]), is_dir or i < len(parts))
+      if result is not None:
+        state = result
+        if state and not include:
+          break
+    return state
+
+  def walk(self, directory, include=False):
+    """
+    Yields `(abspath, relpath)` for the files in *directory* according to
+    #match_path(). With *include* set to False, excluded directories are not
+    entered. Symbolic links to directories are not followed.
+    """
+
+    def recurse(path, prefix, state):
+      for name, is_dir, is_link in _listdir(path):
+        rel = prefix + name
+        result = self.match(rel, is_dir)
+        if not include and result:
+          continue
+        sub_state = state if result is None else result
+        if is_dir:
+          if not is_link:
+            for item in recurse(os.path.join(path, name), rel + '/', sub_state):
+              yield item
+        elif sub_state == include:
+          yield os.path.join(path, name), rel.replace('/', os.sep)
+
+    return recurse(directory, '', False)
+
+
+def _listdir(path):
+  """
+  Returns a list of `(name, is_dir, is_link)` for the entries in *path*.
+  """
+
+  if _scandir is not None:
+    it = _scandir(path)
+    try:
+      return [(e.name, e.is_dir(), e.is_symlink()) for e in it]
+    finally:
+      if hasattr(it, 'close'):
+        it.close()
+  result = []
+  for name in os.listdir(path):
+    filename = os.path.join(path, name)
+    result.append((name, os.path.isdir(filename), os.path.islink(filename)))
+  return result
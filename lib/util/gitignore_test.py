@@ -0,0 +1,92 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import os
+import shutil
+import tempfile
+import { Pattern, PatternList } from './gitignore'
+
+
+def test_pattern():
+  assert_equals(Pattern.parse('# comment'), None)
+  assert_equals(Pattern.parse('   '), None)
+  assert_true(Pattern.parse('*.pyc').match('a/b/c.pyc'))
+  assert_false(Pattern.parse('*.pyc').match('a/b/c.py'))
+  assert_true(Pattern.parse('build/').match('a/build', is_dir=True))
+  assert_false(Pattern.parse('build/').match('a/build'))
+  assert_true(Pattern.parse('/build').match('build'))
+  assert_false(Pattern.parse('/build').match('a/build'))
+  assert_true(Pattern.parse('doc/*.md').match('doc/a.md'))
+  assert_false(Pattern.parse('doc/*.md').match('doc/sub/a.md'))
+  assert_false(Pattern.parse('doc/*.md').match('x/doc/a.md'))
+  assert_true(Pattern.parse('**/logs').match('logs'))
+  assert_true(Pattern.parse('**/logs').match('a/b/logs'))
+  assert_true(Pattern.parse('a/**/b').match('a/b'))
+  assert_true(Pattern.parse('a/**/b').match('a/x/y/b'))
+  assert_true(Pattern.parse('a/**').match('a/x/y'))
+  assert_true(Pattern.parse('file[0-9].txt').match('file1.txt'))
+  assert_false(Pattern.parse('file[!0-9].txt').match('file1.txt'))
+  assert_true(Pattern.parse('\\#notacomment').match('#notacomment'))
+  assert_true(Pattern.parse('!keep').negated)
+
+
+def test_pattern_list():
+  patterns = PatternList(['*.log', '!important.log', 'tmp/'])
+  assert_equals(patterns.match('a.log'), True)
+  assert_equals(patterns.match('x/important.log'), False)
+  assert_equals(patterns.match('a.py'), None)
+  assert_true(patterns.match_path('tmp/important.log'))
+  assert_false(patterns.match_path('src/important.log'))
+
+  patterns = PatternList(['*.pyc', '.git*', 'dist/*'])
+  assert_true(patterns.match('dist/x.tar.gz'))
+  assert_true(patterns.match('.git', is_dir=True))
+  assert_true(patterns.match_path('.git/objects/pack/x'))
+  assert_equals(patterns.match('lib/a.py'), None)
+
+  patterns = PatternList(['lib/', '!lib/tests/'])
+  assert_true(patterns.match_path('lib/a.py', include=True))
+  assert_false(patterns.match_path('lib/tests/a.py', include=True))
+  assert_false(patterns.match_path('README.md', include=True))
+
+
+def test_walk():
+  directory = tempfile.mkdtemp()
+  try:
+    for rel in ['a.py', 'a.pyc', 'lib/b.py', 'lib/tests/c.py', 'node/x.py', '.git/HEAD']:
+      filename = os.path.join(directory, *rel.split('/'))
+      if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      open(filename, 'w').close()
+
+    def walk(patterns, include=False):
+      return sorted(rel.replace(os.sep, '/') for __, rel in
+          PatternList(patterns).walk(directory, include))
+
+    assert_equals(walk(['*.pyc', '.git/', 'node']), ['a.py', 'lib/b.py', 'lib/tests/c.py'])
+    assert_equals(walk(['*.py', '!lib/*.py']), ['.git/HEAD', 'a.pyc', 'lib/b.py'])
+    assert_equals(walk(['lib/', '!tests/'], True), ['lib/b.py'])
+    assert_equals(walk(['*.py'], True), ['a.py', 'lib/b.py', 'lib/tests/c.py', 'node/x.py'])
+  finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import mmap
+import os
+
+#: Files of at least this size are memory-mapped by #file_digest().
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+
+def file_digest(filename, algorithm='sha256', chunk_size=1024 * 1024):
+  """
+  Returns the hex digest of the contents of *filename*. Files larger than
+  #MMAP_THRESHOLD are memory-mapped and hashed without copying them into
+  Python buffers.
+  """
+
+  hasher = hashlib.new(algorithm)
+  with open(filename, 'rb') as fp:
+    size = os.fstat(fp.fileno()).st_size
+    if size >= MMAP_THRESHOLD:
+      try:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+      except (EnvironmentError, ValueError):
+        mapped = None
+      if mapped is not None:
+        try:
+          hasher.update(mapped)
+        finally:
+          mapped.close()
+        return hasher.hexdigest()
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+      hasher.update(chunk)
+  return hasher.hexdigest()
+
+
+class HashingWriter(object):
+  """
+  Wraps a writable file-like object and hashes everything that is written
+  to it.
+  """
+
+  def __init__(self, fp, algorithm='sha256'):
+    self.fp = fp
+    self.hasher = hashlib.new(algorithm)
+
+  def write(self, data):
+    self.hasher.update(data)
+    return self.fp.write(data)
+
+  def hexdigest(self):
+    return self.hasher.hexdigest()
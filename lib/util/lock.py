@@ -0,0 +1,140 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Cross-process file locks. The locks are advisory and held on a separate
+lock file, which is never removed since that would allow two processes to
+lock different files of the same name.
+"""
+
+from __future__ import print_function
+
+import errno
+import os
+import time
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+  import msvcrt
+
+
+class FileLock(object):
+  """
+  An exclusive lock on the file *filename*, which is created if it does
+  not exist. Every instance opens the file separately, thus the lock also
+  excludes other threads of the same process, but it is not reentrant.
+
+  After the lock was acquired, #waited is the number of seconds that were
+  spent waiting for it.
+  """
+
+  def __init__(self, filename, message=None):
+    self.filename = filename
+    self.message = message
+    self.waited = 0.0
+    self._fp = None
+
+  def __repr__(self):
+    return 'FileLock({!r})'.format(self.filename)
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, *args):
+    self.release()
+
+  def acquire(self):
+    """
+    Acquires the lock, waiting for other processes or threads to release it.
+    If the lock is held by someone else, the *message* (if specified) is
+    printed before waiting. Returns #waited.
+    """
+
+    assert self._fp is None, 'lock is already acquired'
+    directory = os.path.dirname(self.filename)
+    if directory and not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError as exc:
+        if exc.errno != errno.EEXIST:
+          raise
+    fp = open(self.filename, 'a+')
+    try:
+      start = time.time()
+      if not _try_lock(fp):
+        if self.message:
+          print(self.message)
+        _lock(fp)
+      self.waited = time.time() - start
+    except:
+      fp.close()
+      raise
+    self._fp = fp
+    return self.waited
+
+  def release(self):
+    fp, self._fp = self._fp, None
+    if fp is not None:
+      try:
+        _unlock(fp)
+      finally:
+        fp.close()
+
+
+if fcntl is not None:
+
+  def _try_lock(fp):
+    try:
+      fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as exc:
+      if exc.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+        raise
+      return False
+    return True
+
+  def _lock(fp):
+    fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+
+  def _unlock(fp):
+    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+else:
+
+  def _try_lock(fp):
+    fp.seek(0)
+    try:
+      msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+    except (IOError, OSError):
+      return False
+    return True
+
+  def _lock(fp):
+    while not _try_lock(fp):
+      time.sleep(0.05)
+
+  def _unlock(fp):
+    fp.seek(0)
+    msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,55 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import os
+import shutil
+import tempfile
+import threading
+import time
+import { FileLock } from './lock'
+
+
+def test_file_lock():
+  directory = tempfile.mkdtemp()
+  try:
+    filename = os.path.join(directory, 'sub', 'test.lock')
+    events = []
+    lock = FileLock(filename)
+    assert_equals(lock.acquire(), lock.waited)
+    assert_true(os.path.isfile(filename))
+
+    def other():
+      with FileLock(filename) as other_lock:
+        events.append(('acquired', other_lock.waited))
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    time.sleep(0.2)
+    assert_equals(events, [])
+    lock.release()
+    thread.join()
+    assert_equals(len(events), 1)
+    assert_true(events[0][1] >= 0.1)
+  finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,70 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Helpers to distribute independent pieces of work over a pool of threads.
+Most of the work that nppm parallelizes is bound by the filesystem or the
+network, thus threads are sufficient and work the same on Python 2 and 3.
+"""
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+
+def cpu_count():
+  """
+  Returns the number of CPUs, or 1 if it can not be determined.
+  """
+
+  try:
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return 1
+
+
+def default_jobs():
+  """
+  Returns the default number of worker threads for I/O bound work.
+  """
+
+  return min(32, cpu_count() + 4)
+
+
+def map_threaded(func, items, jobs=None):
+  """
+  Applies *func* to every element in *items* using up to *jobs* threads and
+  returns a list of the results in the same order as *items*. If *jobs* is
+  1 or there is at most one item, no threads are started.
+  """
+
+  items = list(items)
+  if jobs is None:
+    jobs = default_jobs()
+  jobs = min(jobs, len(items))
+  if jobs <= 1:
+    return [func(x) for x in items]
+  pool = ThreadPool(jobs)
+  try:
+    return pool.map(func, items)
+  finally:
+    pool.close()
+    pool.join()
@@ -0,0 +1,118 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Implements `nppm verify`, which checks the installed packages against their
+#record.InstalledFiles records and reports files that were modified, that
+are missing or that were added since the packages were installed. With
+`--deps`, it also checks that the dependencies of the installed packages
+are satisfied, using a #depgraph.DependencyGraph of the whole tree.
+"""
+
+from __future__ import print_function
+
+import os
+
+import { store_entries, walk_modules } from './dedupe'
+import _depgraph from './depgraph'
+import env from './env'
+import _record from './record'
+import pool from './util/pool'
+
+
+def find_packages(installer):
+  """
+  Returns a list of `(name, directory)` for all package directories in the
+  packages directory of the #Installer, including internal dependencies and
+  the packages in the store.
+  """
+
+  result = [(name, directory) for name, directory, __ in
+            walk_modules(installer.dirs['packages'])]
+  store = installer.store_directory
+  for entry in store_entries(store):
+    name = os.path.relpath(entry, store).replace(os.sep, '/').rpartition('@')[0]
+    result.append((name, entry))
+    result.extend((name, directory) for name, directory, __ in
+                  walk_modules(os.path.join(entry, env.MODULES_DIRECTORY)))
+  return result
+
+
+def verify(installer, jobs=None, fast=False):
+  """
+  Verifies the packages in the packages directory of the #Installer. The
+  recorded files of all packages are checked from up to *jobs* threads
+  (see #record.InstalledFiles.status() for *fast*). Prints a report of the
+  modified, missing and extra files per package.
+
+  # Returns
+  A tuple of the number of packages that were verified, that have no
+  record, and that do not match their record.
+  """
+
+  packages = []
+  unrecorded = 0
+  for name, directory in find_packages(installer):
+    record = _record.InstalledFiles.load(directory)
+    if record is None:
+      print('Warning: "{}" in "{}" has no record of its files'.format(name, directory))
+      unrecorded += 1
+    else:
+      packages.append((name, directory, record))
+
+  tasks = [(directory, record, rel) for __, directory, record in packages
+           for rel in record.files]
+  results = pool.map_threaded(lambda x: x[1].status(x[0], x[2], fast), tasks, jobs)
+  status = dict(((x[0], x[2]), result) for x, result in zip(tasks, results))
+
+  failed = 0
+  for name, directory, record in packages:
+    modified = [rel for rel in record.files if status[(directory, rel)] == 'modified']
+    missing = [rel for rel in record.files if status[(directory, rel)] == 'missing']
+    extra = record.extra_files(directory)
+    if not (modified or missing or extra):
+      continue
+    failed += 1
+    print('"{}" in "{}":'.format(name, directory))
+    for label, files in (('modified', modified), ('missing', missing), ('extra', extra)):
+      for rel in files:
+        print('  {}: {}'.format(label, rel))
+  return len(packages), unrecorded, failed
+
+
+def verify_dependencies(installer):
+  """
+  Checks that the dependencies of the packages in the packages directory of
+  the #Installer are installed in versions that satisfy their requirements
+  (see #depgraph.check()) and prints the ones that are not.
+
+  Returns the number of unsatisfied dependencies.
+  """
+
+  problems = _depgraph.check(installer.dirs['packages'])
+  for directory, name, req, version in problems:
+    if version is None:
+      print('"{}" requires "{}@{}", which is not installed'.format(directory, name, req))
+    else:
+      print('"{}" requires "{}@{}", have "{}" installed'.format(directory, name, req, version))
+  return len(problems)
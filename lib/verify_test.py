@@ -0,0 +1,64 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from nose.tools import *
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import _install from './install'
+import _verify from './verify'
+import { PACKAGE_MANIFEST } from './env'
+
+
+def test_verify_git_install():
+  directory = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  try:
+    # A repository with a file that is excluded from the package.
+    repo = os.path.join(directory, 'repo')
+    os.makedirs(os.path.join(repo, 'docs'))
+    with open(os.path.join(repo, PACKAGE_MANIFEST), 'w') as fp:
+      json.dump({'name': 'gitpkg', 'version': '1.0.0', 'exclude': ['docs/']}, fp)
+    for rel in ('index.py', 'docs/index.md'):
+      with open(os.path.join(repo, *rel.split('/')), 'w') as fp:
+        fp.write('# {}\n'.format(rel))
+    git = ['git', '-c', 'user.name=nppm', '-c', 'user.email=nppm@localhost']
+    subprocess.check_call(['git', 'init', '-q', repo])
+    subprocess.check_call(git + ['-C', repo, 'add', '.'])
+    subprocess.check_call(git + ['-C', repo, 'commit', '-q', '-m', 'initial'])
+
+    project = os.path.join(directory, 'project')
+    os.makedirs(project)
+    os.chdir(project)
+    installer = _install.Installer()
+    success, __ = installer.install_from_git(repo)
+    assert_true(success)
+    package_dir = os.path.join(installer.dirs['packages'], 'gitpkg')
+    assert_false(os.path.exists(os.path.join(package_dir, '.git')))
+    assert_false(os.path.exists(os.path.join(package_dir, 'docs')))
+    assert_equals(_verify.verify(installer), (1, 0, 0))
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,109 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Compares copying the files of a synthetic package with 10k small files the
+way `install_from_directory()` used to (one `_makedirs()` and
+#shutil.copyfile() per file) with #fileops.copy_files().
+
+    $ nodepy scripts/benchmark-copy.py [--files 10000] [--jobs 8]
+"""
+
+from __future__ import print_function
+
+if require.main != module:
+  raise RuntimeError('must not be required')
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import fileops from '../lib/util/fileops'
+import pool from '../lib/util/pool'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--files', type=int, default=10000,
+  help='Number of files in the package. Default: %(default)s')
+parser.add_argument('--jobs', type=int, default=pool.default_jobs(),
+  help='Number of threads for copy_files(). Default: %(default)s')
+parser.add_argument('--dir', help='Directory to create the files in. Default: '
+  'a temporary directory')
+parser.add_argument('--seed', type=int, default=42)
+
+
+def generate(directory, count, seed):
+  """
+  Creates *count* files of 100 bytes to 16 KiB in a tree of directories with
+  up to 100 files each and returns the `(abspath, relpath)` tuples.
+  """
+
+  rng = random.Random(seed)
+  files = []
+  for i in range(count):
+    rel = os.path.join('pkg{}'.format(i // 1000), 'mod{}'.format(i // 100 % 10), 'file{}.py'.format(i))
+    filename = os.path.join(directory, rel)
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    with open(filename, 'wb') as fp:
+      fp.write(b'#' * rng.randint(100, 16 * 1024))
+    files.append((filename, rel))
+  return files
+
+
+def copy_serial(files, target_dir):
+  for src, rel in files:
+    dst = os.path.join(target_dir, rel)
+    if not os.path.isdir(os.path.dirname(dst)):
+      os.makedirs(os.path.dirname(dst))
+    shutil.copyfile(src, dst)
+
+
+def measure(name, func, *args):
+  start = time.time()
+  func(*args)
+  print('  {:<32} {:.3f}s'.format(name, time.time() - start))
+
+
+def main():
+  args = parser.parse_args()
+  directory = tempfile.mkdtemp(dir=args.dir)
+  try:
+    files = generate(os.path.join(directory, 'src'), args.files, args.seed)
+    print('{} files'.format(len(files)))
+    measure('serial shutil.copyfile', copy_serial, files, os.path.join(directory, 'a'))
+    measure('copy_files (copy, 1 job)', fileops.copy_files, files,
+        os.path.join(directory, 'b'), 'copy', 1)
+    measure('copy_files (copy, {} jobs)'.format(args.jobs), fileops.copy_files, files,
+        os.path.join(directory, 'c'), 'copy', args.jobs)
+    measure('copy_files (reflink, {} jobs)'.format(args.jobs), fileops.copy_files, files,
+        os.path.join(directory, 'd'), 'reflink', args.jobs)
+    measure('copy_files (hardlink, {} jobs)'.format(args.jobs), fileops.copy_files, files,
+        os.path.join(directory, 'e'), 'hardlink', args.jobs)
+  finally:
+    shutil.rmtree(directory)
+
+
+main()
@@ -0,0 +1,147 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2017-2018 Niklas Rosenstein
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measures the memory use and traversal speed of #depgraph.DependencyGraph
+for synthetic trees of 1k, 10k and 100k packages, compared to keeping a
+manifest dictionary and a #manifest.Requirement per package and edge.
+
+    $ nodepy scripts/benchmark-depgraph.py [--sizes 1000,10000] [--edges 4]
+"""
+
+from __future__ import print_function
+
+if require.main != module:
+  raise RuntimeError('must not be required')
+
+import argparse
+import collections
+import random
+import time
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+import { GraphBuilder } from '../lib/depgraph'
+import manifest from '../lib/manifest'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', default='1000,10000,100000',
+  help='Comma separated list of graph sizes. Default: %(default)s')
+parser.add_argument('--edges', type=int, default=4,
+  help='Maximum number of dependencies per package. Default: %(default)s')
+parser.add_argument('--seed', type=int, default=42)
+
+
+def generate(size, edges, seed):
+  """
+  Generates a list of `(name, version, dependency indices)`. Packages only
+  depend on packages with a lower index, like in a real tree.
+  """
+
+  rng = random.Random(seed)
+  packages = []
+  for i in range(size):
+    deps = sorted(set(rng.randrange(i) for __ in range(rng.randint(0, edges)))) if i else []
+    packages.append(('package-{}'.format(i), '{}.{}.{}'.format(i % 7, i % 13, i % 5), deps))
+  return packages
+
+
+def build_graph(packages):
+  builder = GraphBuilder()
+  for name, version, __ in packages:
+    builder.add_node(name, version)
+  for node, (__, __, deps) in enumerate(packages):
+    for dep in deps:
+      builder.add_edge(node, dep)
+  return builder.build()
+
+
+def build_manifests(packages):
+  result = {}
+  for name, version, deps in packages:
+    data = collections.OrderedDict([('name', name), ('version', version)])
+    data['dependencies'] = collections.OrderedDict(
+        (packages[dep][0], manifest.Requirement.from_line('~' + packages[dep][1], name=packages[dep][0]))
+        for dep in deps)
+    result[name] = data
+  return result
+
+
+def measure(func, *args):
+  """
+  Calls *func* once for timing and, if #tracemalloc is available, a second
+  time to measure the memory held by its result (tracing slows down the
+  allocations considerably).
+  """
+
+  start = time.time()
+  result = func(*args)
+  duration = time.time() - start
+  memory = None
+  if tracemalloc:
+    del result
+    tracemalloc.start()
+    result = func(*args)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+  return result, duration, memory
+
+
+def fmt_memory(memory):
+  return '{:.1f} MiB'.format(memory / 1024.0 / 1024.0) if memory is not None else 'n/a'
+
+
+def main():
+  args = parser.parse_args()
+  for size in map(int, args.sizes.split(',')):
+    packages = generate(size, args.edges, args.seed)
+    graph, build_time, graph_memory = measure(build_graph, packages)
+    __, manifests_time, manifests_memory = measure(build_manifests, packages)
+    edges = len(graph.targets)
+
+    start = time.time()
+    order = graph.topological_order()
+    topo_time = time.time() - start
+    assert len(order) == size
+
+    start = time.time()
+    for node in range(size):
+      graph.dependents(node)
+    reverse_time = time.time() - start
+
+    start = time.time()
+    sub = graph.subgraph([size - 1])
+    subgraph_time = time.time() - start
+
+    print('{} packages, {} edges'.format(size, edges))
+    print('  graph:      build {:.3f}s, {} ({} bytes in arrays)'.format(
+        build_time, fmt_memory(graph_memory), graph.nbytes()))
+    print('  manifests:  build {:.3f}s, {}'.format(manifests_time, fmt_memory(manifests_memory)))
+    print('  topological order {:.3f}s'.format(topo_time))
+    print('  reverse dependencies of all packages {:.3f}s'.format(reverse_time))
+    print('  subgraph of the last package ({} packages) {:.3f}s'.format(len(sub), subgraph_time))
+
+
+main()